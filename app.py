@@ -8,98 +8,214 @@ Key features:
 - Category and event management
 """
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_file, url_for, g, Response
 import os
-import cv2
-import re
 import json
 from datetime import datetime
 from pathlib import Path
 import shutil
+import threading
+import time
+import cProfile
+import gzip
+import zlib
 from werkzeug.utils import secure_filename
-from copy import deepcopy
+from app.services.upload_service import UploadService, UploadError
+from app.services.video_index_service import VideoIndexService
+from app.services.video_store_service import VideoStoreService
+from app.services.file_utils import file_lock, atomic_write_json
+from app.services.category_registry_service import CategoryRegistry
+from app.services.video_metadata_service import VideoMetadataService
+from app.services.thumbnail_service import ThumbnailService
+from app.services.proxy_service import ProxyService
+from app.services.label_export_service import LabelExportService, EXPORT_FORMATS
+from app.services.import_service import add_seconds
+from app.services.search_index_service import SearchIndex
+from app.services.batch_service import group_batch_operations, plan_video_operations
+from app.services.sync_service import SyncHub
+from app.services.agreement_service import video_agreement, video_report, pooled_report
+from app import factory_settings, serving_pool
+from config.config import Config
+from app.services.metrics_service import metrics, REQUEST_SECONDS
+from app.services.annotation_service import (
+    create_annotation_service, validate_operation
+)
 
 app = Flask(__name__)
-# Configure upload limits and directories
-app.config['UPLOAD_FOLDER'] = 'uploads'  # Where videos are stored
-app.config['ANNOTATIONS_FOLDER'] = 'annotations'  # Where annotation data is stored
-app.config['EVENT_TYPES_FILE'] = 'config/annotation_types.json'  # Event configuration
-app.config['CATEGORIES_FOLDER'] = 'categories'  # Category-specific data
-app.config['MAX_CONTENT_LENGTH'] = 2 * 1000 * 1024 * 1024  # 500MB max file size
-
-# Create necessary directories
-for directory in ['uploads', 'annotations', 'categories', 'config']:
-    os.makedirs(directory, exist_ok=True)
-
-def reprocess_raw_annotations(raw_annotations_list):
-    """
-    Converts a list of raw 'start' and 'end' annotations into a list of
-    'complete' (paired) annotations and unpaired 'start' annotations.
-    Relies on 'start' annotations having a unique 'id' and 'end' annotations
-    having a 'startAnnotationId' linking to that unique 'id'.
-    """
-    processed_annotations = []
-    # Stores start annotations keyed by their unique 'id'
-    active_start_points_by_unique_id = {}
-
-    for ann_data in raw_annotations_list:
-        ann_type = ann_data.get('type')
-        
-        if ann_type == 'start':
-            unique_start_id = ann_data.get('id')
-            if unique_start_id:
-                # Store a deepcopy to avoid modifying the original list if it's used elsewhere
-                active_start_points_by_unique_id[unique_start_id] = deepcopy(ann_data)
-            else:
-                # This should ideally not happen if frontend ensures 'id' for start annotations
-                print(f"Warning: Encountered 'start' annotation missing a unique 'id': {ann_data}")
-                processed_annotations.append(deepcopy(ann_data)) # Add as is, or decide to skip
-        elif ann_type == 'end':
-            linked_start_id = ann_data.get('startAnnotationId')
-            if linked_start_id and linked_start_id in active_start_points_by_unique_id:
-                start_ann_instance = active_start_points_by_unique_id.pop(linked_start_id) # Paired, so remove
-                
-                # Create the 'complete' annotation based on the start annotation's data
-                complete_ann = deepcopy(start_ann_instance)
-                
-                start_time = start_ann_instance.get('time')
-                end_time = ann_data.get('time') # Time from the current 'end' annotation
-                
-                complete_ann.update({
-                    'startTime': start_time,
-                    'endTime': end_time,
-                    'duration': (end_time - start_time) if start_time is not None and end_time is not None else 0,
-                    'type': 'complete',
-                    # 'time' field for 'complete' is typically the startTime
-                })
-                # Remove fields specific to start/end individual points if not needed for 'complete'
-                complete_ann.pop('id', None) # Original unique id of the start point
-                complete_ann.pop('startAnnotationId', None) # Not relevant for complete
-
-                processed_annotations.append(complete_ann)
-            else:
-                # Orphaned end annotation (no matching start found or start already paired)
-                print(f"Warning: Orphaned 'end' annotation or missing start pair for startAnnotationId '{linked_start_id}': {ann_data}")
-                processed_annotations.append(deepcopy(ann_data)) # Add as is, or decide to skip
-        else:
-            # Annotations that are neither 'start' nor 'end' (e.g., already 'complete' if input can have them)
-            # Or a 'start' annotation that was missing its 'id' and added above.
-            processed_annotations.append(deepcopy(ann_data))
+# Upload limits, data folders and the other settings (config/config.py)
+app.config.from_object(Config)
+# Settings passed to create_app (app/__init__.py) override the defaults above
+app.config.update(factory_settings())
+
+video_store = VideoStoreService(app.config['VIDEO_STORE_FOLDER'], app.config['CATEGORIES_FOLDER'], app.config['LOCKS_FOLDER'])
+upload_service = UploadService(video_store)
+video_index = VideoIndexService(
+    app.config['UPLOAD_FOLDER'], app.config['CATEGORIES_FOLDER'], video_store,
+    rescan_interval=app.config['VIDEO_INDEX_RESCAN_SECONDS']
+)
+annotation_service = create_annotation_service(app.config)
+category_registry = CategoryRegistry(app.config['EVENT_TYPES_FILE'])
+video_metadata = VideoMetadataService(
+    app.config['VIDEO_METADATA_FOLDER'], app.config['VIDEO_PROBE_WORKERS'], store_folder=app.config['VIDEO_STORE_FOLDER']
+)
+thumbnails = ThumbnailService(
+    app.config['THUMBNAIL_FOLDER'],
+    workers=app.config['THUMBNAIL_WORKERS'],
+    interval=app.config['THUMBNAIL_INTERVAL'],
+    tile_width=app.config['THUMBNAIL_WIDTH'],
+    columns=app.config['THUMBNAIL_COLUMNS'],
+    rows=app.config['THUMBNAIL_ROWS']
+)
+proxies = ProxyService(
+    app.config['VIDEO_PROXY_FOLDER'],
+    workers=app.config['VIDEO_PROXY_WORKERS'],
+    height=app.config['VIDEO_PROXY_HEIGHT'],
+    keyframe_interval=app.config['VIDEO_PROXY_KEYFRAME_INTERVAL'],
+    enabled=app.config['VIDEO_PROXY_ENABLED']
+)
+label_exports = LabelExportService(app.config['LABEL_EXPORT_FOLDER'], app.config['LABEL_EXPORT_MEMMAP_CELLS'])
+
+def list_annotated_videos():
+    with app.app_context():
+        return annotation_service.videos()
+
+def load_searchable_video(category_id, filename):
+    """(video name, processed annotations) of a video for the search index, or None"""
+    with app.app_context():
+        data = annotation_service.load(category_id, filename)
+        if data is None:
+            return None
+        return data.get('video_name') or filename, annotation_service.load_processed(category_id, filename)
+
+search_index = SearchIndex(list_annotated_videos, load_searchable_video)
+
+
+def start_services():
+    """
+    Create the data folders and start the background work (indexing every
+    annotated video; searches wait for it to finish). Importing this module
+    has no side effects: create_app and ``python app.py`` call this.
+    """
+    for folder in [app.config['UPLOAD_FOLDER'], app.config['ANNOTATIONS_FOLDER'], app.config['CATEGORIES_FOLDER'], 'config']:
+        os.makedirs(folder, exist_ok=True)
+    # Category manifests of earlier versions were named like a video's annotation file
+    video_store.migrate_manifests()
+    threading.Thread(target=search_index.ensure_built, name='search-index', daemon=True).start()
 
-    # Add any remaining (unpaired) start annotations from active_start_points_by_unique_id
-    for unpaired_start_ann in active_start_points_by_unique_id.values():
-        processed_annotations.append(deepcopy(unpaired_start_ann)) # These are still 'start' type
-        
-    return processed_annotations
+sync_hub = SyncHub(app.config['SYNC_HISTORY_SIZE'], app.config['SYNC_HEARTBEAT_SECONDS'])
 
+def change_publisher(category_id, filename):
+    """
+    The ``on_commit`` callback of annotation writes: pushes the video's change
+    to the clients following it, the applied journal operations or (without
+    operations) a 'snapshot' note to reload it. The storage calls it before
+    the video is unlocked, so clients get changes in the order they were
+    written, each with the version it produced.
+    """
+    client = request.headers.get(app.config['SYNC_CLIENT_HEADER'])
+
+    def publish(version, operations=None):
+        if operations is None:
+            sync_hub.publish(category_id, filename, 'snapshot', version=version, client=client)
+        else:
+            sync_hub.publish(category_id, filename, 'operations', operations=operations, version=version, client=client)
+    return publish
+
+def config_lock():
+    """Exclusive lock held while reading, modifying and writing the event types file"""
+    return file_lock(app.config['EVENT_TYPES_FILE'], app.config['LOCKS_FOLDER'])
 
 ind=None
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profiler = None
+    if app.config['PROFILING_ENABLED'] and request.headers.get(app.config['PROFILE_HEADER']):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            g.profiler = profiler
+        except ValueError:
+            # Another profiler is already active in this thread
+            pass
+
+@app.after_request
+def record_request_metrics(response):
+    """Record the request's latency, and dump its profile if it was profiled and slow"""
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=response.status_code)
+
+    profile_path = finish_profile(elapsed)
+    if profile_path is not None:
+        response.headers['X-Profile-File'] = profile_path.name
+    return response
+
+@app.teardown_request
+def stop_request_profiler(error=None):
+    """
+    Stop the profiler of a request that raised (after_request is skipped then,
+    e.g. under the debugger), so the thread's next profiled request can start one
+    """
+    if g.get('profiler') is not None:
+        finish_profile(time.perf_counter() - g.get('request_start', time.perf_counter()))
+
+def finish_profile(elapsed):
+    """Stop the request's profiler, if any; returns the path its stats were dumped to if it was slow"""
+    profiler = g.get('profiler')
+    if profiler is None:
+        return None
+    profiler.disable()
+    g.profiler = None
+    if elapsed < app.config['PROFILE_SLOW_SECONDS']:
+        return None
+    profile_folder = Path(app.config['PROFILE_FOLDER'])
+    profile_folder.mkdir(parents=True, exist_ok=True)
+    endpoint = request.endpoint or 'unmatched'
+    profile_path = profile_folder / f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{endpoint}.prof"
+    profiler.dump_stats(profile_path)
+    print(f"Profile of slow request {request.method} {request.path} ({elapsed:.3f}s) written to {profile_path}")
+    return profile_path
+
+# Responses worth compressing; videos and images are already compressed
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/css', 'text/javascript', 'application/javascript')
+
+@app.after_request
+def compress_response(response):
+    """Compress sizeable text and JSON responses with gzip or deflate, if the client accepts it"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    accepted = request.accept_encodings
+    encoding = next((name for name in ('gzip', 'deflate') if accepted[name]), None)
+    data = response.get_data()
+    if encoding is None or len(data) < app.config['RESPONSE_COMPRESSION_MIN_BYTES']:
+        return response
+    level = app.config['RESPONSE_COMPRESSION_LEVEL']
+    if encoding == 'gzip':
+        data = gzip.compress(data, compresslevel=level, mtime=0)
+    else:
+        data = zlib.compress(data, level)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    """Request latencies, JSON and file I/O and probe times in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     """Render the main application page"""
     return render_template('index.html')
 
 @app.route('/upload', methods=['POST'])
+@serving_pool('blocking')
 def upload_video():
     """
     Handle video upload and initial processing
@@ -128,66 +244,165 @@ def upload_video():
         print("here is the video file",video_file.filename)
         filename = secure_filename(video_file.filename)
         
-        # Create category folder if it doesn't exist
-        category_folder = Path(app.config['CATEGORIES_FOLDER']) / category_id
-        category_folder.mkdir(exist_ok=True)
-        
-        # Create temporary path for the video
-        temp_path = Path(app.config['UPLOAD_FOLDER']) / 'temp' / filename
-        temp_path.parent.mkdir(exist_ok=True)
-        
-        # Save to temporary location first
-        video_file.save(str(temp_path))
-        
-        # Get video info using OpenCV
-        cap = cv2.VideoCapture(str(temp_path))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = frame_count / fps if fps > 0 else 0
-        cap.release()
-        
-        # Move file to final destination
-        final_path = category_folder / filename
-        shutil.move(str(temp_path), str(final_path))
+        # Hash while saving, then keep one copy per content and reference it from the category
+        video_hash, tmp_path = video_store.ingest(video_file.stream)
+        stored_path = video_store.add(tmp_path, video_hash, category_id, filename)
+        video_index.register(stored_path, filename)
         
-        # Check for existing annotation file
-        annotation_file = category_folder / f"{filename.rsplit('.', 1)[0]}.json"
-        
-        if annotation_file.exists():
-            try:
-                with annotation_file.open('r') as f:
-                    annotations = json.load(f)
-            except json.JSONDecodeError:
-                annotations = {
-                    "video_name": filename,
-                    "category_id": category_id,
-                    "annotations": []
-                }
-        else:
-            annotations = {
-                "video_name": filename,
-                "category_id": category_id,
-                "annotations": []
-            }
-            with annotation_file.open('w') as f:
-                json.dump(annotations, f, indent=4)
-
-        return jsonify({
-            'filename': filename,
-            'duration': duration,
-            'annotations': annotations,
-            'category_id': category_id
-        })
+        return jsonify(build_video_response(stored_path, category_id, filename))
 
     except Exception as e:
-        # Clean up temporary files if they exist
-        if 'temp_path' in locals():
+        # Clean up partially written files if they exist
+        if 'tmp_path' in locals():
             try:
-                os.remove(temp_path)
+                os.remove(tmp_path)
             except:
                 pass
         return jsonify({'error': f'Error processing video: {str(e)}'}), 500
 
+def load_or_create_annotation_file(category_folder, filename, category_id):
+    """Load the annotations stored for a video, creating empty ones if missing"""
+    try:
+        annotations = annotation_service.load(category_id, filename)
+    except json.JSONDecodeError:
+        return {
+            "video_name": filename,
+            "category_id": category_id,
+            "annotations": []
+        }
+
+    if annotations is None:
+        annotations = annotation_service.empty(category_id, filename)
+        annotation_service.save(category_id, filename, annotations)
+    return annotations
+
+def build_video_response(video_path, category_id, filename=None):
+    """
+    Build the upload response (video info and existing annotations) for a stored video
+    
+    Probing runs in the background: 'duration' and 'metadata' are only set when
+    the video is already known, otherwise poll /probe_jobs/<probe_job_id>.
+    """
+    video_path = Path(video_path)
+    filename = filename or video_path.name
+    
+    # Get video info from the metadata cache, or start probing it
+    probe_job = video_metadata.submit(video_path)
+    metadata = probe_job.get('metadata')
+    # Timeline thumbnails and the playback proxy are built in the background too
+    thumbnails.submit(video_path, probe_job['job_id'])
+    proxies.submit(video_path, probe_job['job_id'])
+    
+    # Check for existing annotation file
+    category_folder = Path(app.config['CATEGORIES_FOLDER']) / category_id
+    annotations = load_or_create_annotation_file(category_folder, filename, category_id)
+
+    return {
+        'filename': filename,
+        'duration': metadata['duration'] if metadata else None,
+        'metadata': metadata,
+        'probe_job_id': probe_job['job_id'],
+        'probe_status': probe_job['status'],
+        'annotations': annotations,
+        'category_id': category_id
+    }
+
+def upload_error_response(error):
+    """Turn an UploadError into a JSON error response, including the resume offset if known"""
+    payload = {'error': str(error)}
+    if error.session is not None:
+        payload['upload_id'] = error.session['upload_id']
+        payload['offset'] = error.session['received']
+    return jsonify(payload), error.status
+
+def upload_session_status(session):
+    """Public view of a chunked upload session"""
+    return {
+        'upload_id': session['upload_id'],
+        'filename': session['filename'],
+        'category_id': session['category_id'],
+        'total_size': session['total_size'],
+        'chunk_size': session['chunk_size'],
+        'offset': session['received']
+    }
+
+@app.route('/upload/init', methods=['POST'])
+@serving_pool('blocking')
+def init_chunked_upload():
+    """
+    Start (or resume) a chunked upload
+    
+    Expects JSON:
+    - filename, categoryId, size (total bytes)
+    - chunkSize (optional)
+    - sha256 (optional): if a video with this content is already stored, it is
+      added to the category without uploading it again; otherwise it
+      identifies the upload to resume and is checked at finalize
+    - nonce (optional): identifies the upload to resume when there is no sha256
+      (without either, every init starts a new upload)
+    
+    Returns:
+    - JSON with upload_id, chunk_size and the byte offset to continue from, or
+      the video info (as finalize does) with 'complete': true for known content
+    """
+    data = request.json
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+
+    category_id = data.get('categoryId')
+    filename = secure_filename(data.get('filename') or '')
+    if data.get('sha256') and category_id and filename and isinstance(data.get('size'), int):
+        stored_path = video_store.link_existing(data['sha256'], data['size'], category_id, filename)
+        if stored_path is not None:
+            video_index.register(stored_path, filename)
+            return jsonify(dict(build_video_response(stored_path, category_id, filename), complete=True))
+
+    try:
+        session = upload_service.init_session(
+            data.get('categoryId'),
+            data.get('filename'),
+            data.get('size'),
+            data.get('chunkSize'),
+            sha256=data.get('sha256'),
+            nonce=data.get('nonce')
+        )
+        return jsonify(upload_session_status(session))
+    except UploadError as e:
+        return upload_error_response(e)
+
+@app.route('/upload/<upload_id>', methods=['GET'])
+@serving_pool('blocking')
+def get_chunked_upload(upload_id):
+    """Get the state of a chunked upload (used to resume by byte offset)"""
+    session = upload_service.get_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload session not found'}), 404
+    return jsonify(upload_session_status(session))
+
+@app.route('/upload/<upload_id>/chunk/<int:index>', methods=['PUT'])
+@serving_pool('blocking')
+def put_upload_chunk(upload_id, index):
+    """Write chunk N of a chunked upload; the raw request body is the chunk data"""
+    try:
+        session = upload_service.write_chunk(upload_id, index, request.stream)
+        return jsonify(upload_session_status(session))
+    except UploadError as e:
+        return upload_error_response(e)
+
+@app.route('/upload/<upload_id>/finalize', methods=['POST'])
+@serving_pool('blocking')
+def finalize_chunked_upload(upload_id):
+    """Complete a chunked upload and return video info and existing annotations"""
+    try:
+        session = upload_service.finalize(upload_id)
+        stored_path = video_store.add(Path(session['path']), session['sha256'], session['category_id'], session['filename'])
+        video_index.register(stored_path, session['filename'])
+        return jsonify(build_video_response(stored_path, session['category_id'], session['filename']))
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return jsonify({'error': f'Error processing video: {str(e)}'}), 500
+
 def determine_format(data):
     """Determine if the data follows the old or new format."""
     if "version" in data and "videos" in data:
@@ -198,58 +413,21 @@ def determine_format(data):
         return "unknown"
 
 def add_seconds_to_events(file_path,filename):
-    def convert_game_time_to_seconds(game_time):
-        """Convert a game time string to total seconds."""
-       
-        match2=re.match(r"(\d+) - (\d{2}):(\d{2}):(\d{2})", game_time)
-        if match2:
-                print("match2",match2)
-                half,hour, minutes, seconds = map(int, match2.groups())
-                total_seconds = hour*60*60 + minutes * 60 + seconds   # Assuming 45 minutes per half  (half - 1) * 45 * 60
-        else :
-                match = re.match(r"(\d+) - (\d+):(\d+)", game_time)
-                if not match and not match2:
-                    return None  # Return None if the format is invalid
-                if match:
-                    half, minutes, seconds = map(int, match.groups())
-                    total_seconds = 0 + minutes * 60 + seconds   # Assuming 45 minutes per half  (half - 1) * 45 * 60
-
-
-
-        return total_seconds
-
+    """
+    Add 'seconds' to the 'gameTime' annotations of a SoccerNet-style file
+    (only those of video ``filename`` in the multi-video format). The file is
+    only rewritten when something changed. Returns the index of the video.
+    """
     # Read the JSON file
     with open(file_path, 'r') as file:
         data = json.load(file)
 
-    # Handle the new format
-    index=None
-    if "version" in data and "videos" in data:
-        videos_list=[]
-        for idx,video in enumerate(data["videos"]):
-            vid_name=video['path'].split("/")[-1].split(".")[0]
-            
-            if filename==vid_name:
-                    index=idx
-                    print(vid_name)
-                    for annotation in video.get("annotations", []):
-                        if "seconds" not in annotation and "gameTime" in annotation:
-                            print(annotation["gameTime"])
-                            annotation["seconds"] = convert_game_time_to_seconds(annotation["gameTime"])
-                    break        
-    # Handle the old format
-    elif isinstance(data, dict) and "annotations" in data:
-        for annotation in data["annotations"]:
-            if "seconds" not in annotation and "gameTime" in annotation:
-                annotation["seconds"] = convert_game_time_to_seconds(annotation["gameTime"])
-    else:
-        raise ValueError("Unsupported JSON structure: expected a specific format.")
+    changed, index = add_seconds(data, filename)
 
     # Overwrite the JSON file with updated data
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4, ensure_ascii=False)
-
-    print(f"File '{file_path}' has been updated successfully!")
+    if changed:
+        atomic_write_json(file_path, data, indent=4, ensure_ascii=False)
+        print(f"File '{file_path}' has been updated successfully!")
     return index
 
 @app.route('/save_annotations', methods=['POST'])
@@ -268,40 +446,21 @@ def save_annotations():
         if not all([filename, category_id]):
             return jsonify({'error': 'Missing required data (filename, categoryId)'}), 400
 
-        # Create paths for both storage and processed files
-        category_folder = Path(app.config['CATEGORIES_FOLDER']) / category_id
-        category_folder.mkdir(parents=True, exist_ok=True) # Ensure category folder exists
-
-        storage_file_path = category_folder / f"{filename.rsplit('.', 1)[0]}.json"
-        processed_file_path = category_folder / f"{filename.rsplit('.', 1)[0]}_processed.json"
-
         raw_storage_data = {
             "video_name": filename,
             "category_id": category_id,
             "annotations": raw_annotations_from_client, # The list of start/end points
             "activeAnnotations": active_annotations_map_from_client # Client's map of active event types
         }
-        with storage_file_path.open('w') as f:
-            json.dump(raw_storage_data, f, indent=4)
-
-        # --- Process raw annotations to create 'complete' and unpaired 'start' annotations ---
-        processed_annotations_list = reprocess_raw_annotations(raw_annotations_from_client)
-
-        processed_data_to_save = {
-            "video_name": filename,
-            "category_id": category_id,
-            "annotations": processed_annotations_list,
-             # activeAnnotations in processed file might be different or not needed if UI reconstructs from raw
-            "activeAnnotations": active_annotations_map_from_client # Or derive from processed_annotations_list if needed
-        }
-        with processed_file_path.open('w') as f:
-            json.dump(processed_data_to_save, f, indent=4)
+        # Writes the raw and processed files and resets the journal
+        version = annotation_service.save(category_id, filename, raw_storage_data,
+                                          on_commit=change_publisher(category_id, filename))
+        search_index.refresh(category_id, filename)
 
+        # The client already holds what it sent; the version lets it revalidate later reads
         return jsonify({
             'message': 'Annotations saved successfully',
-            # Return the raw annotations and active map, as the client sent them
-            'annotations': raw_annotations_from_client,
-            'activeAnnotations': active_annotations_map_from_client
+            'version': version
         })
 
     except Exception as e:
@@ -332,148 +491,325 @@ def edit_annotations():
             return jsonify({'error': 'Missing required data for edit (filename, categoryId, instanceId, pointToEdit, newTime)'}), 400
 
         if point_to_edit not in ['start', 'end']:
-            return jsonify({'error': f'Invalid pointToEdit value: {pointToEdit}. Must be "start" or "end".'}), 400
-
-        category_folder = Path(app.config['CATEGORIES_FOLDER']) / category_id
-        # Path to the raw storage file (contains start/end points)
-        raw_storage_filename = f"{filename.rsplit('.', 1)[0]}.json"
-        storage_file_path = category_folder / raw_storage_filename
-        
-        processed_filename = f"{filename.rsplit('.', 1)[0]}_processed.json"
-        processed_file_path = category_folder / processed_filename
+            return jsonify({'error': f'Invalid pointToEdit value: {point_to_edit}. Must be "start" or "end".'}), 400
 
-
-        if not storage_file_path.exists():
+        if not annotation_service.exists(category_id, filename):
             return jsonify({'error': 'Annotations (raw storage) file not found'}), 404
 
-        with storage_file_path.open('r') as f:
-            storage_data = json.load(f) # This contains the 'annotations' list of raw start/end points
-
-        raw_annotations_list = storage_data.get('annotations', [])
-        updated_in_raw = False
-
-        for ann in raw_annotations_list:
-            if point_to_edit == 'start' and ann.get('type') == 'start' and ann.get('id') == instance_id_to_update:
-                ann['time'] = new_time
-                if new_fields is not None:
-                    ann['fields'] = new_fields
-                updated_in_raw = True
-                # If start's fields change, the corresponding end's fields should also reflect this
-                # (assuming fields are shared for the pair and defined by the start point)
-                if new_fields is not None:
-                    for end_ann_candidate in raw_annotations_list:
-                        if end_ann_candidate.get('type') == 'end' and end_ann_candidate.get('startAnnotationId') == instance_id_to_update:
-                            end_ann_candidate['fields'] = new_fields # Keep fields consistent
-                            break 
-                break 
-            elif point_to_edit == 'end' and ann.get('type') == 'end' and ann.get('startAnnotationId') == instance_id_to_update:
-                ann['time'] = new_time
-                # If new_fields are provided when editing an 'end' point, it implies updating the pair's fields.
-                # So, update the corresponding 'start' point's fields as well.
-                if new_fields is not None:
-                    ann['fields'] = new_fields # Update end's fields
-                    for start_ann_candidate in raw_annotations_list:
-                        if start_ann_candidate.get('type') == 'start' and start_ann_candidate.get('id') == instance_id_to_update:
-                            start_ann_candidate['fields'] = new_fields # Keep fields consistent
-                            break
-                updated_in_raw = True
-                break
-        
-        if not updated_in_raw:
+        # Fields are shared by the pair, so changed fields are mirrored onto the partner point
+        changes = {'time': new_time}
+        if new_fields is not None:
+            changes['fields'] = new_fields
+        operation = {'op': 'update', 'instanceId': instance_id_to_update, 'point': point_to_edit, 'changes': changes}
+
+        def plan(video):
+            # Checked under the video's lock, so the point cannot be deleted in between
+            if video is None or video.point(instance_id_to_update, point_to_edit) is None:
+                return [], False
+            return [operation], True
+
+        # Record the change in the journal; the processed file is refreshed on compaction
+        version, found = annotation_service.append_planned(category_id, filename, plan,
+                                                           on_commit=change_publisher(category_id, filename))
+        if not found:
             return jsonify({'error': f'Annotation instance with ID {instance_id_to_update} (for point {point_to_edit}) not found in raw data'}), 404
+        search_index.refresh(category_id, filename)
 
-        # Save the updated raw annotations back to the storage file
-        storage_data['annotations'] = raw_annotations_list
-        with storage_file_path.open('w') as f:
-            json.dump(storage_data, f, indent=4)
-
-        # --- Reprocess the updated raw annotations to update the processed file ---
-        processed_annotations_list_updated = reprocess_raw_annotations(raw_annotations_list)
-
-        processed_data_to_save = {
-            "video_name": filename,
-            "category_id": category_id,
-            "annotations": processed_annotations_list_updated,
-            "activeAnnotations": storage_data.get('activeAnnotations', {}) # Keep client's active map
-        }
-        with processed_file_path.open('w') as f:
-            json.dump(processed_data_to_save, f, indent=4)
-
+        # Only the applied change, not the whole raw list
         return jsonify({
             'message': 'Annotation updated successfully',
-            # Return the updated raw annotations list
-            'annotations': raw_annotations_list, 
-            'activeAnnotations': storage_data.get('activeAnnotations', {})
+            'version': version,
+            'operation': operation
         })
 
     except Exception as e:
         print(f"Error editing annotation: {str(e)}")
         return jsonify({'error': f'Error editing annotation: {str(e)}'}), 500
         
+def annotation_version_response(category_id, filename, build_response):
+    """
+    Respond to a GET of a video's annotations with their version as a (weak)
+    ETag. A client whose If-None-Match already names the current version gets
+    a 304 without the payload being built. The version is read before the
+    payload, so a write in between can only make the response newer than its
+    ETag, never older.
+    """
+    version = annotation_service.version(category_id, filename)
+    if version is not None and request.if_none_match.contains_weak(version):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(build_response())
+    if version is not None and response.status_code in (200, 304):
+        response.set_etag(version, weak=True)
+        # Cacheable, but revalidated on every use
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/get_annotation_state/<category_id>/<filename>/<event_id>', methods=['GET'])
 def get_annotation_state(category_id, filename, event_id):
     """Check if an event has an active (started but not ended) annotation"""
-    try:
-        annotation_file = Path(app.config['CATEGORIES_FOLDER']) / category_id / f"{filename.rsplit('.', 1)[0]}.json"
-        
-        if not annotation_file.exists():
-            return jsonify({'active': False})
-            
-        with annotation_file.open('r') as f:
-            data = json.load(f)
-            
-        # Check for unmatched start annotations
-        temp_annotations = {}
-        for annotation in data.get('annotations', []):
-            if annotation.get('type') == 'start' and annotation['event'] == event_id:
-                temp_annotations[event_id] = True
-            elif annotation.get('type') == 'end' and annotation['event'] == event_id:
-                temp_annotations[event_id] = False
-                
+    def build_response():
+        # Active if the event's latest point is an unmatched start
+        active, start_time = annotation_service.event_state(category_id, filename, event_id)
         return jsonify({
-            'active': temp_annotations.get(event_id, False),
-            'startTime': next((a['time'] for a in data.get('annotations', []) 
-                             if a.get('type') == 'start' and a['event'] == event_id), None)
+            'active': active,
+            'startTime': start_time
         })
-        
+
+    try:
+        return annotation_version_response(category_id, filename, build_response)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
 @app.route('/get_active_annotations/<category_id>/<filename>', methods=['GET'])
 def get_active_annotations(category_id, filename):
-    """Get all currently active annotations for a video"""
-    try:
-        annotation_file = Path(app.config['CATEGORIES_FOLDER']) / category_id / f"{filename.rsplit('.', 1)[0]}.json"
-        
-        if not annotation_file.exists():
+    """
+    Get all currently active annotations for a video, with the exact version
+    they are at (clients following the video's events skip the changes up to it)
+    """
+    def build_response():
+        data, version = annotation_service.load_versioned(category_id, filename)
+        if data is None:
             return jsonify({'active_annotations': {}})
-            
-        with annotation_file.open('r') as f:
-            data = json.load(f)
-            
         return jsonify({
             'active_annotations': data.get('active_annotations', {}),
-            'annotations': data.get('annotations', [])
+            'annotations': data.get('annotations', []),
+            'version': version
         })
-        
+
+    try:
+        return annotation_version_response(category_id, filename, build_response)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/annotations/<category_id>/<filename>/export', methods=['GET'])
+@serving_pool('blocking')
+def export_annotations(category_id, filename):
+    """
+    Download a video's annotations as a JSON file
+    
+    Query parameters (optional):
+    - view: 'raw' start/end points (default) or 'processed' paired intervals
+    - pretty: 1 to indent the file for reading (the stored files are compact)
+    """
+    view = request.args.get('view', 'raw')
+    if view not in ('raw', 'processed'):
+        return jsonify({'error': f"Invalid view '{view}'. Must be 'raw' or 'processed'"}), 400
+    pretty = request.args.get('pretty', '0').lower() in ('1', 'true', 'yes')
+
+    def build_response():
+        data = annotation_service.load(category_id, filename)
+        if data is None:
+            return jsonify({'error': 'Annotations not found'}), 404
+        if view == 'processed':
+            data = dict(data, annotations=annotation_service.load_processed(category_id, filename))
+        layout = {'indent': 4} if pretty else {'separators': (',', ':')}
+        suffix = '_processed' if view == 'processed' else ''
+        response = Response(json.dumps(data, **layout), mimetype='application/json')
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename.rsplit(".", 1)[0]}{suffix}.json"'
+        return response
+
+    try:
+        return annotation_version_response(category_id, filename, build_response)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@app.route('/annotations/<category_id>/<filename>/intervals', methods=['GET'])
+def query_annotation_intervals(category_id, filename):
+    """
+    Query the completed (and still open) annotation intervals of a video by time
+    
+    Query parameters (all optional):
+    - start, end: return intervals overlapping [start, end] (seconds)
+    - at: return intervals active at this time (instead of start/end)
+    - event: only intervals of this event id
+    - field.<name>=<value>: only intervals whose custom field has this value
+    - offset, limit: page through the results (ordered by start time)
     
+    Returns:
+    - JSON with the page of 'intervals' and the 'total' number of matches
+    """
+    try:
+        args = request.args
+        at = args.get('at', type=float)
+        start = at if at is not None else args.get('start', type=float)
+        end = at if at is not None else args.get('end', type=float)
+        offset = max(0, args.get('offset', 0, type=int))
+        limit = args.get('limit', type=int)
+        fields = {key[len('field.'):]: value for key, value in args.items() if key.startswith('field.')}
+
+        def build_response():
+            intervals = annotation_service.interval_index(category_id, filename)
+            matches = intervals.query(start, end, args.get('event'), fields) if intervals is not None else []
+            page = matches[offset:offset + limit] if limit is not None else matches[offset:]
+            return jsonify({
+                'intervals': page,
+                'total': len(matches),
+                'offset': offset,
+                'limit': limit
+            })
+
+        return annotation_version_response(category_id, filename, build_response)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+@app.route('/search', methods=['GET'])
+def search_annotations():
+    """
+    Search the annotations of every video of every category
+    
+    Query parameters (all optional, combined with AND):
+    - event: event id
+    - label: annotation label
+    - category: category id
+    - field.<name>=<value>: custom field value
+    - offset, limit: page through the results (default limit 100)
+    
+    Returns:
+    - JSON with the page of 'results' (annotations with their 'category_id'
+      and 'filename'), ordered by category, video and start time, and the
+      'total' number of matches
+    """
+    try:
+        args = request.args
+        offset = max(0, args.get('offset', 0, type=int))
+        limit = max(0, args.get('limit', 100, type=int))
+        fields = {key[len('field.'):]: value for key, value in args.items() if key.startswith('field.')}
+
+        results, total = search_index.search(
+            event_id=args.get('event'),
+            label=args.get('label'),
+            category_id=args.get('category'),
+            fields=fields,
+            offset=offset,
+            limit=limit
+        )
+        return jsonify({
+            'results': results,
+            'total': total,
+            'offset': offset,
+            'limit': limit
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/uploads/<filename>')
+@serving_pool('blocking')
 def uploaded_file(filename):
-    # First, check if the file exists in 'uploads'
-    upload_path = Path(app.config['UPLOAD_FOLDER']) / filename
-    if upload_path.exists():
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
-
-    # If not found, search in category folders
-    for category_folder in Path(app.config['CATEGORIES_FOLDER']).iterdir():
-        category_path = category_folder / filename
-        if category_path.exists():
-            return send_from_directory(str(category_folder), filename)  # ✅ FIXED: Now correctly returns file
+    """
+    Serve a stored video (or other stored file)
     
-    # If file is not found, return a 404 error
-    return jsonify({'error': 'File not found'}), 404
+    Files are located through the in-memory video index. Responses support
+    byte ranges (206 Partial Content), ETag/Last-Modified validators and 304s,
+    so seeking in the player only fetches the bytes it needs.
+    
+    With ?proxy=1 the low-resolution proxy is served if it has been built.
+    """
+    file_path = video_index.locate(filename)
+    if file_path is None:
+        # If file is not found, return a 404 error
+        return jsonify({'error': 'File not found'}), 404
+
+    if request.args.get('proxy'):
+        proxy = proxies.path(video_metadata.fingerprint(file_path))
+        if proxy is not None:
+            proxy_path, mimetype = proxy
+            return send_file(
+                proxy_path,
+                mimetype=mimetype,
+                conditional=True,
+                etag=True,
+                max_age=app.config['VIDEO_CACHE_MAX_AGE']
+            )
+
+    return send_file(
+        file_path,
+        conditional=True,
+        etag=True,
+        max_age=app.config['VIDEO_CACHE_MAX_AGE']
+    )
+
+@app.route('/videos/<filename>/metadata', methods=['GET'])
+@serving_pool('blocking')
+def get_video_metadata(filename):
+    """Metadata of a stored video; starts a probing job if it is not cached yet"""
+    file_path = video_index.locate(filename)
+    if file_path is None:
+        return jsonify({'error': 'File not found'}), 404
+    return jsonify(video_metadata.submit(file_path))
+
+@app.route('/videos/<filename>/thumbnails', methods=['GET'])
+@serving_pool('blocking')
+def get_video_thumbnails(filename):
+    """
+    Sprite sheet and key frame index of a stored video
+    
+    Returns 202 with the build status while the sprites are being built. The
+    index gives the tile size, grid and interval (seconds per tile), the URLs
+    of the sheets and the key frame timestamps.
+    """
+    file_path = video_index.locate(filename)
+    if file_path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    video_hash = video_metadata.fingerprint(file_path)
+    status = thumbnails.submit(file_path, video_hash)
+    if status == 'error':
+        return jsonify({'status': status, 'error': thumbnails.error(video_hash)}), 500
+    if status != 'done':
+        return jsonify({'status': status}), 202
+
+    index = thumbnails.index(video_hash)
+    index['status'] = status
+    index['sprite_urls'] = [
+        url_for('get_thumbnail_sprite', video_hash=video_hash, sheet=sheet)
+        for sheet in range(len(index['sheets']))
+    ]
+    return jsonify(index)
+
+@app.route('/thumbnails/<video_hash>/sprite_<int:sheet>.jpg')
+@serving_pool('blocking')
+def get_thumbnail_sprite(video_hash, sheet):
+    """Serve a sprite sheet; the URL is content-addressed, so it is cached for good"""
+    sprite_path = thumbnails.sprite_path(video_hash, sheet)
+    if sprite_path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    response = send_file(sprite_path, mimetype='image/jpeg', conditional=True, max_age=app.config['THUMBNAIL_CACHE_MAX_AGE'])
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/videos/<filename>/proxy', methods=['GET'])
+@serving_pool('blocking')
+def get_video_proxy(filename):
+    """
+    Status of the low-resolution proxy of a stored video (building it if needed)
+    
+    When the status is 'done', 'url' and 'mimetype' give the proxy to play.
+    """
+    file_path = video_index.locate(filename)
+    if file_path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    video_hash = video_metadata.fingerprint(file_path)
+    status = proxies.submit(file_path, video_hash)
+    response = {'status': status}
+    if status == 'done':
+        response.update(proxies.info(video_hash))
+        response['url'] = url_for('uploaded_file', filename=filename, proxy=1)
+    elif status == 'error':
+        response['error'] = proxies.error(video_hash)
+    return jsonify(response)
+
+@app.route('/probe_jobs/<job_id>', methods=['GET'])
+def get_probe_job(job_id):
+    """Poll a background probing job"""
+    job = video_metadata.job(job_id)
+    if job is None:
+        return jsonify({'error': 'Probe job not found'}), 404
+    return jsonify(job)
 
 @app.route('/get_annotations/<filename>')
 def get_annotations(filename):
@@ -482,16 +818,15 @@ def get_annotations(filename):
         with open(annotation_path, 'r') as f:
             annotations = json.load(f)
             format_type = determine_format(annotations)  # Determine the format
-            print("Annotations loaded:", annotations)
         return jsonify({
             'annotations': annotations,
             'format': format_type  # Send the format to the client
         })
     return jsonify({'annotations': [], 'format': 'old'})  # Default to old format if no file exists
 
-def load_event_types():
+def load_event_types(for_update=False):
     """Load event types from config file or create default if not exists"""
-    if not os.path.exists(app.config['EVENT_TYPES_FILE']):
+    if not category_registry.exists():
         default_types = {
             "event_types": [
                 {
@@ -501,13 +836,10 @@ def load_event_types():
                 }
             ]
         }
-        os.makedirs(os.path.dirname(app.config['EVENT_TYPES_FILE']), exist_ok=True)
-        with open(app.config['EVENT_TYPES_FILE'], 'w') as f:
-            json.dump(default_types, f, indent=4)
+        category_registry.save(default_types)
         return default_types["event_types"]
     
-    with open(app.config['EVENT_TYPES_FILE'], 'r') as f:
-        return json.load(f)["event_types"]
+    return category_registry.load(copy=for_update)["event_types"]
 
 @app.route('/event_types', methods=['GET'])
 def get_event_types():
@@ -521,22 +853,22 @@ def add_event_type():
     if not data or 'name' not in data or 'color' not in data:
         return jsonify({'error': 'Invalid event type data'}), 400
 
-    event_types = load_event_types()
-    
-    # Check if event type already exists
-    if any(et['name'] == data['name'] for et in event_types):
-        return jsonify({'error': 'Event type already exists'}), 400
+    with config_lock():
+        event_types = load_event_types(for_update=True)
+        
+        # Check if event type already exists
+        if any(et['name'] == data['name'] for et in event_types):
+            return jsonify({'error': 'Event type already exists'}), 400
 
-    new_type = {
-        'name': data['name'],
-        'color': data['color'],
-        'description': data.get('description', '')
-    }
-    
-    event_types.append(new_type)
-    
-    with open(app.config['EVENT_TYPES_FILE'], 'w') as f:
-        json.dump({"event_types": event_types}, f, indent=4)
+        new_type = {
+            'name': data['name'],
+            'color': data['color'],
+            'description': data.get('description', '')
+        }
+        
+        event_types.append(new_type)
+        
+        category_registry.save({"event_types": event_types})
     
     return jsonify(new_type), 201
 
@@ -552,15 +884,8 @@ def add_annotation_category():
     if not data or 'name' not in data or 'color' not in data:
         return jsonify({'error': 'Invalid category data'}), 400
 
-    categories = load_annotation_categories()
-    
     # Generate a unique ID from the name
     category_id = data['name'].lower().replace(' ', '_')
-    
-    # Check if category already exists
-    if any(cat['id'] == category_id for cat in categories['annotation_categories']):
-        return jsonify({'error': 'Category already exists'}), 400
-
     new_category = {
         'id': category_id,
         'name': data['name'],
@@ -568,9 +893,17 @@ def add_annotation_category():
         'description': data.get('description', ''),
         'events': []
     }
-    
-    categories['annotation_categories'].append(new_category)
-    save_annotation_categories(categories)
+
+    with config_lock():
+        load_annotation_categories()
+        
+        # Check if category already exists
+        if category_registry.category(category_id) is not None:
+            return jsonify({'error': 'Category already exists'}), 400
+
+        categories = load_annotation_categories(for_update=True)
+        categories['annotation_categories'].append(new_category)
+        save_annotation_categories(categories)
     
     return jsonify(new_category), 201
 
@@ -581,36 +914,40 @@ def add_event_to_category(category_id):
     if not data or 'name' not in data or 'color' not in data:
         return jsonify({'error': 'Invalid event data'}), 400
 
-    categories = load_annotation_categories()
-    
-    # Find the category
-    category = next((cat for cat in categories['annotation_categories'] 
-                    if cat['id'] == category_id), None)
-    if not category:
-        return jsonify({'error': 'Category not found'}), 404
-
     # Generate event ID
     event_id = data['name'].lower().replace(' ', '_')
-    
-    # Check if event already exists in category
-    if any(evt['id'] == event_id for evt in category['events']):
-        return jsonify({'error': 'Event already exists in category'}), 400
-
     new_event = {
         'id': event_id,
         'name': data['name'],
         'color': data['color'],
         'description': data.get('description', '')
     }
-    
-    category['events'].append(new_event)
-    save_annotation_categories(categories)
+
+    with config_lock():
+        load_annotation_categories()
+        if category_registry.category(category_id) is None:
+            return jsonify({'error': 'Category not found'}), 404
+
+        # Check if event already exists in category
+        if category_registry.event(category_id, event_id) is not None:
+            return jsonify({'error': 'Event already exists in category'}), 400
+
+        categories = load_annotation_categories(for_update=True)
+        category = next(cat for cat in categories['annotation_categories'] 
+                        if cat['id'] == category_id)
+        category['events'].append(new_event)
+        save_annotation_categories(categories)
     
     return jsonify(new_event), 201
 
-def load_annotation_categories():
-    """Load annotation categories from config file or create default"""
-    if not os.path.exists(app.config['EVENT_TYPES_FILE']):
+def load_annotation_categories(for_update=False):
+    """
+    Load annotation categories from config file or create default.
+    
+    The result is served from the in-memory registry and must not be modified
+    unless for_update=True, which returns a private copy to edit and save.
+    """
+    if not category_registry.exists():
         default_categories = {
             "annotation_categories": [
                 {
@@ -629,17 +966,13 @@ def load_annotation_categories():
                 }
             ]
         }
-        os.makedirs(os.path.dirname(app.config['EVENT_TYPES_FILE']), exist_ok=True)
         save_annotation_categories(default_categories)
-        return default_categories
     
-    with open(app.config['EVENT_TYPES_FILE'], 'r') as f:
-        return json.load(f)
+    return category_registry.load(copy=for_update)
 
 def save_annotation_categories(categories):
-    """Save annotation categories to file"""
-    with open(app.config['EVENT_TYPES_FILE'], 'w') as f:
-        json.dump(categories, f, indent=4)
+    """Save annotation categories to file (callers modifying it hold config_lock())"""
+    category_registry.save(categories)
 
 # Update the existing annotation structure
 def create_default_annotation():
@@ -669,8 +1002,8 @@ def save_categories():
             "annotation_categories": categories_data
         }
         
-        with open(app.config['EVENT_TYPES_FILE'], 'w') as f:
-            json.dump(categories, f, indent=4)
+        with config_lock():
+            save_annotation_categories(categories)
             
         # If this is an update to a specific category, update its folder
         if category_id:
@@ -686,8 +1019,7 @@ def save_categories():
                     "color": category['color'],
                     "events": category['events']
                 }
-                with open(category_folder / 'config.json', 'w') as f:
-                    json.dump(category_config, f, indent=4)
+                atomic_write_json(category_folder / 'config.json', category_config, indent=4)
         
         return jsonify({'message': 'Categories saved successfully'})
     except Exception as e:
@@ -760,6 +1092,10 @@ def create_default_event_fields():
 @app.route('/event_fields/<category_id>/<event_id>', methods=['GET'])
 def get_event_fields(category_id, event_id):
     """Get the fields for a specific event type"""
+    if category_registry.exists():
+        fields = category_registry.event_fields(category_id, event_id)
+        if fields is not None:
+            return jsonify(fields)
     fields = create_default_event_fields()
     return jsonify(fields.get(category_id, {}).get(event_id, []))
 
@@ -769,9 +1105,8 @@ def category_setup():
     category_id = request.args.get('category_id')
     if category_id:
         # Load existing category data
-        categories = load_annotation_categories()
-        category = next((c for c in categories['annotation_categories'] 
-                        if c['id'] == category_id), None)
+        load_annotation_categories()
+        category = category_registry.category(category_id)
         if category:
             print("Loading category data:", category)  # Debug log
             return render_template('category_setup.html', category=category)
@@ -804,19 +1139,20 @@ def save_category_setup():
             }
             category['events'].append(event)
         
-        # Load existing categories
-        categories = load_annotation_categories()
-        
-        # Add or update category
-        existing_idx = next((i for i, c in enumerate(categories['annotation_categories']) 
-                           if c['id'] == category_id), None)
-        if existing_idx is not None:
-            categories['annotation_categories'][existing_idx] = category
-        else:
-            categories['annotation_categories'].append(category)
-        
-        # Save updated categories
-        save_annotation_categories(categories)
+        with config_lock():
+            # Load existing categories
+            categories = load_annotation_categories(for_update=True)
+            
+            # Add or update category
+            existing_idx = next((i for i, c in enumerate(categories['annotation_categories']) 
+                               if c['id'] == category_id), None)
+            if existing_idx is not None:
+                categories['annotation_categories'][existing_idx] = category
+            else:
+                categories['annotation_categories'].append(category)
+            
+            # Save updated categories
+            save_annotation_categories(categories)
         
         return jsonify({'message': 'Category saved successfully'})
     except Exception as e:
@@ -826,22 +1162,31 @@ def save_category_setup():
 def delete_category(category_id):
     """Delete a category and its associated data"""
     try:
-        # Load existing categories
-        categories = load_annotation_categories()
-        
-        # Remove the category
-        categories['annotation_categories'] = [
-            c for c in categories['annotation_categories'] 
-            if c['id'] != category_id
-        ]
-        
-        # Save updated categories
-        save_annotation_categories(categories)
+        with config_lock():
+            # Load existing categories
+            categories = load_annotation_categories(for_update=True)
+            
+            # Remove the category
+            categories['annotation_categories'] = [
+                c for c in categories['annotation_categories'] 
+                if c['id'] != category_id
+            ]
+            
+            # Save updated categories
+            save_annotation_categories(categories)
         
         # Delete category folder and its contents
         category_folder = Path(app.config['CATEGORIES_FOLDER']) / category_id
+        for filename in video_store.manifest(category_id):
+            video_index.unregister(filename)
+        # Each video is removed under its write lock; the database backend keeps no files in the folder
+        annotation_service.delete_category(category_id)
         if category_folder.exists():
             shutil.rmtree(category_folder)
+        video_index.unregister_folder(category_folder)
+        search_index.remove_category(category_id)
+        # Stored videos no other category refers to
+        video_store.collect_garbage()
         
         return jsonify({'message': 'Category deleted successfully'})
     except Exception as e:
@@ -849,54 +1194,344 @@ def delete_category(category_id):
 
 @app.route('/delete_annotation/<category_id>/<filename>/<annotation_id>', methods=['DELETE'])
 def delete_annotation(category_id, filename, annotation_id):
-    """Delete a specific annotation from a video"""
+    """Delete an annotation instance (its start point and linked end point) from a video"""
     try:
-        # Path to the annotation file
-        annotation_file = Path(app.config['CATEGORIES_FOLDER']) / category_id / f"{filename.rsplit('.', 1)[0]}.json"
-        print(f"Resolved annotation file path: {annotation_file}")
-
-        if not annotation_file.exists():
+        if not annotation_service.exists(category_id, filename):
             print("Annotation file not found.")
             return jsonify({'error': 'Annotation file not found'}), 404
 
-        # Load the existing annotations
-        with annotation_file.open('r') as f:
-            data = json.load(f)
-
-        annotations = data.get('annotations', [])
-        updated_annotations = []
-
-        # Iterate through annotations to handle deletion logic
-        for ann in annotations:
-            if ann.get('id') == annotation_id:
-                print(f"Deleting annotation: {ann}")
-                # If the annotation to delete is an endpoint, also delete the corresponding start point
-                if ann.get('type') == 'end':
-                    event_id = ann.get('event')
-                    # Remove both the endpoint and its corresponding start point
-                    updated_annotations = [
-                        a for a in annotations if not (
-                            (a.get('event') == event_id and a.get('type') == 'start') or
-                            (a.get('id') == annotation_id)
-                        )
-                    ]
-                    break  # Exit the loop since we've handled the deletion
-                # If the annotation to delete is a start point, skip it
-                continue
-            # Add the annotation to the updated list if it is not being deleted
-            updated_annotations.append(ann)
+        # Record the deletion in the journal instead of rewriting the whole file
+        operation = {'op': 'delete', 'instanceId': annotation_id}
 
-        # Update the JSON file
-        data['annotations'] = updated_annotations
-        with annotation_file.open('w') as f:
-            json.dump(data, f, indent=4)
+        def plan(video):
+            # Checked under the video's lock; a missing instance writes nothing
+            if video is None or all(video.point(annotation_id, point) is None for point in ('start', 'end')):
+                return [], False
+            return [operation], True
+
+        version, found = annotation_service.append_planned(category_id, filename, plan,
+                                                           on_commit=change_publisher(category_id, filename))
+        if not found:
+            return jsonify({'error': f'Annotation instance with ID {annotation_id} not found'}), 404
+        search_index.refresh(category_id, filename)
 
         print("Annotation deleted successfully.")
-        return jsonify({'message': 'Annotation deleted successfully'})
+        return jsonify({'message': 'Annotation deleted successfully', 'version': version})
 
     except Exception as e:
         print(f"Error deleting annotation: {str(e)}")
         return jsonify({'error': f'Error deleting annotation: {str(e)}'}), 500
+
+@app.route('/annotations/<category_id>/<filename>/operations', methods=['POST'])
+def apply_annotation_operations(category_id, filename):
+    """
+    Apply a delta to a video's annotations
+    
+    Expects JSON:
+    - operations: list of {'op': 'add', 'annotation': {...}},
+      {'op': 'update', 'instanceId', 'point': 'start'|'end', 'changes': {...}},
+      {'op': 'delete', 'instanceId'} or {'op': 'active', 'activeAnnotations': {...}}
+    
+    The operations are appended to the video's journal, so the cost of a save
+    scales with the size of the change rather than the annotation history.
+    """
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        operations = data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'error': 'No operations provided'}), 400
+
+        for position, operation in enumerate(operations):
+            error = validate_operation(operation)
+            if error:
+                return jsonify({'error': f'Invalid operation {position}: {error}'}), 400
+
+        version = annotation_service.append_operations(category_id, filename, operations,
+                                                       on_commit=change_publisher(category_id, filename))
+        search_index.refresh(category_id, filename)
+
+        return jsonify({
+            'message': 'Annotations saved successfully',
+            'applied': len(operations),
+            'version': version
+        })
+
+    except Exception as e:
+        print(f"Error applying annotation operations: {str(e)}")
+        return jsonify({'error': f'Error applying annotation operations: {str(e)}'}), 500
+
+@app.route('/annotations/<category_id>/<filename>/events', methods=['GET'])
+@serving_pool('stream')
+def annotation_events(category_id, filename):
+    """
+    Server-Sent Events stream of the changes written to a video
+
+    Events:
+    - hello: sent first, with the current sequence number
+    - operations: journal operations applied by a write ({'operations',
+      'version', 'client', 'seq'})
+    - snapshot: the annotations were replaced by a full save; reload them
+    - reset: changes were missed (too far behind, or the server restarted); reload
+
+    Reconnecting clients resume after the Last-Event-ID header (sent by
+    EventSource automatically) or the 'since' query parameter.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    response = Response(sync_hub.stream(category_id, filename, last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Do not let a reverse proxy hold events back in its buffer
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/annotations/batch', methods=['POST'])
+@serving_pool('blocking')
+def apply_batch_operations():
+    """
+    Apply operations across many videos in one request
+    
+    Expects JSON:
+    - operations: list of operations, each with the 'categoryId' and 'filename'
+      of its video: the journal operations of
+      /annotations/<category_id>/<filename>/operations, or the bulk operations
+      {'op': 'shift', 'offset': seconds, 'eventId' (optional)} and
+      {'op': 'relabel', 'from': event id, 'to': event id}
+    
+    Operations are grouped by video: each video is read once and its
+    operations are checked and appended in one write, holding the video's
+    lock throughout. One bad operation or video does not stop the others.
+    
+    Returns:
+    - results: one {'status': 'applied'|'not_found'|'invalid'|'error', ...}
+      per operation, in order ('changed' counts the points a shift or
+      relabel moved; both are 'not_found' for a video without annotations)
+    - videos: the new version of every video the batch touched
+    """
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        operations = data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'error': 'No operations provided'}), 400
+
+        groups, errors = group_batch_operations(operations)
+        results = [None] * len(operations)
+        for position, error in errors.items():
+            results[position] = {'status': 'invalid', 'error': error}
+
+        videos = []
+        for (category_id, _), group in groups.items():
+            filename = group[0][1]['filename']
+            journal = []
+            try:
+                def plan(video, group=group):
+                    planned_journal, planned_results = plan_video_operations(
+                        video.storage_data if video is not None else None, group
+                    )
+                    return planned_journal, (planned_journal, planned_results)
+
+                # Planned and appended under the video's lock, so the absolute updates
+                # a shift expands to cannot overwrite a concurrent edit
+                version, (journal, planned) = annotation_service.append_planned(
+                    category_id, filename, plan, on_commit=change_publisher(category_id, filename)
+                )
+                if journal:
+                    search_index.refresh(category_id, filename)
+                else:
+                    version = annotation_service.version(category_id, filename)
+            except Exception as e:
+                print(f"Error applying batch operations to {category_id}/{filename}: {str(e)}")
+                planned = {position: {'status': 'error', 'error': str(e)} for position, _ in group}
+                version = None
+            for position, result in planned.items():
+                results[position] = result
+            videos.append({
+                'categoryId': category_id,
+                'filename': filename,
+                'version': version,
+                'written': len(journal)
+            })
+
+        applied = sum(1 for result in results if result['status'] == 'applied')
+        return jsonify({
+            'results': results,
+            'videos': videos,
+            'applied': applied,
+            'failed': len(results) - applied
+        })
+
+    except Exception as e:
+        print(f"Error applying batch operations: {str(e)}")
+        return jsonify({'error': f'Error applying batch operations: {str(e)}'}), 500
+    
+def category_video_names(category_id):
+    """Filenames of the videos of a category: its stored videos and any kept in its folder"""
+    names = list(video_store.manifest(category_id))
+    category_folder = Path(app.config['CATEGORIES_FOLDER']) / category_id
+    if category_folder.is_dir():
+        for file_path in sorted(category_folder.iterdir()):
+            if file_path.is_file() and file_path.suffix.lower() not in ('.json', '.jsonl') and file_path.name not in names:
+                names.append(file_path.name)
+    return names
+
+def label_event_ids(category_id, processed_annotations, requested=None):
+    """
+    Columns of a label export: the requested events, or the category's events
+    in configuration order followed by any other event found in the annotations
+    """
+    if requested:
+        return requested
+    category = category_registry.category(category_id) or {}
+    event_ids = [event.get('id') for event in category.get('events', [])]
+    extra = {ann.get('eventId', ann.get('event')) for ann in processed_annotations} - set(event_ids) - {None}
+    return event_ids + sorted(extra)
+
+def export_video_labels(category_id, filename, export_format, requested_events=None):
+    """Write the dense label matrix of one video; raises LookupError if the video is missing"""
+    video_path = video_store.resolve(category_id, filename) or video_index.locate(filename)
+    if video_path is None:
+        raise LookupError(f"Video not found: {filename}")
+    processed = annotation_service.load_processed(category_id, filename) or []
+    event_ids = label_event_ids(category_id, processed, requested_events)
+    return label_exports.export(
+        category_id, filename, processed, event_ids, video_metadata.probe(video_path), export_format
+    )
+
+def label_export_args(args):
+    """(format, events) of a label export request, from query parameters or a JSON body"""
+    export_format = args.get('format') or 'auto'
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format '{export_format}'. Must be one of {', '.join(EXPORT_FORMATS)}")
+    events = args.get('events')
+    if isinstance(events, str):
+        events = [event for event in events.split(',') if event]
+    return export_format, events or None
+
+@app.route('/export/labels/<category_id>/<filename>', methods=['GET'])
+@serving_pool('blocking')
+def export_labels(category_id, filename):
+    """
+    Download the dense per-frame labels of a video
+    
+    Query parameters (optional):
+    - format: 'npz', 'npy' or 'auto' (npy, memory-mapped, for large matrices)
+    - events: comma-separated event ids, one column each (default: all events of the category)
+    
+    The matrix has one row per frame and one uint8 column per event, set when
+    the frame lies in a completed interval of that event.
+    """
+    try:
+        export_format, events = label_export_args(request.args)
+        summary = export_video_labels(category_id, filename, export_format, events)
+        return send_file(
+            label_exports.path(category_id, filename, summary['format']),
+            as_attachment=True,
+            mimetype='application/octet-stream'
+        )
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Error exporting labels: {str(e)}'}), 500
+
+@app.route('/export/labels/<category_id>', methods=['POST'])
+@serving_pool('blocking')
+def export_category_labels(category_id):
+    """
+    Export the dense per-frame labels of every video of a category
+    
+    Accepts an optional JSON body with 'format' and 'events' (as for a single
+    video). Files are written to LABEL_EXPORT_FOLDER/<category_id>/.
+    
+    Returns:
+    - JSON with a summary of each 'exported' video and the 'failed' ones
+    """
+    try:
+        export_format, events = label_export_args(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    exported = []
+    failed = []
+    for filename in category_video_names(category_id):
+        try:
+            exported.append(export_video_labels(category_id, filename, export_format, events))
+        except Exception as e:
+            print(f"Warning: exporting labels of {filename} failed: {e}")
+            failed.append({'filename': filename, 'error': str(e)})
+
+    return jsonify({
+        'folder': str(label_exports.folder(category_id)),
+        'exported': exported,
+        'failed': failed
+    })
+
+def category_video_files(category_ids):
+    """Annotation file of each video (by stem) in each of the given categories: {stem: {category_id: filename}}"""
+    wanted = set(category_ids)
+    videos = {}
+    for category_id, filename in annotation_service.videos():
+        if category_id in wanted:
+            videos.setdefault(filename.rsplit('.', 1)[0], {})[category_id] = filename
+    return videos
+
+@app.route('/agreement', methods=['GET'])
+@serving_pool('blocking')
+def annotator_agreement():
+    """
+    Agreement between annotators who annotated the same videos, each in a
+    category of their own
     
+    Query parameters:
+    - categories: comma-separated category ids, one per annotator (at least two)
+    - filename: compare this video only, listing the matched intervals of each
+      pair of annotators and those only one of them has (default: every video
+      annotated in all the categories, pooled)
+    - events: comma-separated event ids (default: every event with a completed interval)
+    - fps: frames per second of the comparison grid (default AGREEMENT_FPS)
+    - iou: minimum IoU of matched intervals (default AGREEMENT_IOU_THRESHOLD)
+    
+    Returns:
+    - JSON with the temporal IoU, Cohen's kappa (per pair) and Fleiss' kappa of
+      each event and 'overall', and matched/unmatched interval counts per pair
+    """
+    args = request.args
+    category_ids = [category for category in args.get('categories', '').split(',') if category]
+    events = [event for event in args.get('events', '').split(',') if event] or None
+    fps = args.get('fps', app.config['AGREEMENT_FPS'], type=float)
+    iou_threshold = args.get('iou', app.config['AGREEMENT_IOU_THRESHOLD'], type=float)
+    if len(category_ids) < 2 or len(set(category_ids)) != len(category_ids):
+        return jsonify({'error': 'categories must name at least two different categories'}), 400
+    if not fps or fps <= 0:
+        return jsonify({'error': 'fps must be a positive number'}), 400
+
+    try:
+        filename = args.get('filename')
+        if filename:
+            processed = [annotation_service.load_processed(category_id, filename) for category_id in category_ids]
+            missing = [category_id for category_id, annotations in zip(category_ids, processed) if annotations is None]
+            if missing:
+                return jsonify({'error': f"{filename} has no annotations in {', '.join(missing)}"}), 404
+            stats, diffs = video_agreement(processed, events, fps, iou_threshold, details=True)
+            return jsonify(dict(video_report(stats, diffs, category_ids), filename=filename))
+
+        per_video = {}
+        skipped = []
+        for stem, files in sorted(category_video_files(category_ids).items()):
+            if len(files) < len(category_ids):
+                skipped.append(stem)
+                continue
+            processed = [annotation_service.load_processed(category_id, files[category_id]) or [] for category_id in category_ids]
+            per_video[stem], _ = video_agreement(processed, events, fps, iou_threshold)
+        return jsonify(pooled_report(per_video, category_ids, skipped))
+    except Exception as e:
+        return jsonify({'error': f'Error computing agreement: {str(e)}'}), 500
+
 if __name__ == '__main__':
+    start_services()
     app.run(debug=True)
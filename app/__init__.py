@@ -1,24 +1,60 @@
-from flask import Flask
+from app.services.metrics_service import STARTUP_SECONDS
 from config.config import Config
-import os
+from pathlib import Path
+import importlib.util
+import sys
+import threading
+import time
 
-def create_app(config_class=Config):
-    app = Flask(__name__)
-    app.config.from_object(config_class)
+# The application module: configuration defaults, services and routes
+SERVER_MODULE_PATH = Path(__file__).resolve().parent.parent / 'app.py'
 
-    # Ensure required directories exist
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['ANNOTATIONS_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['CATEGORIES_FOLDER'], exist_ok=True)
-    os.makedirs('config', exist_ok=True)
+# Settings of the create_app call that is loading app.py
+_settings = {}
+_loading = threading.Lock()
 
-    # Register blueprints
-    from app.routes.main_routes import main
-    from app.routes.annotation_routes import annotation
-    from app.routes.category_routes import category
 
-    app.register_blueprint(main)
-    app.register_blueprint(annotation)
-    app.register_blueprint(category)
+def factory_settings():
+    """Settings app.py applies over its defaults (none when app.py is run directly)"""
+    return dict(_settings)
 
-    return app 
\ No newline at end of file
+
+def serving_pool(name):
+    """
+    Mark a view to run in the ASGI front's ``name`` thread pool: 'blocking'
+    for slow work (files, uploads, exports, bulk computations) or 'stream'
+    for event streams. Unmarked views run in the annotation pool.
+    """
+    def mark(view):
+        view.serving_pool = name
+        return view
+    return mark
+
+
+def create_app(config_class=Config, **settings):
+    """
+    Load the application with the settings of ``config_class`` (and keyword
+    overrides) applied before any of its services are created. Every call
+    loads a new instance of app.py, with services of its own.
+    """
+    config = {key: getattr(config_class, key) for key in dir(config_class) if key.isupper()}
+    config.update(settings)
+
+    with _loading:
+        _settings.update(config)
+        try:
+            start = time.perf_counter()
+            spec = importlib.util.spec_from_file_location('taat_server', SERVER_MODULE_PATH)
+            module = importlib.util.module_from_spec(spec)
+            # Registered so Flask finds the templates and static files next to app.py
+            sys.modules[spec.name] = module
+            spec.loader.exec_module(module)
+        finally:
+            _settings.clear()
+    STARTUP_SECONDS.observe(time.perf_counter() - start, phase='load')
+
+    # Data folders and background work: loading app.py has no side effects
+    start = time.perf_counter()
+    module.start_services()
+    STARTUP_SECONDS.observe(time.perf_counter() - start, phase='start')
+    return module.app
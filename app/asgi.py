@@ -0,0 +1,300 @@
+"""
+Asynchronous (ASGI) front for production serving.
+
+The Flask application runs unchanged behind an asyncio event loop that owns
+every connection. Each request is handed to one of three thread pools, so
+slow work never holds up the annotation routes:
+- blocking: uploads, video and sprite files, probes, exports, batches and
+  agreement reports
+- stream: Server-Sent Event streams, one thread per connected client
+- annotation: everything else (annotation reads and writes, pages, search)
+The pool is the one the matched route's view is marked with (see
+``app.serving_pool``), so new routes are classified where they are defined.
+
+Request bodies are not buffered: the application reads them from the
+connection as it goes (an upload chunk is streamed to disk in blocks), and
+response bodies are sent as they are produced, with the event loop applying
+backpressure. OpenCV probes, thumbnails and proxies already run in the
+services' own background thread and process pools.
+
+Usage:
+    python -m app.asgi [--host 127.0.0.1] [--port 5000]
+    uvicorn --factory app.asgi:create_asgi_app
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import FileWrapper
+import argparse
+import asyncio
+import sys
+import threading
+
+from app import create_app
+from config.config import Config
+
+# Files are served in blocks of at least this size (fewer event loop round trips than 8 KiB)
+FILE_BLOCK_SIZE = 256 * 1024
+
+
+def request_pool(app, urls, method, path):
+    """
+    Name of the pool a request runs in: the one its view is marked with.
+    ``urls`` is the application's URL map bound once (a MapAdapter).
+    """
+    try:
+        endpoint, _ = urls.match(path, method=method)
+    except HTTPException:
+        # Not found, wrong method or a redirect: a cheap error response
+        return 'annotation'
+    return getattr(app.view_functions.get(endpoint), 'serving_pool', 'annotation')
+
+
+class _FileWrapper(FileWrapper):
+    """wsgi.file_wrapper reading large blocks"""
+
+    def __init__(self, file, buffer_size=8192):
+        super().__init__(file, max(buffer_size, FILE_BLOCK_SIZE))
+
+
+class _RequestBody:
+    """
+    wsgi.input reading the request body from the ASGI connection as the
+    application asks for it. Reads run in a worker thread; the messages are
+    received on the event loop.
+    """
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.buffer = bytearray()
+        self.complete = False
+        self.disconnected = threading.Event()
+        self._receiving = asyncio.Lock()
+        self._completed = asyncio.Event()
+
+    def _end(self):
+        self.complete = True
+        self._completed.set()
+
+    async def _pull(self):
+        """The next part of the body (b'' once it is complete)"""
+        # Checked first: once the body is complete the disconnect watcher holds the lock
+        if self.complete:
+            return b''
+        async with self._receiving:
+            if self.complete:
+                return b''
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                self.disconnected.set()
+                self._end()
+                return b''
+            if not message.get('more_body', False):
+                self._end()
+            return message.get('body', b'')
+
+    async def watch_disconnect(self, has_body):
+        """Flag the client going away; the server reports it once the body has been received"""
+        if has_body:
+            await self._completed.wait()
+        else:
+            await self._pull()
+        while not self.disconnected.is_set():
+            async with self._receiving:
+                message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                self.disconnected.set()
+
+    def _fill(self):
+        part = asyncio.run_coroutine_threadsafe(self._pull(), self.loop).result()
+        self.buffer += part
+        return bool(part) or not self.complete
+
+    def read(self, size=-1):
+        """Up to ``size`` bytes, as soon as some are available (everything if size < 0)"""
+        if size is None or size < 0:
+            while self._fill():
+                pass
+            size = len(self.buffer)
+        else:
+            while not self.buffer and self._fill():
+                pass
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readline(self, size=-1):
+        while b'\n' not in self.buffer and (size is None or size < 0 or len(self.buffer) < size) and self._fill():
+            pass
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+def request_path(scope):
+    """Path of an ASGI request below the application's root path"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    return path
+
+
+def build_environ(scope, body):
+    """WSGI environ of an ASGI HTTP request"""
+    root_path = scope.get('root_path', '')
+    path = request_path(scope)
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The body ends where the client's does, chunked or not
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': _FileWrapper,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsyncFront:
+    """ASGI application running a WSGI (Flask) application in per-kind thread pools"""
+
+    def __init__(self, wsgi_app, annotation_threads=16, blocking_threads=8, stream_threads=128):
+        self.wsgi_app = wsgi_app
+        # Matched on the event loop only, so one adapter serves every request
+        self._urls = wsgi_app.url_map.bind('localhost')
+        self.pools = {
+            'annotation': ThreadPoolExecutor(max_workers=annotation_threads, thread_name_prefix='asgi-annotation'),
+            'blocking': ThreadPoolExecutor(max_workers=blocking_threads, thread_name_prefix='asgi-blocking'),
+            'stream': ThreadPoolExecutor(max_workers=stream_threads, thread_name_prefix='asgi-stream'),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await receive()
+            await send({'type': 'websocket.close', 'code': 1000})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        body = _RequestBody(receive, loop)
+        headers = dict(scope.get('headers', []))
+        has_body = b'content-length' in headers and headers[b'content-length'] != b'0' or b'transfer-encoding' in headers
+        watcher = asyncio.ensure_future(body.watch_disconnect(has_body))
+        try:
+            pool = self.pools[request_pool(self.wsgi_app, self._urls, scope['method'], request_path(scope))]
+            await loop.run_in_executor(pool, self._run_wsgi, build_environ(scope, body), body, send, loop)
+        finally:
+            watcher.cancel()
+
+    def _run_wsgi(self, environ, body, send, loop):
+        """Run the WSGI application in a worker thread, sending its response through the event loop"""
+        def send_message(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        def start():
+            if not response.get('started'):
+                response['started'] = True
+                send_message({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if body.disconnected.is_set():
+                    # Stops endless responses (event streams) of clients that left
+                    return
+                if chunk:
+                    start()
+                    send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            start()
+            send_message({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+def create_asgi_app(config_class=Config, **settings):
+    """The application (see ``create_app``) behind the asynchronous front"""
+    app = create_app(config_class, **settings)
+    return AsyncFront(
+        app,
+        annotation_threads=app.config['ASGI_ANNOTATION_THREADS'],
+        blocking_threads=app.config['ASGI_BLOCKING_THREADS'],
+        stream_threads=app.config['ASGI_STREAM_THREADS']
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the annotation tool with an asynchronous (ASGI) front')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('The async serving mode needs an ASGI server: pip install uvicorn')
+    # One process: live sync and the search index live in the serving process
+    uvicorn.run('app.asgi:create_asgi_app', factory=True, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
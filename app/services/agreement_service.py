@@ -0,0 +1,457 @@
+"""
+Agreement between annotators who labelled the same videos.
+
+Each annotator keeps their own annotation file of a video (for instance one
+category per annotator). The files are paired with
+``reprocess_raw_annotations`` and only completed intervals are compared.
+For every event:
+- temporal IoU: frames labelled by both annotators of a pair / frames
+  labelled by either
+- Cohen's kappa per pair of annotators, and Fleiss' kappa across all of them
+- interval diffs: intervals matched one-to-one across a pair (highest IoU
+  first, at least ``iou_threshold``) and the intervals only one of them has
+
+Frames are sampled on a grid of ``fps`` frames per second up to the end of
+the last interval of the video; a frame is labelled when
+startTime <= t < endTime, as in the label export. Each annotator's intervals
+are painted once into a frames x events matrix and every statistic is a sum
+over its axes. The statistics are kept as counts, so a whole category pools
+them across videos.
+
+Usage:
+    python -m app.services.agreement_service annotator_a annotator_b [...] [--fps 25] [--json agreement.json]
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from pathlib import Path
+import argparse
+import json
+import math
+import os
+
+from app.services.annotation_service import apply_operations, read_journal, reprocess_raw_annotations
+from app.services.label_export_service import frame_spans, paint_labels
+
+# numpy is imported by the functions using it, so loading the app does not pay for it
+
+# Rows of the interval IoU matrix computed at a time (bounds it to MATCH_BLOCK x intervals)
+MATCH_BLOCK = 1024
+
+# Files of the category folders that do not hold a video's raw annotations
+# (besides dotfiles such as the video manifest)
+SKIPPED_FILES = ('config',)
+
+# Pair counts, per event: frames labelled by both, by the first only, by the
+# second only, by neither; then the interval diff totals
+_N11, _N10, _N01, _N00, _MATCHED, _ONLY_A, _ONLY_B, _IOU_SUM, _START_OFFSET_SUM, _END_OFFSET_SUM = range(10)
+_PAIR_FIELDS = 10
+
+
+def _event_of(ann):
+    return ann.get('eventId', ann.get('event'))
+
+
+def _round(value):
+    return None if value is None else round(float(value), 4)
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else None
+
+
+def cohen_kappa(n11, n10, n01, n00):
+    """Cohen's kappa of two raters' binary labels; None when chance agreement is total"""
+    total = n11 + n10 + n01 + n00
+    if not total:
+        return None
+    observed = (n11 + n00) / total
+    expected = ((n11 + n10) * (n11 + n01) + (n01 + n00) * (n10 + n00)) / (total * total)
+    return None if expected >= 1 else (observed - expected) / (1 - expected)
+
+
+def fleiss_kappa(agreeing_pairs, labelled, frames, raters):
+    """
+    Fleiss' kappa of ``raters`` binary labels per frame, from its sums over
+    the frames: agreeing rater pairs (sum of n(n-1) over both labels) and
+    labels set
+    """
+    if not frames or raters < 2:
+        return None
+    observed = agreeing_pairs / (frames * raters * (raters - 1))
+    share = labelled / (frames * raters)
+    expected = share * share + (1 - share) * (1 - share)
+    return None if expected >= 1 else (observed - expected) / (1 - expected)
+
+
+def interval_arrays(processed_annotations, event_ids):
+    """(column, start, end) arrays of the completed intervals of the given events"""
+    import numpy as np
+    columns = {event_id: column for column, event_id in enumerate(event_ids)}
+    rows = [
+        (columns[_event_of(ann)], min(ann['startTime'], ann['endTime']), max(ann['startTime'], ann['endTime']))
+        for ann in processed_annotations
+        if ann.get('type') == 'complete' and _event_of(ann) in columns
+        and isinstance(ann.get('startTime'), (int, float)) and isinstance(ann.get('endTime'), (int, float))
+    ]
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0), np.empty(0)
+    column, start, end = (np.asarray(values) for values in zip(*rows))
+    return column.astype(np.int64), start.astype(float), end.astype(float)
+
+
+def match_intervals(a_start, a_end, b_start, b_end, iou_threshold=0.5):
+    """
+    One-to-one matches of two annotators' intervals of one event, best IoU
+    first. Returns (index in a, index in b, IoU) arrays.
+    """
+    import numpy as np
+    rows, cols, ious = [], [], []
+    b_length = b_end - b_start
+    for low in range(0, len(a_start), MATCH_BLOCK):
+        start = a_start[low:low + MATCH_BLOCK, None]
+        end = a_end[low:low + MATCH_BLOCK, None]
+        overlap = np.clip(np.minimum(end, b_end) - np.maximum(start, b_start), 0, None)
+        union = (end - start) + b_length - overlap
+        iou = np.divide(overlap, union, out=np.zeros_like(overlap), where=union > 0)
+        row, col = np.nonzero((iou >= iou_threshold) & (overlap > 0))
+        rows.append(row + low)
+        cols.append(col)
+        ious.append(iou[row, col])
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    rows, cols, ious = np.concatenate(rows), np.concatenate(cols), np.concatenate(ious)
+
+    # Greedy assignment over the overlapping candidates only
+    order = np.argsort(-ious, kind='stable')
+    used_a, used_b = set(), set()
+    keep = []
+    for candidate, row, col in zip(order.tolist(), rows[order].tolist(), cols[order].tolist()):
+        if row not in used_a and col not in used_b:
+            used_a.add(row)
+            used_b.add(col)
+            keep.append(candidate)
+    keep = np.asarray(keep, np.int64)
+    return rows[keep], cols[keep], ious[keep]
+
+
+def _interval(event_id, start, end):
+    return {'eventId': event_id, 'startTime': float(start), 'endTime': float(end)}
+
+
+def video_agreement(processed_by_annotator, event_ids=None, fps=25, iou_threshold=0.5, details=False):
+    """
+    Agreement counts of one video annotated by several annotators.
+
+    ``processed_by_annotator`` lists each annotator's processed annotations;
+    ``event_ids`` defaults to every event with a completed interval. Returns
+    the counts as an AgreementStats, and with ``details`` also the interval
+    diff of every pair of annotators (matched intervals, and those only one
+    of them has), in ``combinations`` order.
+    """
+    import numpy as np
+    raters = len(processed_by_annotator)
+    if event_ids is None:
+        event_ids = sorted({
+            _event_of(ann) for processed in processed_by_annotator for ann in processed
+            if ann.get('type') == 'complete' and _event_of(ann) is not None
+        })
+    event_count = len(event_ids)
+    intervals = [interval_arrays(processed, event_ids) for processed in processed_by_annotator]
+    last_end = max((float(end.max()) for _, _, end in intervals if len(end)), default=0.0)
+    frames = int(math.ceil(last_end * fps - 1e-6)) if last_end > 0 else 0
+
+    # annotators x frames x events; frame_spans uses the same labelled-frame rule as the export
+    labels = np.zeros((raters, frames, event_count), np.uint8)
+    for rater, processed in enumerate(processed_by_annotator):
+        paint_labels(*frame_spans(processed, event_ids, fps, frames), frames, event_count, out=labels[rater])
+    labelled = np.count_nonzero(labels, axis=1)
+
+    votes = labels.sum(axis=0, dtype=np.int64)
+    agreeing_pairs = (votes * (votes - 1) + (raters - votes) * (raters - votes - 1)).sum(axis=0)
+
+    pairs = list(combinations(range(raters), 2))
+    counts = np.zeros((len(pairs), event_count, _PAIR_FIELDS))
+    diffs = []
+    for index, (a, b) in enumerate(pairs):
+        both = np.count_nonzero(labels[a] & labels[b], axis=0)
+        counts[index, :, _N11] = both
+        counts[index, :, _N10] = labelled[a] - both
+        counts[index, :, _N01] = labelled[b] - both
+        counts[index, :, _N00] = frames - labelled[a] - labelled[b] + both
+
+        diff = {'matched': [], 'only_a': [], 'only_b': []}
+        a_column, a_start, a_end = intervals[a]
+        b_column, b_start, b_end = intervals[b]
+        for column, event_id in enumerate(event_ids):
+            a_rows = np.flatnonzero(a_column == column)
+            b_rows = np.flatnonzero(b_column == column)
+            rows, cols, ious = match_intervals(a_start[a_rows], a_end[a_rows], b_start[b_rows], b_end[b_rows], iou_threshold)
+            matched_a, matched_b = a_rows[rows], b_rows[cols]
+            counts[index, column, _MATCHED] = len(ious)
+            counts[index, column, _ONLY_A] = len(a_rows) - len(ious)
+            counts[index, column, _ONLY_B] = len(b_rows) - len(ious)
+            counts[index, column, _IOU_SUM] = ious.sum()
+            counts[index, column, _START_OFFSET_SUM] = np.abs(b_start[matched_b] - a_start[matched_a]).sum()
+            counts[index, column, _END_OFFSET_SUM] = np.abs(b_end[matched_b] - a_end[matched_a]).sum()
+            if not details:
+                continue
+            for row, col, iou in zip(matched_a.tolist(), matched_b.tolist(), ious.tolist()):
+                diff['matched'].append({
+                    'eventId': event_id,
+                    'a': [float(a_start[row]), float(a_end[row])],
+                    'b': [float(b_start[col]), float(b_end[col])],
+                    'iou': _round(iou)
+                })
+            unmatched_a = np.setdiff1d(a_rows, matched_a)
+            unmatched_b = np.setdiff1d(b_rows, matched_b)
+            diff['only_a'].extend(_interval(event_id, a_start[row], a_end[row]) for row in unmatched_a.tolist())
+            diff['only_b'].extend(_interval(event_id, b_start[row], b_end[row]) for row in unmatched_b.tolist())
+        diffs.append(diff)
+
+    stats = AgreementStats(raters)
+    stats.videos = 1
+    stats.frames = frames
+    for column, event_id in enumerate(event_ids):
+        stats.events[event_id] = {
+            'intervals': [int(np.count_nonzero(intervals[rater][0] == column)) for rater in range(raters)],
+            'fleiss': [int(agreeing_pairs[column]), int(votes[:, column].sum())],
+            'pairs': counts[:, column, :].tolist()
+        }
+    return stats, diffs
+
+
+def _add_entries(first, second):
+    """Sum of the counts of an event in two AgreementStats"""
+    return {
+        'intervals': [x + y for x, y in zip(first['intervals'], second['intervals'])],
+        'fleiss': [x + y for x, y in zip(first['fleiss'], second['fleiss'])],
+        'pairs': [[x + y for x, y in zip(pair, other)] for pair, other in zip(first['pairs'], second['pairs'])]
+    }
+
+
+class AgreementStats:
+    """
+    Agreement counts of a number of annotators, mergeable across videos. An
+    event a video has no interval of counts as unlabelled on all its frames.
+    """
+
+    def __init__(self, raters):
+        self.raters = raters
+        self.videos = 0
+        self.frames = 0
+        # event id -> {'intervals': [per annotator], 'fleiss': [agreeing pairs, labels], 'pairs': [[count] per pair]}
+        self.events = {}
+
+    def _unlabelled(self, frames):
+        pairs = [[0.0] * _PAIR_FIELDS for _ in combinations(range(self.raters), 2)]
+        for pair in pairs:
+            pair[_N00] = frames
+        return {
+            'intervals': [0] * self.raters,
+            'fleiss': [frames * self.raters * (self.raters - 1), 0],
+            'pairs': pairs
+        }
+
+    def merge(self, other):
+        for event_id in set(self.events) | set(other.events):
+            mine = self.events.get(event_id) or self._unlabelled(self.frames)
+            theirs = other.events.get(event_id) or other._unlabelled(other.frames)
+            self.events[event_id] = _add_entries(mine, theirs)
+        self.videos += other.videos
+        self.frames += other.frames
+        return self
+
+    def _summary(self, entry, frames, annotators):
+        intervals, fleiss, pairs = entry['intervals'], entry['fleiss'], entry['pairs']
+        names = list(combinations(annotators, 2))
+        labelled_either = sum(pair[_N11] + pair[_N10] + pair[_N01] for pair in pairs)
+        kappas = [cohen_kappa(*pair[:4]) for pair in pairs]
+        defined = [kappa for kappa in kappas if kappa is not None]
+        return {
+            'intervals': dict(zip(annotators, map(int, intervals))),
+            # Pooled over every pair of annotators
+            'iou': _round(_ratio(sum(pair[_N11] for pair in pairs), labelled_either)),
+            'cohen_kappa': _round(sum(defined) / len(defined)) if defined else None,
+            'fleiss_kappa': _round(fleiss_kappa(fleiss[0], fleiss[1], frames, self.raters)),
+            'pairs': [
+                {
+                    'annotators': list(pair_names),
+                    'iou': _round(_ratio(pair[_N11], pair[_N11] + pair[_N10] + pair[_N01])),
+                    'cohen_kappa': _round(kappa),
+                    'matched': int(pair[_MATCHED]),
+                    'unmatched': {pair_names[0]: int(pair[_ONLY_A]), pair_names[1]: int(pair[_ONLY_B])},
+                    'matched_iou': _round(_ratio(pair[_IOU_SUM], pair[_MATCHED])),
+                    'start_offset': _round(_ratio(pair[_START_OFFSET_SUM], pair[_MATCHED])),
+                    'end_offset': _round(_ratio(pair[_END_OFFSET_SUM], pair[_MATCHED]))
+                }
+                for pair_names, pair, kappa in zip(names, pairs, kappas)
+            ]
+        }
+
+    def report(self, annotators):
+        """Agreement per event, and over all events together ('overall'), by annotator name"""
+        # Overall, every (frame, event) cell is one rated item
+        overall = self._unlabelled(0)
+        for entry in self.events.values():
+            overall = _add_entries(overall, entry)
+        return {
+            'annotators': list(annotators),
+            'videos': self.videos,
+            'frames': self.frames,
+            'events': {
+                event_id: self._summary(entry, self.frames, annotators)
+                for event_id, entry in sorted(self.events.items())
+            },
+            'overall': self._summary(overall, self.frames * len(self.events), annotators)
+        }
+
+
+def read_processed(file_path):
+    """Processed annotations of a raw annotation file (snapshot plus journal replay)"""
+    file_path = Path(file_path)
+    journal_file_path = file_path.with_name(f"{file_path.stem}.journal.jsonl")
+    if file_path.is_file():
+        with file_path.open('r', encoding='utf-8') as f:
+            storage_data = json.load(f)
+    else:
+        storage_data = {'annotations': []}
+    operations = read_journal(journal_file_path)
+    if operations:
+        apply_operations(storage_data, operations)
+    return reprocess_raw_annotations(storage_data.get('annotations', []))
+
+
+def video_stems(folder):
+    """Stems of the videos with a raw annotation file (or journal) in a folder"""
+    folder = Path(folder)
+    stems = {path.stem for path in folder.glob('*.json')}
+    stems.update(path.name[:-len('.journal.jsonl')] for path in folder.glob('*.journal.jsonl'))
+    return {
+        stem for stem in stems
+        if stem not in SKIPPED_FILES and not stem.startswith('.') and not stem.endswith('_processed')
+    }
+
+
+def shared_videos(folders):
+    """(stems annotated in every folder, stems missing from some), sorted"""
+    stems = [video_stems(folder) for folder in folders]
+    shared = set.intersection(*stems) if stems else set()
+    return sorted(shared), sorted(set.union(*stems) - shared) if stems else []
+
+
+def folder_video_agreement(folders, stem, event_ids=None, fps=25, iou_threshold=0.5, details=False):
+    """Agreement of the annotation files of one video in each annotator's folder"""
+    processed = [read_processed(Path(folder) / f"{stem}.json") for folder in folders]
+    return video_agreement(processed, event_ids, fps, iou_threshold, details)
+
+
+def _video_summary(args):
+    folders, stem, event_ids, fps, iou_threshold = args
+    stats, _ = folder_video_agreement(folders, stem, event_ids, fps, iou_threshold)
+    return stem, stats
+
+
+def collect_agreement(folders, event_ids=None, fps=25, iou_threshold=0.5, workers=None):
+    """
+    Agreement of every video annotated in all the folders, computed across a
+    process pool. Returns the AgreementStats of each video (by stem) and the
+    stems skipped because some folder lacks them.
+    """
+    stems, skipped = shared_videos(folders)
+    jobs = [(list(map(str, folders)), stem, event_ids, fps, iou_threshold) for stem in stems]
+    if workers == 1 or len(jobs) < 2:
+        return dict(map(_video_summary, jobs)), skipped
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(_video_summary, jobs, chunksize=8)), skipped
+
+
+def annotator_names(folders):
+    """
+    Names of the annotators of the given folders: the folder names, or for
+    folders whose names repeat (e.g. ann_a/videos, ann_b/videos) their paths
+    relative to the working directory
+    """
+    names = [Path(folder).name for folder in folders]
+    return [
+        os.path.relpath(folder) if names.count(name) > 1 else name
+        for folder, name in zip(folders, names)
+    ]
+
+
+def video_report(stats, diffs, annotators):
+    """Report of one video, with the interval diff of every pair of annotators"""
+    report = stats.report(annotators)
+    report['diffs'] = [dict(diff, annotators=list(pair)) for pair, diff in zip(combinations(annotators, 2), diffs)]
+    return report
+
+
+def pooled_report(per_video, annotators, skipped=()):
+    """Report pooled over many videos (their AgreementStats by name), with the report of each"""
+    total = AgreementStats(len(annotators))
+    for stats in per_video.values():
+        total.merge(stats)
+    report = total.report(annotators)
+    report['per_video'] = {video: stats.report(annotators) for video, stats in per_video.items()}
+    report['skipped'] = list(skipped)
+    return report
+
+
+def format_report(report):
+    lines = [f"{report['videos']} videos, {report['frames']} frames, annotators: {', '.join(report['annotators'])}"]
+    lines.append(f"  {'IoU':>7} {'Cohen':>7} {'Fleiss':>7}  event")
+
+    def number(value):
+        return f"{value:7.3f}" if value is not None else f"{'-':>7}"
+
+    for event_id, summary in list(report['events'].items()) + [('(overall)', report['overall'])]:
+        lines.append(f"  {number(summary['iou'])} {number(summary['cohen_kappa'])} {number(summary['fleiss_kappa'])}  {event_id}")
+        for pair in summary['pairs']:
+            first, second = pair['annotators']
+            lines.append(f"      {first} / {second}: {pair['matched']} matched, "
+                         f"{pair['unmatched'][first]} only {first}, {pair['unmatched'][second]} only {second}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inter-annotator agreement of videos annotated in several folders")
+    parser.add_argument('folders', nargs='+', help="one folder of <video>.json files per annotator (e.g. category folders)")
+    parser.add_argument('--video', help='compare this video only (file name or stem) and list its interval diffs')
+    parser.add_argument('--events', help='comma-separated event ids (default: every event with an interval)')
+    parser.add_argument('--fps', type=float, default=25, help='frames per second of the comparison grid')
+    parser.add_argument('--iou', type=float, default=0.5, help='minimum IoU of matched intervals')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--json', help='write the full report to this JSON file')
+    args = parser.parse_args()
+
+    if len(args.folders) < 2:
+        parser.error('at least two annotator folders are needed')
+    if args.fps <= 0:
+        parser.error('--fps must be positive')
+    if len({Path(folder).resolve() for folder in args.folders}) != len(args.folders):
+        parser.error('each annotator folder can only be given once')
+    annotators = annotator_names(args.folders)
+    event_ids = [event for event in args.events.split(',') if event] if args.events else None
+
+    if args.video:
+        stem = Path(args.video).stem
+        missing = [folder for folder in args.folders if stem not in video_stems(folder)]
+        if missing:
+            raise SystemExit(f"{stem} has no annotations in {', '.join(missing)}")
+        stats, diffs = folder_video_agreement(args.folders, stem, event_ids, args.fps, args.iou, details=True)
+        report = video_report(stats, diffs, annotators)
+    else:
+        per_video, skipped = collect_agreement(args.folders, event_ids, args.fps, args.iou, args.workers)
+        report = pooled_report(per_video, annotators, skipped)
+
+    print(format_report(report))
+    for stem in report.get('skipped', []):
+        print(f"Skipped {stem}: not annotated in every folder")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
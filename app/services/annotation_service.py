@@ -0,0 +1,789 @@
+from flask import current_app
+from pathlib import Path
+from collections import OrderedDict
+from app.services.file_utils import file_lock, atomic_write_json
+from app.services.metrics_service import JSON_SECONDS, FILE_BYTES_READ, FILE_BYTES_WRITTEN
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+import hashlib
+import json
+import math
+import os
+import threading
+
+# Operations accepted by the annotation journal
+JOURNAL_OPERATIONS = ('add', 'update', 'delete', 'active')
+
+# Keys that link and index the points of a pair; an update may not change them
+LINK_KEYS = ('id', 'type', 'startAnnotationId')
+
+
+def _copy_annotation(ann_data):
+    """Lightweight (shallow) copy of a raw record for the processed view"""
+    return dict(ann_data)
+
+
+def _complete_annotation(start_ann, end_ann):
+    """Build the 'complete' annotation of a start/end pair"""
+    # Create the 'complete' annotation based on the start annotation's data
+    complete_ann = dict(start_ann)
+
+    start_time = start_ann.get('time')
+    end_time = end_ann.get('time') # Time from the 'end' annotation
+
+    complete_ann.update({
+        'startTime': start_time,
+        'endTime': end_time,
+        'duration': (end_time - start_time) if start_time is not None and end_time is not None else 0,
+        'type': 'complete',
+        # 'time' field for 'complete' is typically the startTime
+    })
+    # Remove fields specific to start/end individual points if not needed for 'complete'
+    complete_ann.pop('id', None) # Original unique id of the start point
+    complete_ann.pop('startAnnotationId', None) # Not relevant for complete
+    return complete_ann
+
+
+def _pair_annotations(raw_annotations_list, build_complete):
+    """
+    Pairing pass shared by reprocess_raw_annotations and ProcessedView.
+    ``build_complete(start, end)`` creates (or reuses) the record of a pair.
+    """
+    processed_annotations = []
+    # Stores start annotations keyed by their unique 'id'
+    active_start_points_by_unique_id = {}
+
+    for ann_data in raw_annotations_list:
+        ann_type = ann_data.get('type')
+
+        if ann_type == 'start':
+            unique_start_id = ann_data.get('id')
+            if unique_start_id:
+                active_start_points_by_unique_id[unique_start_id] = ann_data
+            else:
+                # This should ideally not happen if frontend ensures 'id' for start annotations
+                print(f"Warning: Encountered 'start' annotation missing a unique 'id': {ann_data}")
+                processed_annotations.append(_copy_annotation(ann_data)) # Add as is, or decide to skip
+        elif ann_type == 'end':
+            linked_start_id = ann_data.get('startAnnotationId')
+            if linked_start_id and linked_start_id in active_start_points_by_unique_id:
+                start_ann_instance = active_start_points_by_unique_id.pop(linked_start_id) # Paired, so remove
+                processed_annotations.append(build_complete(start_ann_instance, ann_data))
+            else:
+                # Orphaned end annotation (no matching start found or start already paired)
+                print(f"Warning: Orphaned 'end' annotation or missing start pair for startAnnotationId '{linked_start_id}': {ann_data}")
+                processed_annotations.append(_copy_annotation(ann_data)) # Add as is, or decide to skip
+        else:
+            # Annotations that are neither 'start' nor 'end' (e.g., already 'complete' if input can have them)
+            processed_annotations.append(_copy_annotation(ann_data))
+
+    # Add any remaining (unpaired) start annotations from active_start_points_by_unique_id
+    for unpaired_start_ann in active_start_points_by_unique_id.values():
+        processed_annotations.append(_copy_annotation(unpaired_start_ann)) # These are still 'start' type
+
+    return processed_annotations
+
+
+def reprocess_raw_annotations(raw_annotations_list):
+    """
+    Converts a list of raw 'start' and 'end' annotations into a list of
+    'complete' (paired) annotations and unpaired 'start' annotations.
+    Relies on 'start' annotations having a unique 'id' and 'end' annotations
+    having a 'startAnnotationId' linking to that unique 'id'.
+
+    Output records are new top-level dicts; nested values such as 'fields'
+    are shared with the raw records rather than deep-copied.
+    """
+    return _pair_annotations(raw_annotations_list, _complete_annotation)
+
+
+def validate_operation(operation):
+    """Return an error message if a journal operation is malformed, otherwise None"""
+    if not isinstance(operation, dict):
+        return 'Operation must be an object'
+
+    kind = operation.get('op')
+    if kind not in JOURNAL_OPERATIONS:
+        return f"Unknown operation '{kind}'. Must be one of {', '.join(JOURNAL_OPERATIONS)}"
+    if kind == 'add' and not isinstance(operation.get('annotation'), dict):
+        return "'add' requires an 'annotation' object"
+    if kind == 'update':
+        if not operation.get('instanceId'):
+            return "'update' requires an 'instanceId'"
+        if operation.get('point') not in ('start', 'end'):
+            return "'update' requires 'point' to be \"start\" or \"end\""
+        if not isinstance(operation.get('changes'), dict):
+            return "'update' requires a 'changes' object"
+        linked = [key for key in LINK_KEYS if key in operation['changes']]
+        if linked:
+            return f"'update' cannot change {', '.join(linked)}; delete the instance and add it again instead"
+    if kind == 'delete' and not operation.get('instanceId'):
+        return "'delete' requires an 'instanceId'"
+    if kind == 'active' and not isinstance(operation.get('activeAnnotations'), dict):
+        return "'active' requires an 'activeAnnotations' object"
+    return None
+
+
+def _event_of(ann):
+    return ann.get('eventId', ann.get('event'))
+
+
+def _instance_of(ann):
+    """Id linking the two points of a pair: the start's 'id' or the end's 'startAnnotationId'"""
+    return ann.get('id') if ann.get('type') == 'start' else ann.get('startAnnotationId')
+
+
+class AnnotationIndex:
+    """
+    Lookups over a video's raw start/end points.
+
+    - start id -> start point(s) and linked end point(s), first one wins
+      (the same point the original linear scans found)
+    - event id -> {start id: start point} for starts that have no end
+
+    Kept in step with the raw list by ``apply_operations`` so point edits,
+    deletes and "is this event active" checks do not scan the list.
+    """
+
+    def __init__(self, raw_annotations=()):
+        self._starts = {}
+        self._ends = {}
+        self.open_starts = {}
+        # start id -> event id it is listed under in open_starts
+        self._open_event = {}
+        # id(point) -> order of the point in the raw list (points are only ever appended)
+        self._positions = {}
+        self._next_position = 0
+        for ann in raw_annotations:
+            self.add(ann)
+
+    def add(self, ann):
+        ann_type = ann.get('type')
+        if ann_type == 'start' and ann.get('id'):
+            points = self._starts.setdefault(ann['id'], [])
+        elif ann_type == 'end' and ann.get('startAnnotationId'):
+            points = self._ends.setdefault(ann['startAnnotationId'], [])
+        else:
+            return
+        points.append(ann)
+        self._positions[id(ann)] = self._next_position
+        self._next_position += 1
+        if len(points) == 1:
+            self.refresh(_instance_of(ann))
+
+    def remove(self, instance_id):
+        """Drop the start and end point of an instance; returns the removed records"""
+        removed = []
+        for points_by_id in (self._starts, self._ends):
+            points = points_by_id.get(instance_id)
+            if points:
+                removed.append(points.pop(0))
+                del self._positions[id(removed[-1])]
+                if not points:
+                    del points_by_id[instance_id]
+        self.refresh(instance_id)
+        return removed
+
+    def refresh(self, instance_id):
+        """Recompute whether an instance is open (start without end) and under which event"""
+        start_ann = self.point(instance_id, 'start')
+        is_open = start_ann is not None and instance_id not in self._ends
+        event_id = _event_of(start_ann) if is_open else None
+
+        old_event_id = self._open_event.get(instance_id)
+        if instance_id in self._open_event and (not is_open or old_event_id != event_id):
+            del self._open_event[instance_id]
+            open_for_event = self.open_starts[old_event_id]
+            del open_for_event[instance_id]
+            if not open_for_event:
+                del self.open_starts[old_event_id]
+        if is_open:
+            self._open_event[instance_id] = event_id
+            self.open_starts.setdefault(event_id, {})[instance_id] = start_ann
+
+    def instance_ids(self):
+        """Ids of every instance with a start or end point, starts first"""
+        return list(dict.fromkeys([*self._starts, *self._ends]))
+
+    def point(self, instance_id, point):
+        """The 'start' or 'end' point of an instance, or None"""
+        points = (self._starts if point == 'start' else self._ends).get(instance_id)
+        return points[0] if points else None
+
+    def open_start(self, event_id):
+        """The last start point in the raw list of an event that has no end yet"""
+        open_for_event = self.open_starts.get(event_id)
+        if not open_for_event:
+            return None
+        # An instance relabeled to this event is listed last but keeps its place in the raw list
+        return max(open_for_event.values(), key=lambda ann: self._positions[id(ann)])
+
+
+def apply_operations(storage_data, operations, index=None):
+    """
+    Replay journal operations on top of a raw storage snapshot (in place).
+
+    - add: append a raw start/end point
+    - update: merge 'changes' into the start or end point of instance 'instanceId';
+      changed 'fields' are copied to the partner point to keep the pair consistent.
+      'changes' never touch the LINK_KEYS (see ``validate_operation``)
+    - delete: remove the start point 'instanceId' and its linked end point
+    - active: replace the client's activeAnnotations map
+
+    Operations that target a missing instance are ignored. Pass the video's
+    AnnotationIndex to keep it current and avoid rebuilding it.
+    """
+    raw_annotations = storage_data.setdefault('annotations', [])
+    if index is None:
+        index = AnnotationIndex(raw_annotations)
+
+    deleted = set()
+    for operation in operations:
+        kind = operation.get('op')
+        if kind == 'add':
+            ann = operation['annotation']
+            raw_annotations.append(ann)
+            index.add(ann)
+        elif kind == 'update':
+            instance_id = operation['instanceId']
+            partner_point = 'end' if operation['point'] == 'start' else 'start'
+            ann = index.point(instance_id, operation['point'])
+            if ann is None:
+                continue
+            ann.update(operation['changes'])
+            partner = index.point(instance_id, partner_point)
+            if 'fields' in operation['changes'] and partner is not None:
+                partner['fields'] = operation['changes']['fields']
+            index.refresh(instance_id)
+        elif kind == 'delete':
+            deleted.update(id(ann) for ann in index.remove(operation['instanceId']))
+        elif kind == 'active':
+            storage_data['activeAnnotations'] = operation['activeAnnotations']
+
+    if deleted:
+        raw_annotations[:] = [ann for ann in raw_annotations if id(ann) not in deleted]
+    return storage_data
+
+
+def _field_matches(value, expected):
+    """Compare a stored field value with a query value (query values are strings)"""
+    if isinstance(value, list):
+        return any(_field_matches(item, expected) for item in value)
+    if isinstance(value, bool):
+        return str(value).lower() == str(expected).lower()
+    return value == expected or str(value) == str(expected)
+
+
+class IntervalIndex:
+    """
+    Time-range queries over the processed annotations of a video.
+
+    A 'complete' record spans [startTime, endTime]; a start whose end has not
+    been set yet is open and spans [time, +inf). Intervals are sorted by start
+    time next to a running maximum of their end times. Both sequences are
+    sorted, so an overlap query is two bisections followed by a scan of the
+    candidates in between; it never walks the intervals that end before t0 or
+    start after t1. Per-event indexes are built on first use.
+    """
+
+    def __init__(self, processed_annotations=(), _entries=None):
+        if _entries is None:
+            _entries = []
+            for ann in processed_annotations:
+                ann_type = ann.get('type')
+                if ann_type == 'complete':
+                    start, end = ann.get('startTime'), ann.get('endTime')
+                elif ann_type == 'start':
+                    start, end = ann.get('time'), math.inf
+                else:
+                    continue
+                if not isinstance(start, (int, float)):
+                    continue
+                if not isinstance(end, (int, float)):
+                    end = start
+                _entries.append((min(start, end), max(start, end), ann))
+            _entries.sort(key=lambda entry: (entry[0], entry[1]))
+
+        self._entries = _entries
+        self._starts = [entry[0] for entry in _entries]
+        self._reach = list(accumulate((entry[1] for entry in _entries), max))
+        self._by_event = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def for_event(self, event_id):
+        """The index restricted to one event"""
+        if self._by_event is None:
+            grouped = {}
+            for entry in self._entries:
+                grouped.setdefault(_event_of(entry[2]), []).append(entry)
+            self._by_event = {key: IntervalIndex(_entries=entries) for key, entries in grouped.items()}
+        return self._by_event.get(event_id) or IntervalIndex()
+
+    def overlapping(self, t0=-math.inf, t1=math.inf):
+        """Records whose interval overlaps [t0, t1], ordered by start time"""
+        low = bisect_left(self._reach, t0)
+        high = bisect_right(self._starts, t1)
+        return [entry[2] for entry in self._entries[low:high] if entry[1] >= t0]
+
+    def at(self, time):
+        """Records active at ``time``"""
+        return self.overlapping(time, time)
+
+    def query(self, start=None, end=None, event_id=None, fields=None):
+        """
+        Records overlapping [start, end] (either bound may be None for
+        unbounded), optionally of one event and with the given field values.
+        """
+        index = self.for_event(event_id) if event_id is not None else self
+        records = index.overlapping(-math.inf if start is None else start, math.inf if end is None else end)
+        if fields:
+            records = [
+                ann for ann in records
+                if all(_field_matches((ann.get('fields') or {}).get(name), value) for name, value in fields.items())
+            ]
+        return records
+
+
+class VideoAnnotations:
+    """
+    In-memory state of one video: raw storage data, its AnnotationIndex and
+    the paired (processed) view, all kept up to date incrementally.
+
+    The 'complete' record of each pair is cached by instance id. Applying
+    operations only drops the cached records of the instances they touch, so
+    rebuilding the processed view after a point edit recomputes just that
+    pair; every other record is reused as is. The output is identical to
+    ``reprocess_raw_annotations`` on the same raw list. The processed list
+    itself is kept until the next change, so reads do not pair the points again.
+    """
+
+    def __init__(self, storage_data):
+        self.storage_data = storage_data
+        self.index = AnnotationIndex(storage_data.setdefault('annotations', []))
+        # instance id -> (start record, end record, complete record)
+        self._complete = {}
+        self._processed = None
+        self._intervals = None
+
+    def apply(self, operations):
+        """Apply journal operations to the raw data and invalidate the affected pairs"""
+        apply_operations(self.storage_data, operations, index=self.index)
+        self._processed = None
+        self._intervals = None
+        for operation in operations:
+            if operation.get('op') in ('update', 'delete'):
+                self._complete.pop(operation.get('instanceId'), None)
+
+    def _build_complete(self, start_ann, end_ann):
+        instance_id = start_ann.get('id')
+        cached = self._complete.get(instance_id)
+        if cached is not None and cached[0] is start_ann and cached[1] is end_ann:
+            return cached[2]
+        complete_ann = _complete_annotation(start_ann, end_ann)
+        self._complete[instance_id] = (start_ann, end_ann, complete_ann)
+        return complete_ann
+
+    def point(self, instance_id, point):
+        """The 'start' or 'end' point of an instance, or None"""
+        return self.index.point(instance_id, point)
+
+    @property
+    def processed(self):
+        """The processed annotation list (same as reprocess_raw_annotations), kept until the next change"""
+        processed = self._processed
+        if processed is None:
+            processed = self._processed = _pair_annotations(self.storage_data['annotations'], self._build_complete)
+        return processed
+
+    @property
+    def intervals(self):
+        """IntervalIndex of the processed view, rebuilt after the next change"""
+        intervals = self._intervals
+        if intervals is None:
+            intervals = self._intervals = IntervalIndex(self.processed)
+        return intervals
+
+
+def read_journal(journal_file_path):
+    """Read the operations recorded in a journal file (empty list if there is none)"""
+    operations = []
+    journal_file_path = Path(journal_file_path)
+    if not journal_file_path.exists():
+        return operations
+    with journal_file_path.open('r') as f, JSON_SECONDS.time(operation='load', kind='annotation_journal'):
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                operations.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn final line from an interrupted append; skip it
+                print(f"Warning: Skipping unreadable journal line in {journal_file_path}")
+        FILE_BYTES_READ.inc(f.tell(), kind='annotation_journal')
+    return operations
+
+
+def create_annotation_service(config):
+    """Create the annotation storage backend selected by ANNOTATION_BACKEND ('json' or 'sqlite')"""
+    backend = config.get('ANNOTATION_BACKEND', 'json')
+    if backend == 'sqlite':
+        from app.services.sqlite_annotation_service import SqliteAnnotationService
+        return SqliteAnnotationService(config['ANNOTATION_DATABASE'], config.get('ANNOTATION_CACHE_SIZE', 64))
+    if backend != 'json':
+        raise ValueError(f"Unknown ANNOTATION_BACKEND '{backend}'. Must be 'json' or 'sqlite'")
+    return AnnotationService()
+
+
+class AnnotationService:
+    """
+    Storage of per-video annotation files.
+
+    Each video has three files in its category folder:
+    - ``<video>.json``: snapshot of the raw start/end points
+    - ``<video>.journal.jsonl``: append-only log of operations since the snapshot
+    - ``<video>_processed.json``: paired view, refreshed whenever the snapshot is
+
+    Saving a delta only appends its operations to the journal, so the cost of a
+    save scales with the size of the change. Once the journal grows past
+    ``ANNOTATION_JOURNAL_COMPACT_BYTES`` it is compacted into the snapshot.
+
+    The state of recently used videos (raw data, AnnotationIndex, processed
+    view) is cached in memory and kept up to date with the operations
+    appended through this service. A cached state is only reused while the
+    snapshot and journal files are unchanged on disk (same inode, mtime and
+    size), so writes from other processes invalidate it. The same file
+    signature is the video's ``version``.
+
+    Files are written compactly unless ``ANNOTATION_JSON_INDENT`` is set.
+
+    Writers hold an exclusive per-video lock (shared across worker processes)
+    and files are replaced atomically, so concurrent annotators do not lose
+    each other's updates and a crash never leaves a truncated file.
+    """
+
+    def __init__(self):
+        # snapshot path -> (file signature, VideoAnnotations), least recently used first
+        self._videos = OrderedDict()
+        self._videos_lock = threading.Lock()
+
+    def paths(self, category_id, filename):
+        category_folder = Path(current_app.config['CATEGORIES_FOLDER']) / category_id
+        stem = filename.rsplit('.', 1)[0]
+        return (
+            category_folder / f"{stem}.json",
+            category_folder / f"{stem}_processed.json",
+            category_folder / f"{stem}.journal.jsonl"
+        )
+
+    @staticmethod
+    def _signature(storage_file_path, journal_file_path):
+        """Identify the on-disk state of a video's snapshot and journal"""
+        signature = []
+        for file_path in (storage_file_path, journal_file_path):
+            try:
+                stat = file_path.stat()
+                # Snapshots are replaced (new inode), journals only grow
+                signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _cached_state(self, storage_file_path, signature):
+        with self._videos_lock:
+            cached = self._videos.get(str(storage_file_path))
+            if cached is None or cached[0] != signature:
+                return None
+            self._videos.move_to_end(str(storage_file_path))
+            return cached[1]
+
+    def _cache_state(self, storage_file_path, signature, state):
+        with self._videos_lock:
+            self._videos[str(storage_file_path)] = (signature, state)
+            self._videos.move_to_end(str(storage_file_path))
+            while len(self._videos) > current_app.config['ANNOTATION_CACHE_SIZE']:
+                self._videos.popitem(last=False)
+
+    @staticmethod
+    def _lock(storage_file_path, shared=False):
+        """Per-video lock, shared by all worker processes"""
+        return file_lock(storage_file_path, current_app.config['LOCKS_FOLDER'], shared=shared)
+
+    def _state(self, category_id, filename, locked=False):
+        """
+        The cached VideoAnnotations of a video (read from disk if stale), or None.
+        Pass locked=True when the caller already holds the video's lock.
+        """
+        storage_file_path, _, journal_file_path = self.paths(category_id, filename)
+        state = self._cached_state(storage_file_path, self._signature(storage_file_path, journal_file_path))
+        if state is not None:
+            return state
+
+        if locked:
+            signature = self._signature(storage_file_path, journal_file_path)
+            storage_data = self._read(category_id, filename)
+        else:
+            # Snapshot and journal must be read together, not halfway through a compaction
+            with self._lock(storage_file_path, shared=True):
+                signature = self._signature(storage_file_path, journal_file_path)
+                storage_data = self._read(category_id, filename)
+        if storage_data is None:
+            return None
+        state = VideoAnnotations(storage_data)
+        self._cache_state(storage_file_path, signature, state)
+        return state
+
+    def exists(self, category_id, filename):
+        storage_file_path, _, journal_file_path = self.paths(category_id, filename)
+        return storage_file_path.exists() or journal_file_path.exists()
+
+    def version(self, category_id, filename):
+        """
+        Version of a video's annotations, derived from the on-disk state of its
+        snapshot and journal (so every worker process agrees on it), or None if
+        it has no data
+        """
+        storage_file_path, _, journal_file_path = self.paths(category_id, filename)
+        signature = self._signature(storage_file_path, journal_file_path)
+        return self._version(signature)
+
+    @staticmethod
+    def _version(signature):
+        if signature == (None, None):
+            return None
+        return hashlib.sha1(repr(signature).encode('ascii')).hexdigest()[:16]
+
+    def videos(self):
+        """
+        (category_id, filename) of every video with annotation data. The
+        filename is that of the snapshot, which addresses the same video as
+        the video's own file name; its 'video_name' is in the loaded data.
+        """
+        categories_folder = Path(current_app.config['CATEGORIES_FOLDER'])
+        if not categories_folder.is_dir():
+            return []
+        videos = []
+        for category_folder in sorted(categories_folder.iterdir()):
+            if not category_folder.is_dir():
+                continue
+            stems = {path.stem for path in category_folder.glob('*.json')}
+            stems.update(path.name[:-len('.journal.jsonl')] for path in category_folder.glob('*.journal.jsonl'))
+            for stem in sorted(stems):
+                if stem == 'config' or stem.startswith('.') or stem.endswith('_processed'):
+                    continue
+                videos.append((category_folder.name, f"{stem}.json"))
+        return videos
+
+    def _read(self, category_id, filename):
+        """Read the raw storage data from disk (snapshot plus journal replay), or None"""
+        storage_file_path, _, journal_file_path = self.paths(category_id, filename)
+        if not storage_file_path.exists() and not journal_file_path.exists():
+            return None
+
+        if storage_file_path.exists():
+            with storage_file_path.open('r') as f, JSON_SECONDS.time(operation='load', kind='annotation_snapshot'):
+                storage_data = json.load(f)
+                FILE_BYTES_READ.inc(f.tell(), kind='annotation_snapshot')
+        else:
+            storage_data = self.empty(category_id, filename)
+
+        operations = read_journal(journal_file_path)
+        if operations:
+            apply_operations(storage_data, operations)
+        return storage_data
+
+    def load(self, category_id, filename):
+        """
+        Load the current raw storage data (snapshot plus journal replay).
+        Returns None if the video has no annotation data yet.
+
+        The returned dict and list are copies; the annotation records are shared
+        with the cache and must not be modified.
+        """
+        state = self._state(category_id, filename)
+        if state is None:
+            return None
+        return dict(state.storage_data, annotations=list(state.storage_data['annotations']))
+
+    def load_versioned(self, category_id, filename):
+        """(``load`` result, version), read together so the version is exactly that of the data"""
+        storage_file_path, _, _ = self.paths(category_id, filename)
+        with self._lock(storage_file_path, shared=True):
+            state = self._state(category_id, filename, locked=True)
+            if state is None:
+                return None, None
+            storage_data = dict(state.storage_data, annotations=list(state.storage_data['annotations']))
+            return storage_data, self.version(category_id, filename)
+
+    @staticmethod
+    def empty(category_id, filename):
+        return {
+            "video_name": filename,
+            "category_id": category_id,
+            "annotations": [],
+            "activeAnnotations": {}
+        }
+
+    def load_processed(self, category_id, filename):
+        """
+        Return the processed (paired) annotation list of a video, or None if it
+        has no annotation data. Served from the cached state when it is current.
+
+        The returned list is a copy; the records are shared with the cache and
+        must not be modified.
+        """
+        state = self._state(category_id, filename)
+        return list(state.processed) if state is not None else None
+
+    def save(self, category_id, filename, storage_data, on_commit=None):
+        """
+        Write a full snapshot (raw and processed files) and reset the journal;
+        returns the new version. ``on_commit(version)`` is called before the
+        video is unlocked, so changes are announced in the order they were made.
+        """
+        storage_file_path, _, _ = self.paths(category_id, filename)
+        storage_file_path.parent.mkdir(parents=True, exist_ok=True)
+        state = VideoAnnotations(dict(storage_data, annotations=list(storage_data.get('annotations', []))))
+        with self._lock(storage_file_path):
+            version = self._save_locked(category_id, filename, state)
+            if on_commit is not None:
+                on_commit(version)
+            return version
+
+    def _save_locked(self, category_id, filename, state):
+        storage_file_path, processed_file_path, journal_file_path = self.paths(category_id, filename)
+        storage_data = state.storage_data
+
+        indent = current_app.config.get('ANNOTATION_JSON_INDENT')
+        # Without indentation the separators carry no spaces either
+        layout = {'indent': indent} if indent is not None else {'separators': (',', ':')}
+        atomic_write_json(storage_file_path, storage_data, kind='annotation_snapshot', **layout)
+
+        # --- Process raw annotations to create 'complete' and unpaired 'start' annotations ---
+        processed_data_to_save = {
+            "video_name": storage_data.get('video_name', filename),
+            "category_id": storage_data.get('category_id', category_id),
+            "annotations": state.processed,
+            "activeAnnotations": storage_data.get('activeAnnotations', {})
+        }
+        atomic_write_json(processed_file_path, processed_data_to_save, kind='annotation_processed', **layout)
+
+        if journal_file_path.exists():
+            journal_file_path.unlink()
+
+        signature = self._signature(storage_file_path, journal_file_path)
+        self._cache_state(storage_file_path, signature, state)
+        return self._version(signature)
+
+    def append_operations(self, category_id, filename, operations, on_commit=None):
+        """
+        Append operations to the video's journal, compacting it when it grows
+        past the configured size. Returns the new version, read while the
+        video is still locked so it is exactly the state these operations
+        produced. ``on_commit(version, operations)`` is called before the
+        video is unlocked, so changes are announced in the order they were made.
+        """
+        storage_file_path, _, _ = self.paths(category_id, filename)
+        storage_file_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock(storage_file_path):
+            version = self._append_locked(category_id, filename, operations)
+            if on_commit is not None:
+                on_commit(version, operations)
+            return version
+
+    def append_planned(self, category_id, filename, plan, on_commit=None):
+        """
+        Decide the operations from the video's current state and append them,
+        holding the video's lock throughout so no other write lands between
+        the read and the append.
+
+        ``plan(video)`` gets the video's VideoAnnotations (None if it has no
+        data; not to be modified) and returns (operations, result). Returns
+        (new version, result); the version is None when there was nothing to
+        append. ``on_commit`` is called as for ``append_operations``.
+        """
+        storage_file_path, _, _ = self.paths(category_id, filename)
+        storage_file_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock(storage_file_path):
+            operations, result = plan(self._state(category_id, filename, locked=True))
+            if not operations:
+                return None, result
+            version = self._append_locked(category_id, filename, operations)
+            if on_commit is not None:
+                on_commit(version, operations)
+            return version, result
+
+    def _append_locked(self, category_id, filename, operations):
+        storage_file_path, _, journal_file_path = self.paths(category_id, filename)
+        with JSON_SECONDS.time(operation='dump', kind='annotation_journal'):
+            payload = ''.join(json.dumps(op, separators=(',', ':')) + '\n' for op in operations).encode('utf-8')
+
+        state = self._cached_state(storage_file_path, self._signature(storage_file_path, journal_file_path))
+
+        # A single O_APPEND write; a torn line from a crash is skipped on replay
+        fd = os.open(journal_file_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, payload)
+        finally:
+            os.close(fd)
+        FILE_BYTES_WRITTEN.inc(len(payload), kind='annotation_journal')
+
+        signature = self._signature(storage_file_path, journal_file_path)
+        if state is not None:
+            # Update the cached state in place: index lookups plus the touched pairs only
+            state.apply(operations)
+            self._cache_state(storage_file_path, signature, state)
+
+        if journal_file_path.stat().st_size >= current_app.config['ANNOTATION_JOURNAL_COMPACT_BYTES']:
+            self._compact_locked(category_id, filename)
+            signature = self._signature(storage_file_path, journal_file_path)
+        return self._version(signature)
+
+    def compact(self, category_id, filename):
+        """Fold the journal into the snapshot files"""
+        storage_file_path, _, _ = self.paths(category_id, filename)
+        with self._lock(storage_file_path):
+            return self._compact_locked(category_id, filename)
+
+    def _compact_locked(self, category_id, filename):
+        state = self._state(category_id, filename, locked=True)
+        if state is None:
+            return None
+        self._save_locked(category_id, filename, state)
+        return state.storage_data
+
+    def delete_video(self, category_id, filename):
+        """Remove a video's snapshot, processed view and journal; returns whether it had any data"""
+        storage_file_path, processed_file_path, journal_file_path = self.paths(category_id, filename)
+        with self._lock(storage_file_path):
+            existed = storage_file_path.exists() or journal_file_path.exists()
+            for file_path in (storage_file_path, processed_file_path, journal_file_path):
+                file_path.unlink(missing_ok=True)
+            with self._videos_lock:
+                self._videos.pop(str(storage_file_path), None)
+        return existed
+
+    def delete_category(self, category_id):
+        """Remove the annotation files of every video of a category; returns the number of videos removed"""
+        return sum(
+            self.delete_video(video_category, filename)
+            for video_category, filename in self.videos() if video_category == category_id
+        )
+
+    def interval_index(self, category_id, filename):
+        """IntervalIndex over the processed annotations of a video, or None if it has no data"""
+        state = self._state(category_id, filename)
+        return state.intervals if state is not None else None
+
+    def event_state(self, category_id, filename, event_id):
+        """
+        Return (active, startTime) for an event: active if it has a start point
+        without an end, startTime of the most recent such start
+        """
+        state = self._state(category_id, filename)
+        open_start = state.index.open_start(event_id) if state is not None else None
+        if open_start is None:
+            return False, None
+        return True, open_start.get('time')
@@ -0,0 +1,164 @@
+"""
+Batches of annotation operations across many videos.
+
+A batch is a list of journal operations (see ``apply_operations``), each
+naming its video with 'categoryId' and 'filename', plus two bulk operations
+that expand into point updates:
+- shift: {'op': 'shift', 'offset': seconds[, 'eventId']} moves every start
+  and end point of the video (or of one event) by ``offset``
+- relabel: {'op': 'relabel', 'from': event id, 'to': event id} moves every
+  point of an event to another event, and the event's entry in the
+  client's activeAnnotations map with them
+
+Operations are grouped by video. ``plan_video_operations`` checks and expands
+the operations of one video in order against its current data, so the caller
+can plan and append them under the video's lock with one write and report a
+result per operation.
+"""
+
+from collections import OrderedDict
+
+from app.services.annotation_service import AnnotationIndex, JOURNAL_OPERATIONS, apply_operations, validate_operation
+
+BULK_OPERATIONS = ('shift', 'relabel')
+BATCH_OPERATIONS = JOURNAL_OPERATIONS + BULK_OPERATIONS
+
+# Shifted times are rounded so repeated shifts do not accumulate float noise
+TIME_DECIMALS = 6
+
+
+def _event_of(ann):
+    return ann.get('eventId', ann.get('event'))
+
+
+def _valid_name(name):
+    return isinstance(name, str) and name and '/' not in name and '\\' not in name and not name.startswith('.')
+
+
+def validate_batch_operation(operation):
+    """Return an error message if a batch operation is malformed, otherwise None"""
+    if not isinstance(operation, dict):
+        return 'Operation must be an object'
+    if not _valid_name(operation.get('categoryId')):
+        return "Operation requires a valid 'categoryId'"
+    if not _valid_name(operation.get('filename')):
+        return "Operation requires a valid 'filename'"
+
+    kind = operation.get('op')
+    if kind == 'shift':
+        offset = operation.get('offset')
+        if not isinstance(offset, (int, float)) or isinstance(offset, bool):
+            return "'shift' requires a numeric 'offset'"
+        return None
+    if kind == 'relabel':
+        if not operation.get('from') or not operation.get('to'):
+            return "'relabel' requires 'from' and 'to' event ids"
+        return None
+    if kind not in BATCH_OPERATIONS:
+        return f"Unknown operation '{kind}'. Must be one of {', '.join(BATCH_OPERATIONS)}"
+    return validate_operation(operation)
+
+
+def group_batch_operations(operations):
+    """
+    Group valid operations by video, keeping their order.
+    Returns ({(category_id, filename): [(position, operation)]}, {position: error}).
+    """
+    groups = OrderedDict()
+    errors = {}
+    for position, operation in enumerate(operations):
+        error = validate_batch_operation(operation)
+        if error:
+            errors[position] = error
+            continue
+        # Videos are stored by file stem, whatever the extension
+        key = (operation['categoryId'], operation['filename'].rsplit('.', 1)[0])
+        groups.setdefault(key, []).append((position, operation))
+    return groups, errors
+
+
+def _journal_operation(operation):
+    return {key: value for key, value in operation.items() if key not in ('categoryId', 'filename')}
+
+
+def _bulk_updates(index, operation):
+    """The point updates a shift or relabel expands to"""
+    updates = []
+    for instance_id in index.instance_ids():
+        for point in ('start', 'end'):
+            ann = index.point(instance_id, point)
+            if ann is None:
+                continue
+            if operation['op'] == 'shift':
+                if 'eventId' in operation and _event_of(ann) != operation['eventId']:
+                    continue
+                if not isinstance(ann.get('time'), (int, float)):
+                    continue
+                changes = {'time': round(ann['time'] + operation['offset'], TIME_DECIMALS)}
+            else:
+                if _event_of(ann) != operation['from']:
+                    continue
+                changes = {'eventId': operation['to']}
+            updates.append({'op': 'update', 'instanceId': instance_id, 'point': point, 'changes': changes})
+    return updates
+
+
+def _relabel_active(active_annotations, operation):
+    """activeAnnotations with the relabelled event's entry moved to its new id, or None if it has none"""
+    entry = active_annotations.get(operation['from'])
+    if entry is None:
+        return None
+    relabelled = {event_id: ann for event_id, ann in active_annotations.items() if event_id != operation['from']}
+    if isinstance(entry, dict) and 'eventId' in entry:
+        entry = dict(entry, eventId=operation['to'])
+    # An entry already open under the new id stays; the client tracks one per event
+    relabelled.setdefault(operation['to'], entry)
+    return relabelled
+
+
+def plan_video_operations(storage_data, operations):
+    """
+    Check and expand the operations of one video, in order.
+
+    ``storage_data`` is the video's current raw data (None if it has none yet)
+    and is not modified. Returns (journal operations to append, {position:
+    result}); each result has a 'status' ('applied' or 'not_found') and, for
+    shift and relabel, the number of points 'changed'. Shift and relabel on a
+    video without data are 'not_found'. Operations that would not change
+    anything are left out of the journal.
+    """
+    # Copies of the points, so the checks can follow the batch's own changes
+    annotations = [dict(ann) for ann in (storage_data or {}).get('annotations', [])]
+    index = AnnotationIndex(annotations)
+    # Only the index and the active map are kept current; the list holds nothing but this batch's additions
+    working = {'annotations': [], 'activeAnnotations': dict((storage_data or {}).get('activeAnnotations') or {})}
+
+    journal = []
+    results = {}
+    for position, operation in operations:
+        kind = operation['op']
+        if kind in BULK_OPERATIONS and storage_data is None and not journal:
+            expanded = []
+            results[position] = {'status': 'not_found'}
+        elif kind in BULK_OPERATIONS:
+            expanded = _bulk_updates(index, operation)
+            results[position] = {'status': 'applied', 'changed': len(expanded)}
+            active_annotations = _relabel_active(working['activeAnnotations'], operation) if kind == 'relabel' else None
+            if active_annotations is not None:
+                expanded.append({'op': 'active', 'activeAnnotations': active_annotations})
+        elif kind == 'update' and index.point(operation['instanceId'], operation['point']) is None:
+            expanded = []
+            results[position] = {'status': 'not_found'}
+        elif kind == 'delete' and not any(index.point(operation['instanceId'], point) for point in ('start', 'end')):
+            expanded = []
+            results[position] = {'status': 'not_found'}
+        else:
+            expanded = [_journal_operation(operation)]
+            results[position] = {'status': 'applied'}
+        if expanded:
+            journal.extend(expanded)
+            # Added records go to the journal as sent; the index follows copies of them
+            apply_operations(working, [
+                dict(op, annotation=dict(op['annotation'])) if op['op'] == 'add' else op for op in expanded
+            ], index)
+    return journal, results
@@ -0,0 +1,106 @@
+from copy import deepcopy
+from pathlib import Path
+from app.services.file_utils import atomic_write_json
+from app.services.metrics_service import JSON_SECONDS, FILE_BYTES_READ, CONFIG_COPY_SECONDS
+import json
+import threading
+
+
+class CategoryRegistry:
+    """
+    In-process cache of the category/event configuration file.
+
+    The file is parsed once and served from memory; lookups of a category, an
+    event or an event's custom fields are dict lookups. Every access
+    compares the file's mtime and size with the parsed version (one stat), so
+    edits made by hand or by another worker process are picked up, and saves
+    through the API refresh the cache directly without re-reading the file.
+
+    The data returned by ``load()`` is shared and must not be modified; use
+    ``load(copy=True)`` to get a copy to edit and ``save()``.
+    """
+
+    def __init__(self, config_file):
+        self.config_file = Path(config_file)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._data = None
+        self._categories = {}
+        self._events = {}
+
+    def _file_signature(self):
+        try:
+            stat = self.config_file.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _index(self, data, signature):
+        categories = {}
+        events = {}
+        for category in data.get('annotation_categories', []):
+            category_id = category.get('id')
+            categories.setdefault(category_id, category)
+            for event in category.get('events', []):
+                key = (category_id, event.get('id'))
+                events.setdefault(key, event)
+
+        with self._lock:
+            self._data = data
+            self._categories = categories
+            self._events = events
+            self._signature = signature
+
+    def _refresh(self):
+        signature = self._file_signature()
+        if signature is None:
+            raise FileNotFoundError(f"Configuration file not found: {self.config_file}")
+        if signature == self._signature:
+            return
+        with self.config_file.open('r') as f, JSON_SECONDS.time(operation='load', kind='config'):
+            data = json.load(f)
+            FILE_BYTES_READ.inc(f.tell(), kind='config')
+        self._index(data, signature)
+
+    def exists(self):
+        return self._file_signature() is not None
+
+    def invalidate(self):
+        """Force the next access to re-read the file"""
+        with self._lock:
+            self._signature = None
+
+    def load(self, copy=False):
+        """The parsed configuration file; pass copy=True to get a copy safe to modify"""
+        self._refresh()
+        if not copy:
+            return self._data
+        with CONFIG_COPY_SECONDS.time():
+            return deepcopy(self._data)
+
+    def save(self, data):
+        """Write the configuration file and refresh the cache from ``data``"""
+        self.config_file.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(self.config_file, data, kind='config', indent=4)
+        # Keep our own copy so later changes by the caller do not leak into the cache
+        self._index(deepcopy(data), self._file_signature())
+
+    def categories(self):
+        return self.load().get('annotation_categories', [])
+
+    def category(self, category_id):
+        """The category with this id, or None"""
+        self._refresh()
+        return self._categories.get(category_id)
+
+    def event(self, category_id, event_id):
+        """The event ``event_id`` of a category, or None"""
+        self._refresh()
+        return self._events.get((category_id, event_id))
+
+    def event_fields(self, category_id, event_id):
+        """The custom fields of an event (empty if it has none), or None if there is no such event"""
+        event = self.event(category_id, event_id)
+        if event is None:
+            return None
+        return event.get('customFields') or []
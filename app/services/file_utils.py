@@ -0,0 +1,82 @@
+"""
+Cross-process file locking and atomic file writes.
+
+Several worker processes may read-modify-write the same JSON files. Writers
+hold an exclusive lock per file (per video, per config file) while they
+read, modify and replace it; readers that need a consistent view of several
+files take a shared lock. Files are written to a temporary file in the same
+folder and moved into place with ``os.replace``, so a crash never leaves a
+truncated file behind.
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from app.services.metrics_service import JSON_SECONDS, FILE_BYTES_WRITTEN
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock_path(path, lock_folder):
+    lock_folder = Path(lock_folder)
+    lock_folder.mkdir(parents=True, exist_ok=True)
+    key = hashlib.sha1(str(Path(path).resolve()).encode('utf-8')).hexdigest()
+    return lock_folder / f"{key}.lock"
+
+
+@contextmanager
+def file_lock(path, lock_folder, shared=False):
+    """
+    Hold a lock on ``path`` across processes (and threads) for the duration of
+    the block. Locks are not re-entrant: do not take the same lock twice.
+    On Windows shared locks are exclusive.
+    """
+    with open(_lock_path(path, lock_folder), 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write_json(path, data, kind='other', **dump_kwargs):
+    """
+    Write ``data`` as JSON to ``path`` through a temporary file and os.replace.
+    ``kind`` labels the write in the JSON time and bytes written metrics.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            start = time.perf_counter()
+            json.dump(data, f, **dump_kwargs)
+            JSON_SECONDS.observe(time.perf_counter() - start, operation='dump', kind=kind)
+            FILE_BYTES_WRITTEN.inc(f.tell(), kind=kind)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file private to the owner; use regular file permissions
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
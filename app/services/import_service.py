@@ -0,0 +1,361 @@
+"""
+Batch conversion of external annotation files into TAAT's formats.
+
+Two sources are supported:
+- ``superannotate``: SuperAnnotate video exports, converted into the detailed
+  (start/end points, as stored per video) and the concise ('complete'
+  intervals) TAAT formats
+- ``soccernet``: SoccerNet-style files ({'annotations': [...]} or
+  {'version', 'videos': [...]}) whose 'gameTime' values get a 'seconds' field
+
+Files are converted across a process pool. A file whose output is newer than
+the input is skipped, an unchanged file is not rewritten, and outputs are
+written atomically, so an interrupted import can simply be run again. The
+video each SuperAnnotate export was written to is recorded in the output
+folder, so up-to-date exports are skipped without being read.
+
+Detailed files are written the way the app saves a video: under the video's
+lock, with its processed file refreshed and its journal removed, so the
+import can target a category folder the app is serving.
+
+Usage:
+    python -m app.services.import_service superannotate <input dir> <output dir> [--concise <dir>] [--category <id>]
+    python -m app.services.import_service soccernet <input dir> [--output <dir>]
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import json
+import os
+import re
+
+from app.services.annotation_service import reprocess_raw_annotations
+from app.services.file_utils import atomic_write_json, file_lock
+from config.config import Config
+
+# "<half> - HH:MM:SS" and "<half> - MM:SS(.mmm)"
+GAME_TIME_HMS = re.compile(r"(\d+) - (\d{2}):(\d{2}):(\d{2})")
+GAME_TIME_MS = re.compile(r"(\d+) - (\d+):(\d+)")
+
+# Files handed to a worker process at a time
+IMPORT_CHUNK_SIZE = 16
+
+PERSON_ORDINALS = ('1st', '2nd', '3rd', '4th', '5th', '6th')
+
+# Input file name -> output stem of the SuperAnnotate exports imported into a folder
+IMPORT_MANIFEST_NAME = '.superannotate_import.json'
+
+
+# --- SoccerNet game times ---
+
+def game_time_to_seconds(game_time):
+    """Convert a game time string to seconds into the half, or None if it is not one"""
+    match = GAME_TIME_HMS.match(game_time)
+    if match:
+        _, hours, minutes, seconds = map(int, match.groups())
+        return hours * 60 * 60 + minutes * 60 + seconds
+    match = GAME_TIME_MS.match(game_time)
+    if match:
+        _, minutes, seconds = map(int, match.groups())
+        return minutes * 60 + seconds
+    return None
+
+
+def _add_seconds(annotations):
+    changed = False
+    for annotation in annotations:
+        if "seconds" not in annotation and "gameTime" in annotation:
+            annotation["seconds"] = game_time_to_seconds(annotation["gameTime"])
+            changed = True
+    return changed
+
+
+def add_seconds(data, video_stem=None):
+    """
+    Add 'seconds' to the annotations of a SoccerNet-style file that only have a 'gameTime'.
+
+    In the multi-video format only the video whose file stem is ``video_stem``
+    is updated (every video if None). Returns (changed, index of that video).
+    """
+    if "version" in data and "videos" in data:
+        changed = False
+        for index, video in enumerate(data["videos"]):
+            stem = video['path'].split("/")[-1].split(".")[0]
+            if video_stem is None:
+                changed = _add_seconds(video.get("annotations", [])) or changed
+            elif stem == video_stem:
+                return _add_seconds(video.get("annotations", [])), index
+        return changed, None
+    if isinstance(data, dict) and "annotations" in data:
+        return _add_seconds(data["annotations"]), None
+    raise ValueError("Unsupported JSON structure: expected a specific format.")
+
+
+# --- SuperAnnotate ---
+
+def superannotate_fields(event_id, attributes):
+    """The TAAT custom fields of an event, filled from SuperAnnotate attributes"""
+    if not isinstance(attributes, dict):
+        attributes = {}
+    if event_id == "other_person_talking":
+        return {
+            "1st Person Age Group": attributes.get("1st Person Age Group", ""),
+            "1st Person Gender": attributes.get("1st Person Gender", "")
+        }
+    if event_id == "overheard_speech":
+        return {}
+    if event_id == "location":
+        return {"Type of Location": attributes.get("Type of Location", "")}
+
+    fields = {"Alone?": attributes.get("Alone?", "")}
+    for ordinal in PERSON_ORDINALS:
+        fields[f"{ordinal} Person Age Group"] = attributes.get(f"{ordinal} Person Age Group", "")
+        fields[f"{ordinal} Person Gender"] = attributes.get(f"{ordinal} Person Gender", "")
+    return fields
+
+
+def superannotate_instances(sa_data):
+    """
+    The event instances of a SuperAnnotate export as
+    (event id, start seconds, end seconds, attributes, instance id).
+    Instances without times, attributes or a class are skipped.
+    """
+    instances = []
+    for instance in sa_data.get("instances", []):
+        meta = instance.get("meta", {})
+        if meta.get("type") != "event":
+            continue
+        class_name = meta.get("className")
+        instance_id = meta.get("id")
+
+        parameters = instance.get("parameters") or [{}]
+        # Event times are in microseconds
+        start, end = parameters[0].get("start"), parameters[0].get("end")
+        timestamps = parameters[0].get("timestamps")
+        if start is None or end is None or not timestamps:
+            print(f"Skipping instance (ID: {instance_id}): missing times or timestamps.")
+            continue
+
+        attributes = {
+            attr.get("groupName"): attr.get("name")
+            for attr in timestamps[0].get("attributes", [])
+            if attr.get("groupName") and attr.get("name") is not None
+        }
+
+        if class_name == "Location":
+            event_id = "location"
+            attributes = {"Type of Location": attributes.get("Type of Location")}
+        elif class_name == "Action":
+            action = attributes.get("Type of Action")
+            if not action:
+                print(f"Skipping 'Action' instance (ID: {instance_id}): 'Type of Action' attribute missing.")
+                continue
+            event_id = action.lower().replace(" ", "_")
+        elif class_name:
+            event_id = class_name.lower().replace(" ", "_")
+        else:
+            print(f"Skipping instance (ID: {instance_id}): 'className' is missing in meta.")
+            continue
+
+        instances.append((event_id, float(start) / 1_000_000.0, float(end) / 1_000_000.0, attributes, instance_id))
+    return instances
+
+
+def convert_superannotate(sa_data, category_id, default_video_name="unknown.mp4"):
+    """
+    Convert a SuperAnnotate export into (video name, detailed TAAT data, concise TAAT data).
+    Instances without a SuperAnnotate id get '<event>_<position>' ids.
+    """
+    video_name = sa_data.get("metadata", {}).get("name", default_video_name)
+    detailed = []
+    concise = []
+    for position, (event_id, start_time, end_time, attributes, instance_id) in enumerate(superannotate_instances(sa_data)):
+        fields = superannotate_fields(event_id, attributes)
+        start_id = instance_id or f"{event_id}_{position}"
+        common = {"categoryId": category_id, "eventId": event_id}
+        detailed.append(dict(
+            common, id=start_id, time=start_time, fields=fields, type="start", videoName=video_name
+        ))
+        detailed.append(dict(
+            common, time=end_time, type="end", startAnnotationId=start_id, fields=fields, videoName=video_name
+        ))
+        concise.append(dict(
+            common, time=start_time, fields=fields, type="complete", videoName=video_name,
+            startTime=start_time, endTime=end_time, duration=end_time - start_time
+        ))
+
+    def taat(annotations):
+        return {"video_name": video_name, "category_id": category_id, "annotations": annotations, "activeAnnotations": {}}
+
+    return video_name, taat(detailed), taat(concise)
+
+
+# --- Per-file workers (run in the process pool) ---
+
+def _is_fresh(output_path, input_mtime):
+    try:
+        return output_path.stat().st_mtime >= input_mtime
+    except FileNotFoundError:
+        return False
+
+
+def _superannotate_outputs(stem, output_folder, concise_folder):
+    """The detailed and (if wanted) concise output paths of a video"""
+    outputs = [Path(output_folder) / f"{stem}.json"]
+    if concise_folder:
+        outputs.append(Path(concise_folder) / f"{stem}.json")
+    return outputs
+
+
+def write_video_annotations(path, data, lock_folder):
+    """
+    Write a detailed TAAT file as the app saves a video: under the video's
+    lock, refreshing its processed file and removing its journal, whose
+    changes were made on top of the replaced annotations
+    """
+    path = Path(path)
+    processed_path = path.with_name(f"{path.stem}_processed.json")
+    journal_path = path.with_name(f"{path.stem}.journal.jsonl")
+    with file_lock(path, lock_folder):
+        atomic_write_json(path, data, indent=4)
+        if processed_path.exists() or journal_path.exists():
+            processed = dict(data, annotations=reprocess_raw_annotations(data["annotations"]))
+            atomic_write_json(processed_path, processed, indent=4)
+        if journal_path.exists():
+            journal_path.unlink()
+
+
+def import_superannotate_file(input_path, output_folder, concise_folder, category_id, force=False,
+                              known_stem=None, lock_folder=Config.LOCKS_FOLDER):
+    """
+    Convert one SuperAnnotate export. ``known_stem`` is the output stem an
+    earlier import recorded for it. Returns (status, input path, detail); the
+    detail of a converted or up-to-date file is its detailed output path.
+    """
+    input_path = Path(input_path)
+    input_mtime = input_path.stat().st_mtime
+    if known_stem and not force:
+        # Checked before reading the export: skipping it costs two stats
+        outputs = _superannotate_outputs(known_stem, output_folder, concise_folder)
+        if all(_is_fresh(path, input_mtime) for path in outputs):
+            return 'skipped', str(input_path), str(outputs[0])
+
+    with input_path.open('r') as f:
+        sa_data = json.load(f)
+
+    video_name, detailed, concise = convert_superannotate(sa_data, category_id)
+    if not detailed["annotations"]:
+        return 'empty', str(input_path), 'no event instances'
+    # Outputs are named after the video, so without a recorded stem they are only known once the file is read
+    stem = Path(video_name).stem or input_path.stem
+    outputs = _superannotate_outputs(stem, output_folder, concise_folder)
+
+    if not force and all(_is_fresh(path, input_mtime) for path in outputs):
+        return 'skipped', str(input_path), str(outputs[0])
+    write_video_annotations(outputs[0], detailed, lock_folder)
+    if concise_folder:
+        atomic_write_json(outputs[1], concise, indent=4)
+    return 'converted', str(input_path), str(outputs[0])
+
+
+def read_import_manifest(output_folder):
+    """The output stems recorded by earlier SuperAnnotate imports into a folder"""
+    try:
+        with (Path(output_folder) / IMPORT_MANIFEST_NAME).open('r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def import_soccernet_file(input_path, output_folder=None, force=False):
+    """Add 'seconds' to one SoccerNet-style file (in place or into output_folder)."""
+    input_path = Path(input_path)
+    output_path = Path(output_folder) / input_path.name if output_folder else input_path
+    if output_folder and not force and _is_fresh(output_path, input_path.stat().st_mtime):
+        return 'skipped', str(input_path), 'up to date'
+
+    with input_path.open('r') as f:
+        data = json.load(f)
+    changed, _ = add_seconds(data)
+    if not changed and output_path == input_path:
+        return 'unchanged', str(input_path), 'no game times without seconds'
+    atomic_write_json(output_path, data, indent=4, ensure_ascii=False)
+    return 'converted', str(input_path), str(output_path)
+
+
+def _run_job(job):
+    function, args = job
+    try:
+        return function(*args)
+    except Exception as e:
+        return 'error', str(args[0]), str(e)
+
+
+def run_import(jobs, workers=None):
+    """Run (function, args) jobs across a process pool. Returns {status: [(input, detail)]}."""
+    results = {}
+    if workers == 1:
+        outcomes = map(_run_job, jobs)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        outcomes = executor.map(_run_job, jobs, chunksize=IMPORT_CHUNK_SIZE)
+    try:
+        for status, input_path, detail in outcomes:
+            results.setdefault(status, []).append((input_path, detail))
+            if status == 'error':
+                print(f"Error importing {input_path}: {detail}")
+    finally:
+        if workers != 1:
+            executor.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a directory of annotation files into TAAT formats')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='convert files whose output is up to date too')
+    sources = parser.add_subparsers(dest='source', required=True)
+
+    superannotate = sources.add_parser('superannotate', help='SuperAnnotate video exports')
+    superannotate.add_argument('input_folder')
+    superannotate.add_argument('output_folder', help='detailed (start/end) TAAT files')
+    superannotate.add_argument('--concise', help='folder for the concise (complete interval) TAAT files')
+    superannotate.add_argument('--category', default='human_actions', help='category id of the annotations')
+    superannotate.add_argument('--locks', default=Config.LOCKS_FOLDER, help="the app's lock folder (LOCKS_FOLDER)")
+
+    soccernet = sources.add_parser('soccernet', help="SoccerNet-style files: add 'seconds' to 'gameTime' events")
+    soccernet.add_argument('input_folder')
+    soccernet.add_argument('--output', help='write the updated files here instead of in place')
+
+    args = parser.parse_args()
+    input_files = sorted(Path(args.input_folder).glob('*.json'))
+    if args.source == 'superannotate':
+        for folder in (args.output_folder, args.concise):
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+        manifest = read_import_manifest(args.output_folder)
+        jobs = [
+            (import_superannotate_file, (
+                path, args.output_folder, args.concise, args.category, args.force, manifest.get(path.name), args.locks
+            ))
+            for path in input_files
+        ]
+    else:
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+        jobs = [(import_soccernet_file, (path, args.output, args.force)) for path in input_files]
+
+    results = run_import(jobs, args.workers)
+    if args.source == 'superannotate':
+        for status in ('converted', 'skipped'):
+            manifest.update((Path(input_path).name, Path(output).stem) for input_path, output in results.get(status, []))
+        atomic_write_json(Path(args.output_folder) / IMPORT_MANIFEST_NAME, manifest, indent=4)
+    summary = ', '.join(f"{status}: {len(files)}" for status, files in sorted(results.items()))
+    print(f"Imported {len(input_files)} files from {args.input_folder} ({summary or 'nothing to do'})")
+    return 1 if 'error' in results else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+from pathlib import Path
+from app.services.file_utils import atomic_write_json
+import os
+import tempfile
+
+# numpy is imported by the functions using it, so loading the app does not pay for it
+
+# Frames painted at a time; bounds the int32 scratch buffer to
+# PAINT_BLOCK_FRAMES x events whatever the length of the video
+PAINT_BLOCK_FRAMES = 65536
+
+EXPORT_FORMATS = ('auto', 'npz', 'npy')
+
+
+def _event_of(ann):
+    return ann.get('eventId', ann.get('event'))
+
+
+def frame_spans(processed_annotations, event_ids, fps, frame_count):
+    """
+    Frame ranges of the completed intervals of the given events.
+
+    Returns three int arrays (column, first frame, stop frame): frame i, shown
+    at i / fps, is labelled when startTime <= i / fps < endTime. Open starts
+    (no end yet), other events and empty ranges are left out.
+    """
+    import numpy as np
+    columns = {event_id: column for column, event_id in enumerate(event_ids)}
+    rows = [
+        (columns[_event_of(ann)], ann['startTime'], ann['endTime'])
+        for ann in processed_annotations
+        if ann.get('type') == 'complete' and _event_of(ann) in columns
+        and isinstance(ann.get('startTime'), (int, float)) and isinstance(ann.get('endTime'), (int, float))
+    ]
+    if not rows:
+        empty = np.empty(0, np.int64)
+        return empty, empty, empty
+
+    column, start, end = (np.asarray(values) for values in zip(*rows))
+    start, end = np.minimum(start, end), np.maximum(start, end)
+    # Tolerate float noise on times that fall exactly on a frame
+    first = np.clip(np.ceil(start * fps - 1e-6), 0, frame_count).astype(np.int64)
+    stop = np.clip(np.ceil(end * fps - 1e-6), 0, frame_count).astype(np.int64)
+    keep = first < stop
+    return column.astype(np.int64)[keep], first[keep], stop[keep]
+
+
+def paint_labels(columns, first, stop, frame_count, event_count, out=None):
+    """
+    Paint frame ranges into a frames x events multi-hot uint8 matrix.
+
+    Each range adds +1 at its first frame and -1 at its stop frame; a cumulative
+    sum over the frames then gives the number of intervals covering each frame.
+    This is done block by block with the running count carried over, so ``out``
+    may be a memory-mapped array larger than memory.
+    """
+    import numpy as np
+    if out is None:
+        out = np.zeros((frame_count, event_count), np.uint8)
+
+    frames = np.concatenate([first, stop])
+    boundary_columns = np.concatenate([columns, columns])
+    deltas = np.concatenate([np.ones(len(first), np.int32), -np.ones(len(stop), np.int32)])
+    order = np.argsort(frames, kind='stable')
+    frames, boundary_columns, deltas = frames[order], boundary_columns[order], deltas[order]
+
+    carry = np.zeros(event_count, np.int32)
+    for block_start in range(0, frame_count, PAINT_BLOCK_FRAMES):
+        block_stop = min(frame_count, block_start + PAINT_BLOCK_FRAMES)
+        low, high = np.searchsorted(frames, [block_start, block_stop])
+        counts = np.zeros((block_stop - block_start, event_count), np.int32)
+        np.add.at(counts, (frames[low:high] - block_start, boundary_columns[low:high]), deltas[low:high])
+        counts[0] += carry
+        np.cumsum(counts, axis=0, out=counts)
+        carry = counts[-1].copy()
+        out[block_start:block_stop] = counts > 0
+    return out
+
+
+def label_matrix(processed_annotations, event_ids, fps, frame_count, out=None):
+    """Frames x events multi-hot label matrix of a video's processed annotations"""
+    columns, first, stop = frame_spans(processed_annotations, event_ids, fps, frame_count)
+    return paint_labels(columns, first, stop, frame_count, len(event_ids), out=out)
+
+
+class LabelExportService:
+    """
+    Dense per-frame label export for model training.
+
+    A video's completed intervals are turned into a frames x events multi-hot
+    uint8 matrix using the fps and frame count of its probed metadata. Small
+    matrices are written as ``<video>.npz`` (``labels``, ``events``, ``fps``,
+    ``frame_count``). Matrices over ``memmap_cells`` cells are painted straight
+    into a memory-mapped ``<video>.npy`` (open it with
+    ``np.load(path, mmap_mode='r')``) described by a ``<video>.labels.json``
+    sidecar, so exporting a long video never holds the matrix in memory.
+    """
+
+    def __init__(self, export_folder, memmap_cells=64 * 1024 * 1024):
+        self.export_folder = Path(export_folder)
+        self.memmap_cells = memmap_cells
+
+    def folder(self, category_id):
+        return self.export_folder / category_id
+
+    def export(self, category_id, filename, processed_annotations, event_ids, metadata, export_format='auto'):
+        """
+        Write the label matrix of a video. Returns a summary with the written
+        file, its format, the number of frames and the event of each column.
+        """
+        import numpy as np
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format '{export_format}'. Must be one of {', '.join(EXPORT_FORMATS)}")
+        fps = metadata.get('fps') or 0
+        frame_count = int(metadata.get('frame_count') or 0)
+        if fps <= 0 or frame_count <= 0:
+            raise ValueError(f"No frame rate or frame count known for {filename}")
+        event_ids = list(event_ids)
+        if export_format == 'auto':
+            export_format = 'npy' if frame_count * len(event_ids) > self.memmap_cells else 'npz'
+
+        folder = self.folder(category_id)
+        folder.mkdir(parents=True, exist_ok=True)
+        stem = Path(filename).stem
+        summary = {
+            'filename': filename,
+            'format': export_format,
+            'events': event_ids,
+            'fps': fps,
+            'frame_count': frame_count
+        }
+
+        columns, first, stop = frame_spans(processed_annotations, event_ids, fps, frame_count)
+        if export_format == 'npz':
+            labels = paint_labels(columns, first, stop, frame_count, len(event_ids))
+            path = folder / f"{stem}.npz"
+            self._write_atomic(path, lambda f: np.savez_compressed(
+                f, labels=labels, events=np.array(event_ids, dtype=str), fps=fps, frame_count=frame_count
+            ))
+        else:
+            path = folder / f"{stem}.npy"
+            fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=f".{path.name}.", suffix='.tmp')
+            os.close(fd)
+            try:
+                labels = np.lib.format.open_memmap(
+                    tmp_path, mode='w+', dtype=np.uint8, shape=(frame_count, len(event_ids))
+                )
+                paint_labels(columns, first, stop, frame_count, len(event_ids), out=labels)
+                labels.flush()
+                del labels
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+            except BaseException:
+                Path(tmp_path).unlink(missing_ok=True)
+                raise
+            atomic_write_json(folder / f"{stem}.labels.json", summary, indent=4)
+
+        summary['file'] = path.name
+        summary['intervals'] = int(len(columns))
+        return summary
+
+    @staticmethod
+    def _write_atomic(path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def path(self, category_id, filename, export_format):
+        """Path of an exported file, or None"""
+        path = self.folder(category_id) / f"{Path(filename).stem}.{export_format}"
+        return path if path.is_file() else None
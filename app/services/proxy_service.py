@@ -0,0 +1,176 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from app.services.file_utils import atomic_write_json
+import json
+import multiprocessing
+import os
+import re
+import threading
+
+# Encoders tried in order: H.264 where the OpenCV build has it, else VP8 (playable
+# in every major browser), else MPEG-4 Part 2 as a last resort.
+PROXY_FORMATS = [
+    ('avc1', '.mp4', 'video/mp4'),
+    ('VP80', '.webm', 'video/webm'),
+    ('mp4v', '.mp4', 'video/mp4')
+]
+
+
+def transcode_proxy(video_path, output_stem, height, keyframe_interval):
+    """
+    Write a low-resolution copy of a video to ``output_stem`` + suffix.
+
+    Every frame is kept and written at the original frame rate, so a frame has
+    the same timestamp in the proxy as in the original and annotations line up.
+    A key frame is forced every ``keyframe_interval`` seconds to keep seeking
+    cheap. Runs in a worker process; returns the proxy info, with status
+    'skipped' if the video is not larger than the proxy size.
+    """
+    import cv2
+    video_path = Path(video_path)
+    output_stem = Path(output_stem)
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video: {video_path.name}")
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        source_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        source_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if source_height <= height or fps <= 0:
+            return {'status': 'skipped'}
+        # Encoders want even dimensions
+        width = max(2, round(source_width * height / source_height / 2) * 2)
+        height = height - height % 2
+
+        for fourcc, suffix, mimetype in PROXY_FORMATS:
+            tmp_path = output_stem.with_name(f".{output_stem.name}.{os.getpid()}{suffix}")
+            writer = cv2.VideoWriter(
+                str(tmp_path), cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height),
+                [cv2.VIDEOWRITER_PROP_KEY_INTERVAL, max(1, round(fps * keyframe_interval))]
+            )
+            if writer.isOpened():
+                break
+            writer.release()
+            tmp_path.unlink(missing_ok=True)
+        else:
+            raise ValueError('No video encoder available for proxies')
+
+        frame_count = 0
+        try:
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                writer.write(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+                frame_count += 1
+        except BaseException:
+            writer.release()
+            tmp_path.unlink(missing_ok=True)
+            raise
+        writer.release()
+    finally:
+        cap.release()
+
+    proxy_path = output_stem.with_suffix(suffix)
+    os.replace(tmp_path, proxy_path)
+    return {
+        'status': 'done',
+        'file': proxy_path.name,
+        'mimetype': mimetype,
+        'width': width,
+        'height': height,
+        'fps': fps,
+        'frame_count': frame_count
+    }
+
+
+class ProxyService:
+    """
+    Low-resolution proxies of uploaded videos for playback on slow machines.
+
+    Transcoding is CPU bound, so it runs in a process pool (started on the
+    first job) rather than in threads of the web server. Proxies are written to
+    ``<proxy folder>/<video hash>.<ext>`` with an ``<video hash>.json`` sidecar
+    describing them; videos no larger than the proxy size are recorded as
+    'skipped' and always played from the original.
+    """
+
+    def __init__(self, proxy_folder, workers=1, height=480, keyframe_interval=1.0, enabled=True):
+        self.proxy_folder = Path(proxy_folder)
+        self.workers = workers
+        self.height = height
+        self.keyframe_interval = keyframe_interval
+        self.enabled = enabled
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._errors = {}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 'spawn': forking a server that runs other thread pools is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _sidecar_path(self, video_hash):
+        return self.proxy_folder / f"{video_hash}.json"
+
+    def info(self, video_hash):
+        """The proxy info of a video ('done' or 'skipped'), or None if not built"""
+        if not re.fullmatch(r'[0-9a-f]{40,64}', video_hash or ''):
+            return None
+        try:
+            with self._sidecar_path(video_hash).open('r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def submit(self, video_path, video_hash):
+        """
+        Build the proxy of a video in the background unless it exists.
+        Returns the status: 'done', 'skipped', 'pending', 'error' or 'disabled'.
+        """
+        info = self.info(video_hash)
+        if info is not None:
+            return info['status']
+        if not self.enabled:
+            return 'disabled'
+        with self._lock:
+            if video_hash in self._pending:
+                return 'pending'
+            if video_hash in self._errors:
+                return 'error'
+            self._pending.add(video_hash)
+
+        self.proxy_folder.mkdir(parents=True, exist_ok=True)
+        future = self._get_executor().submit(
+            transcode_proxy, str(video_path), str(self.proxy_folder / video_hash), self.height, self.keyframe_interval
+        )
+        future.add_done_callback(lambda future: self._finish(video_path, video_hash, future))
+        return 'pending'
+
+    def _finish(self, video_path, video_hash, future):
+        try:
+            atomic_write_json(self._sidecar_path(video_hash), future.result())
+        except Exception as e:
+            print(f"Warning: building the proxy of {video_path} failed: {e}")
+            with self._lock:
+                self._errors[video_hash] = str(e)
+        finally:
+            with self._lock:
+                self._pending.discard(video_hash)
+
+    def error(self, video_hash):
+        return self._errors.get(video_hash)
+
+    def path(self, video_hash):
+        """(path, mimetype) of a finished proxy, or None"""
+        info = self.info(video_hash)
+        if info is None or info['status'] != 'done':
+            return None
+        proxy_path = self.proxy_folder / info['file']
+        return (proxy_path, info['mimetype']) if proxy_path.is_file() else None
@@ -0,0 +1,225 @@
+import threading
+
+
+def video_key(category_id, filename):
+    """Key of a video in the index; the file extension does not matter, as for the annotation files"""
+    return category_id, filename.rsplit('.', 1)[0]
+
+
+def _normalize(value):
+    """Field values are matched as strings (query parameters are strings)"""
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+def annotation_terms(category_id, ann):
+    """The index terms of a processed annotation"""
+    terms = {('category', category_id)}
+    event_id = ann.get('eventId', ann.get('event'))
+    if event_id is not None:
+        terms.add(('event', str(event_id)))
+    if ann.get('label') is not None:
+        terms.add(('label', str(ann['label'])))
+    fields = ann.get('fields')
+    if isinstance(fields, dict):
+        for name, value in fields.items():
+            for item in (value if isinstance(value, list) else [value]):
+                terms.add(('field', name, _normalize(item)))
+    return terms
+
+
+def _order(ann):
+    """Sort key of the results of a video: start time, then end time"""
+    start = ann.get('startTime', ann.get('time'))
+    end = ann.get('endTime')
+    return (
+        start if isinstance(start, (int, float)) else float('inf'),
+        end if isinstance(end, (int, float)) else float('inf')
+    )
+
+
+class SearchIndex:
+    """
+    Inverted index over the annotations of every video of every category.
+
+    Each term (category, event id, label, or custom field name and value)
+    maps to the videos that contain it and, per video, the annotations that
+    match. A query intersects the postings of its terms, starting from the
+    rarest, so its cost depends on the number of matches rather than on the
+    number of videos.
+
+    The index is built once from ``list_videos()`` / ``load_video(category_id,
+    filename)`` (the latter returns (video name, processed annotations) or
+    None), and the routes that change annotations ``refresh`` just the video
+    they changed. A refresh only re-indexes the records that are not the
+    same objects as before; the annotation service reuses the processed
+    record of every pair an edit did not touch, so re-indexing after an edit
+    costs about as much as the edit. Each worker process keeps its own index;
+    changes written by another process are seen after that video is
+    refreshed here or the index is rebuilt.
+    """
+
+    def __init__(self, list_videos, load_video):
+        self.list_videos = list_videos
+        self.load_video = load_video
+        self._lock = threading.RLock()
+        # Held for the whole of a build; the index lock only while the result is swapped in
+        self._build_lock = threading.RLock()
+        self._built = False
+        # While a build reads the videos: the refreshes and removals to apply once it is swapped in
+        self._pending = None
+        # video key -> (category id, video name, {record id: (annotation, terms)})
+        self._videos = {}
+        # term -> {video key: set of record ids}
+        self._postings = {}
+
+    def _unpost_locked(self, key, record_id, terms):
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            records = postings.get(key)
+            if records is not None:
+                records.discard(record_id)
+                if not records:
+                    del postings[key]
+            if not postings:
+                del self._postings[term]
+
+    def _remove_locked(self, key):
+        video = self._videos.pop(key, None)
+        if video is not None:
+            for record_id, (_, terms) in video[2].items():
+                self._unpost_locked(key, record_id, terms)
+
+    def _add_locked(self, category_id, filename):
+        key = video_key(category_id, filename)
+        loaded = self.load_video(category_id, filename)
+        if loaded is None:
+            self._remove_locked(key)
+            return
+        name, processed = loaded
+        # Records are identified by object identity; the index holds a reference so ids stay unique
+        current = {id(ann): ann for ann in processed or [] if ann.get('type') != 'end'}
+        video = self._videos.get(key)
+        records = video[2] if video is not None else {}
+
+        for record_id in [record_id for record_id in records if record_id not in current]:
+            _, terms = records.pop(record_id)
+            self._unpost_locked(key, record_id, terms)
+        for record_id, ann in current.items():
+            if record_id in records:
+                continue
+            terms = annotation_terms(category_id, ann)
+            records[record_id] = (ann, terms)
+            for term in terms:
+                self._postings.setdefault(term, {}).setdefault(key, set()).add(record_id)
+
+        if records:
+            self._videos[key] = (category_id, name, records)
+        else:
+            self._videos.pop(key, None)
+
+    def build(self):
+        """
+        (Re)build the whole index. The videos are read into a new index without
+        holding the lock, so refreshes and searches of the current index go on
+        meanwhile; the changes they report are applied again once it is swapped in.
+        """
+        with self._build_lock:
+            with self._lock:
+                self._pending = []
+            staging = SearchIndex(self.list_videos, self.load_video)
+            try:
+                for category_id, filename in self.list_videos():
+                    try:
+                        staging._add_locked(category_id, filename)
+                    except Exception as e:
+                        print(f"Warning: indexing annotations of {category_id}/{filename} failed: {e}")
+            except BaseException:
+                with self._lock:
+                    self._pending = None
+                raise
+            with self._lock:
+                self._videos, self._postings = staging._videos, staging._postings
+                pending, self._pending = self._pending, None
+                for change in pending:
+                    change()
+                self._built = True
+
+    def ensure_built(self):
+        if not self._built:
+            with self._build_lock:
+                if not self._built:
+                    self.build()
+
+    def refresh(self, category_id, filename):
+        """Re-index one video after its annotations changed"""
+        if not self._built and self._pending is None:
+            # Not built yet: the build will read the current data
+            return
+        with self._lock:
+            if self._pending is not None:
+                # The build may have read the video before this change
+                self._pending.append(lambda: self._add_locked(category_id, filename))
+            if self._built:
+                self._add_locked(category_id, filename)
+
+    def remove_category(self, category_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(lambda: self._remove_category_locked(category_id))
+            self._remove_category_locked(category_id)
+
+    def _remove_category_locked(self, category_id):
+        for key in [key for key in self._videos if key[0] == category_id]:
+            self._remove_locked(key)
+
+    def search(self, event_id=None, label=None, category_id=None, fields=None, offset=0, limit=None):
+        """
+        Annotations matching every given criterion, ordered by category, video
+        and start time. Returns (page of results, total number of matches).
+        """
+        self.ensure_built()
+        terms = []
+        if category_id is not None:
+            terms.append(('category', category_id))
+        if event_id is not None:
+            terms.append(('event', event_id))
+        if label is not None:
+            terms.append(('label', label))
+        for name, value in (fields or {}).items():
+            terms.append(('field', name, value))
+
+        with self._lock:
+            if terms:
+                postings = sorted((self._postings.get(term, {}) for term in terms), key=len)
+                candidates = postings[0]
+            else:
+                postings = []
+                candidates = {key: video[2].keys() for key, video in self._videos.items()}
+
+            total = 0
+            page = []
+            stop = None if limit is None else offset + limit
+            for key in sorted(candidates, key=lambda key: (key[0], self._videos[key][1])):
+                matches = candidates[key]
+                for other in postings[1:]:
+                    matches = other.get(key, ()) and set(matches).intersection(other[key])
+                    if not matches:
+                        break
+                if not matches:
+                    continue
+                # Only the requested page is turned into result records
+                first = max(0, offset - total)
+                last = len(matches) if stop is None else max(0, min(len(matches), stop - total))
+                if first < last:
+                    video_category, name, records = self._videos[key]
+                    annotations = sorted((records[record_id][0] for record_id in matches), key=_order)
+                    page.extend(
+                        dict(ann, category_id=video_category, filename=name)
+                        for ann in annotations[first:last]
+                    )
+                total += len(matches)
+        return page, total
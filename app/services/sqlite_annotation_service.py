@@ -0,0 +1,477 @@
+"""
+SQLite storage backend for annotations.
+
+Stores the same data as the per-video JSON files (raw start/end points and
+the client's activeAnnotations map) in an embedded database, so routes can
+look up single points and events through indexes instead of parsing and
+scanning a whole file per request. The processed view and interval index of
+recently used videos are cached in memory for as long as the video's version
+is unchanged, as with the JSON backend. The database runs in WAL mode so many
+annotators can read while one writes.
+
+Usage to import the existing JSON layout:
+    python -m app.services.sqlite_annotation_service categories annotations.db
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+import argparse
+import json
+import sqlite3
+import threading
+
+from app.services.annotation_service import VideoAnnotations, apply_operations, read_journal
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY,
+    category_id TEXT NOT NULL,
+    video_key TEXT NOT NULL,
+    video_name TEXT NOT NULL,
+    active_annotations TEXT NOT NULL DEFAULT '{}',
+    -- Incremented by every write; identifies the current state of the video's annotations
+    version INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (category_id, video_key)
+);
+
+-- Raw start/end points; rowid order is the order of the raw annotation list
+CREATE TABLE IF NOT EXISTS points (
+    id INTEGER PRIMARY KEY,
+    video_id INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+    type TEXT,
+    instance_id TEXT,
+    event_id TEXT,
+    time REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_points_video_event ON points (video_id, event_id);
+CREATE INDEX IF NOT EXISTS idx_points_video_instance ON points (video_id, instance_id);
+CREATE INDEX IF NOT EXISTS idx_points_video_time ON points (video_id, time);
+"""
+
+
+def _instance_id(ann):
+    """Id linking the two points of a pair: the start's 'id' or the end's 'startAnnotationId'"""
+    if ann.get('type') == 'start':
+        return ann.get('id')
+    if ann.get('type') == 'end':
+        return ann.get('startAnnotationId')
+    return None
+
+
+def _event_id(ann):
+    return ann.get('eventId', ann.get('event'))
+
+
+def _time(ann):
+    time = ann.get('time')
+    return time if isinstance(time, (int, float)) else None
+
+
+class LockedVideo:
+    """
+    A video's data as seen inside a write transaction: point lookups through
+    the indexes and, loaded on first use, the raw storage data
+    """
+
+    def __init__(self, service, conn, category_id, video_id):
+        self._service = service
+        self._conn = conn
+        self._category_id = category_id
+        self._video_id = video_id
+        self._storage_data = None
+
+    def point(self, instance_id, point):
+        """The 'start' or 'end' point of an instance, or None"""
+        row = self._service._find_point(self._conn, self._video_id, instance_id, point)
+        return json.loads(row['data']) if row is not None else None
+
+    @property
+    def storage_data(self):
+        if self._storage_data is None:
+            self._storage_data = self._service._load(self._conn, self._category_id, self._video_id)
+        return self._storage_data
+
+
+class SqliteAnnotationService:
+    """
+    Annotation storage backed by the stdlib ``sqlite3`` module.
+
+    Implements the same interface as ``AnnotationService`` (load, save,
+    append_operations, ...) so the routes do not care which backend is used.
+    """
+
+    def __init__(self, database_path, cache_size=64):
+        self.database_path = str(database_path)
+        self.cache_size = cache_size
+        # (category id, video key) -> (version, VideoAnnotations), least recently used first
+        self._videos = OrderedDict()
+        self._videos_lock = threading.Lock()
+        self._local = threading.local()
+        # Held from the start of a write until its on_commit callback returns, so the
+        # changes made through this process are announced in the order they were made
+        self._write_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(videos)')}
+            if 'version' not in columns:
+                # Databases created before videos had a version
+                conn.execute('ALTER TABLE videos ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+            # Databases created before the processed view was cached kept a table of completed intervals
+            conn.execute('DROP TABLE IF EXISTS intervals')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.database_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _video_key(filename):
+        return filename.rsplit('.', 1)[0]
+
+    def _video_id(self, conn, category_id, filename, create=False):
+        row = conn.execute(
+            'SELECT id FROM videos WHERE category_id = ? AND video_key = ?',
+            (category_id, self._video_key(filename))
+        ).fetchone()
+        if row is not None:
+            return row['id']
+        if not create:
+            return None
+        cursor = conn.execute(
+            'INSERT INTO videos (category_id, video_key, video_name) VALUES (?, ?, ?)',
+            (category_id, self._video_key(filename), filename)
+        )
+        return cursor.lastrowid
+
+    @staticmethod
+    def _current_version(conn, video_id):
+        return str(conn.execute('SELECT version FROM videos WHERE id = ?', (video_id,)).fetchone()['version'])
+
+    # --- Points ---
+
+    def _insert_point(self, conn, video_id, ann):
+        conn.execute(
+            'INSERT INTO points (video_id, type, instance_id, event_id, time, data) VALUES (?, ?, ?, ?, ?, ?)',
+            (video_id, ann.get('type'), _instance_id(ann), _event_id(ann), _time(ann), json.dumps(ann))
+        )
+
+    def _find_point(self, conn, video_id, instance_id, point):
+        return conn.execute(
+            'SELECT id, data FROM points WHERE video_id = ? AND instance_id = ? AND type = ? ORDER BY id LIMIT 1',
+            (video_id, instance_id, point)
+        ).fetchone()
+
+    # --- AnnotationService interface ---
+
+    def exists(self, category_id, filename):
+        return self._video_id(self._connect(), category_id, filename) is not None
+
+    @staticmethod
+    def empty(category_id, filename):
+        return {
+            "video_name": filename,
+            "category_id": category_id,
+            "annotations": [],
+            "activeAnnotations": {}
+        }
+
+    def version(self, category_id, filename):
+        """Version of a video's annotations (changes with every write), or None if it has no data"""
+        row = self._connect().execute(
+            'SELECT version FROM videos WHERE category_id = ? AND video_key = ?',
+            (category_id, self._video_key(filename))
+        ).fetchone()
+        return str(row['version']) if row is not None else None
+
+    def videos(self):
+        """(category_id, filename) of every video with annotation data"""
+        rows = self._connect().execute('SELECT category_id, video_name FROM videos ORDER BY category_id, video_key')
+        return [(row['category_id'], row['video_name']) for row in rows]
+
+    def load(self, category_id, filename):
+        conn = self._connect()
+        video_id = self._video_id(conn, category_id, filename)
+        return self._load(conn, category_id, video_id) if video_id is not None else None
+
+    def load_versioned(self, category_id, filename):
+        """(``load`` result, version), read in one transaction so the version is exactly that of the data"""
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            video_id = self._video_id(conn, category_id, filename)
+            if video_id is None:
+                return None, None
+            return self._load(conn, category_id, video_id), self._current_version(conn, video_id)
+
+    def _load(self, conn, category_id, video_id):
+        video = conn.execute('SELECT video_name, active_annotations FROM videos WHERE id = ?', (video_id,)).fetchone()
+        rows = conn.execute('SELECT data FROM points WHERE video_id = ? ORDER BY id', (video_id,))
+        return {
+            "video_name": video['video_name'],
+            "category_id": category_id,
+            "annotations": [json.loads(row['data']) for row in rows],
+            "activeAnnotations": json.loads(video['active_annotations'])
+        }
+
+    def save(self, category_id, filename, storage_data, on_commit=None):
+        """Replace all stored data of a video; returns the new version. ``on_commit(version)`` follows the commit."""
+        with self._write_lock:
+            version = self._save(category_id, filename, storage_data)
+            if on_commit is not None:
+                on_commit(version)
+            return version
+
+    def _save(self, category_id, filename, storage_data):
+        conn = self._connect()
+        with conn:
+            video_id = self._video_id(conn, category_id, filename, create=True)
+            conn.execute('DELETE FROM points WHERE video_id = ?', (video_id,))
+            conn.execute(
+                'UPDATE videos SET video_name = ?, active_annotations = ?, version = version + 1 WHERE id = ?',
+                (storage_data.get('video_name', filename), json.dumps(storage_data.get('activeAnnotations', {})), video_id)
+            )
+            for ann in storage_data.get('annotations', []):
+                self._insert_point(conn, video_id, ann)
+            return self._current_version(conn, video_id)
+
+    def append_operations(self, category_id, filename, operations, on_commit=None):
+        """
+        Apply journal-style operations (see ``apply_operations``) in one
+        transaction; returns the new version. ``on_commit(version, operations)``
+        follows the commit.
+        """
+        conn = self._connect()
+        with self._write_lock:
+            with conn:
+                video_id = self._video_id(conn, category_id, filename, create=True)
+                version = self._apply_operations(conn, video_id, operations)
+            self._applied(category_id, filename, version, operations)
+            if on_commit is not None:
+                on_commit(version, operations)
+            return version
+
+    def append_planned(self, category_id, filename, plan, on_commit=None):
+        """
+        Decide the operations from the video's current data and apply them in
+        one write transaction, taken before the read so no other write lands
+        in between. ``plan(video)`` gets a ``LockedVideo`` (None if the video
+        has no data) and returns (operations, result). Returns (new version or
+        None if there was nothing to apply, result). ``on_commit`` is called as
+        for ``append_operations``.
+        """
+        conn = self._connect()
+        with self._write_lock:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                video_id = self._video_id(conn, category_id, filename)
+                video = LockedVideo(self, conn, category_id, video_id) if video_id is not None else None
+                operations, result = plan(video)
+                if not operations:
+                    return None, result
+                if video_id is None:
+                    video_id = self._video_id(conn, category_id, filename, create=True)
+                version = self._apply_operations(conn, video_id, operations)
+            self._applied(category_id, filename, version, operations)
+            if on_commit is not None:
+                on_commit(version, operations)
+            return version, result
+
+    def _apply_operations(self, conn, video_id, operations):
+        conn.execute('UPDATE videos SET version = version + 1 WHERE id = ?', (video_id,))
+        for operation in operations:
+            kind = operation.get('op')
+            if kind == 'add':
+                ann = operation['annotation']
+                self._insert_point(conn, video_id, ann)
+            elif kind == 'update':
+                instance_id = operation['instanceId']
+                partner_point = 'end' if operation['point'] == 'start' else 'start'
+                row = self._find_point(conn, video_id, instance_id, operation['point'])
+                if row is None:
+                    continue
+                ann = json.loads(row['data'])
+                ann.update(operation['changes'])
+                conn.execute(
+                    'UPDATE points SET event_id = ?, time = ?, data = ? WHERE id = ?',
+                    (_event_id(ann), _time(ann), json.dumps(ann), row['id'])
+                )
+                partner = self._find_point(conn, video_id, instance_id, partner_point)
+                if 'fields' in operation['changes'] and partner is not None:
+                    partner_ann = json.loads(partner['data'])
+                    partner_ann['fields'] = operation['changes']['fields']
+                    conn.execute('UPDATE points SET data = ? WHERE id = ?', (json.dumps(partner_ann), partner['id']))
+            elif kind == 'delete':
+                # The instance's first start and first end point only, as AnnotationIndex.remove does
+                for point in ('start', 'end'):
+                    row = self._find_point(conn, video_id, operation['instanceId'], point)
+                    if row is not None:
+                        conn.execute('DELETE FROM points WHERE id = ?', (row['id'],))
+            elif kind == 'active':
+                conn.execute(
+                    'UPDATE videos SET active_annotations = ? WHERE id = ?',
+                    (json.dumps(operation['activeAnnotations']), video_id)
+                )
+        # Every operation is applied in place; there is no journal to compact
+        return self._current_version(conn, video_id)
+
+    def delete_video(self, category_id, filename):
+        """Remove all stored data of a video; returns whether it had any"""
+        key = (category_id, self._video_key(filename))
+        conn = self._connect()
+        with self._write_lock:
+            with conn:
+                conn.execute(
+                    'DELETE FROM points WHERE video_id IN (SELECT id FROM videos WHERE category_id = ? AND video_key = ?)',
+                    key
+                )
+                deleted = conn.execute('DELETE FROM videos WHERE category_id = ? AND video_key = ?', key).rowcount
+            self._forget(lambda cached_key: cached_key == key)
+        return deleted > 0
+
+    def delete_category(self, category_id):
+        """Remove all stored data of every video of a category; returns the number of videos removed"""
+        conn = self._connect()
+        with self._write_lock:
+            with conn:
+                conn.execute(
+                    'DELETE FROM points WHERE video_id IN (SELECT id FROM videos WHERE category_id = ?)', (category_id,)
+                )
+                deleted = conn.execute('DELETE FROM videos WHERE category_id = ?', (category_id,)).rowcount
+            self._forget(lambda cached_key: cached_key[0] == category_id)
+        return deleted
+
+    def _forget(self, matches):
+        # A video created again restarts at version 1, which must not match what was cached before
+        with self._videos_lock:
+            for key in [key for key in self._videos if matches(key)]:
+                del self._videos[key]
+
+    def compact(self, category_id, filename):
+        return self.load(category_id, filename)
+
+    def _state(self, category_id, filename):
+        """
+        The cached VideoAnnotations of a video (read from the database if its
+        version changed), or None if it has no data
+        """
+        key = (category_id, self._video_key(filename))
+        version = self.version(category_id, filename)
+        if version is None:
+            return None
+        with self._videos_lock:
+            cached = self._videos.get(key)
+            if cached is not None and cached[0] == version:
+                self._videos.move_to_end(key)
+                return cached[1]
+
+        storage_data, version = self.load_versioned(category_id, filename)
+        if storage_data is None:
+            return None
+        state = VideoAnnotations(storage_data)
+        self._cache_state(key, version, state)
+        return state
+
+    def _cache_state(self, key, version, state):
+        with self._videos_lock:
+            self._videos[key] = (version, state)
+            self._videos.move_to_end(key)
+            while len(self._videos) > self.cache_size:
+                self._videos.popitem(last=False)
+
+    def _applied(self, category_id, filename, version, operations):
+        """Bring a cached state one version behind up to date in place, instead of reloading it"""
+        key = (category_id, self._video_key(filename))
+        with self._videos_lock:
+            cached = self._videos.get(key)
+        if cached is not None and cached[0] == str(int(version) - 1):
+            cached[1].apply(operations)
+            self._cache_state(key, version, cached[1])
+
+    def load_processed(self, category_id, filename):
+        """
+        Processed (paired) annotation list of a video, or None if it has no
+        data. Served from the cached state when it is current. The returned
+        list is a copy; the records are shared with the cache.
+        """
+        state = self._state(category_id, filename)
+        return list(state.processed) if state is not None else None
+
+    def event_state(self, category_id, filename, event_id):
+        """
+        Return (active, startTime) for an event: active if it has a start point
+        without an end, startTime of the most recent such start
+        """
+        conn = self._connect()
+        video_id = self._video_id(conn, category_id, filename)
+        if video_id is None:
+            return False, None
+        open_start = conn.execute(
+            "SELECT time FROM points AS s WHERE s.video_id = ? AND s.event_id = ? AND s.type = 'start' "
+            "AND NOT EXISTS (SELECT 1 FROM points AS e WHERE e.video_id = s.video_id "
+            "AND e.instance_id = s.instance_id AND e.type = 'end') "
+            "ORDER BY s.id DESC LIMIT 1",
+            (video_id, event_id)
+        ).fetchone()
+        if open_start is None:
+            return False, None
+        return True, open_start['time']
+
+    def interval_index(self, category_id, filename):
+        """IntervalIndex over the processed annotations of a video, or None if it has no data"""
+        state = self._state(category_id, filename)
+        return state.intervals if state is not None else None
+
+    # --- Import ---
+
+    def import_json_layout(self, categories_folder):
+        """
+        Import every ``categories/<id>/<video>.json`` raw annotation file.
+        Journals next to the snapshots are replayed first. Returns the number
+        of videos imported.
+        """
+        imported = 0
+        for category_folder in sorted(Path(categories_folder).iterdir()):
+            if not category_folder.is_dir():
+                continue
+            for storage_file_path in sorted(category_folder.glob('*.json')):
+                if storage_file_path.name == 'config.json' or storage_file_path.name.startswith('.') or storage_file_path.stem.endswith('_processed'):
+                    continue
+                try:
+                    with storage_file_path.open('r') as f:
+                        storage_data = json.load(f)
+                except (json.JSONDecodeError, OSError) as e:
+                    print(f"Warning: Skipping unreadable annotation file {storage_file_path}: {e}")
+                    continue
+                if not isinstance(storage_data, dict) or not isinstance(storage_data.get('annotations'), list):
+                    continue
+
+                journal_file_path = storage_file_path.with_name(f"{storage_file_path.stem}.journal.jsonl")
+                apply_operations(storage_data, read_journal(journal_file_path))
+
+                # The video key is the snapshot's stem, as for the JSON backend
+                filename = storage_file_path.stem + Path(storage_data.get('video_name') or '.mp4').suffix
+                self.save(category_folder.name, filename, storage_data)
+                imported += 1
+        return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import the categories/<id>/*.json annotation layout into SQLite')
+    parser.add_argument('categories_folder', nargs='?', default='categories')
+    parser.add_argument('database', nargs='?', default='annotations.db')
+    args = parser.parse_args()
+
+    service = SqliteAnnotationService(args.database)
+    imported = service.import_json_layout(args.categories_folder)
+    print(f"Imported annotations of {imported} videos into {args.database}")
+
+
+if __name__ == '__main__':
+    main()
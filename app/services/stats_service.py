@@ -0,0 +1,361 @@
+"""
+Streaming statistics over every annotation file of the dataset.
+
+Walks ``annotations/*.json`` and ``categories/<id>/*.json`` and reports the
+unique labels, the number of annotations per label and per video, and
+histograms of the durations of completed intervals. Both file formats are
+read (see ``determine_format`` in app.py):
+- old: {'annotations': [...]} (SoccerNet-style records with a 'label', or
+  TAAT start/end/complete records with an 'eventId')
+- new: {'version', 'videos': [{'path', 'annotations': [...]}]}
+
+Files are parsed incrementally, one annotation at a time, so memory does not
+grow with the size of a file; files are processed in parallel.
+
+Usage:
+    python -m app.services.stats_service [folder ...] [--labels labels.txt] [--json stats.json]
+"""
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import json
+import math
+import re
+
+from app.services.annotation_service import apply_operations, read_journal
+
+# Characters read from a file at a time
+READ_BLOCK_SIZE = 64 * 1024
+
+# Files of the category folders that do not hold a video's raw annotations
+SKIPPED_FILES = ('config.json',)
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_PART = re.compile(r'[0-9eE.+-]*')
+_DECODER = json.JSONDecoder()
+
+
+class JsonStream:
+    """
+    Minimal pull parser over a JSON text file.
+
+    Only the structure the caller walks into (``keys`` of an object, ``items``
+    of an array) is tokenized here; every value the caller reads is decoded by
+    ``json``'s C decoder from a buffer of a few blocks, and values the caller
+    is not interested in are skipped structurally, so no more than one
+    annotation is held in memory.
+    """
+
+    def __init__(self, f, block_size=READ_BLOCK_SIZE):
+        self.f = f
+        self.block_size = block_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        block = self.f.read(self.block_size)
+        if not block:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """The next non-whitespace character ('' at the end of the file)"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, characters):
+        character = self.peek()
+        if character not in characters or not character:
+            raise ValueError(f"Expected one of {characters!r} but found {character!r}")
+        self.pos += 1
+        return character
+
+    def value(self):
+        """Decode the next value"""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number cut at the end of the buffer continues in the next block
+            if (not self.eof and _NUMBER_PART.match(self.buffer, end).end() == len(self.buffer)
+                    and self._fill()):
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        """Iterate over an array; the caller reads or skips each item"""
+        self._expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self._expect(',]') == ']':
+                return
+
+    def keys(self):
+        """Iterate over the keys of an object; the caller reads or skips each value"""
+        self._expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise ValueError('Expected an object key')
+            key = self.value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def skip(self):
+        """Skip the next value without building it"""
+        character = self.peek()
+        if character == '[':
+            for _ in self.items():
+                self.skip()
+        elif character == '{':
+            for _ in self.keys():
+                self.skip()
+        else:
+            self.value()
+
+
+def _label_of(ann):
+    return ann.get('label') or ann.get('eventId') or ann.get('event') or '(no label)'
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+class AnnotationStats:
+    """Counts and duration histograms, mergeable across files"""
+
+    def __init__(self, bin_width=1.0):
+        self.bin_width = bin_width
+        self.files = 0
+        self.labels = Counter()
+        self.videos = {}
+        self.durations = {}
+        self.total_durations = Counter()
+        self.errors = []
+
+    def add_duration(self, label, duration):
+        if duration is None or duration < 0:
+            return
+        self.durations.setdefault(label, Counter())[math.floor(duration / self.bin_width)] += 1
+        self.total_durations[label] += duration
+
+    def add_video(self, video, counts):
+        if counts:
+            self.videos.setdefault(video, Counter()).update(counts)
+
+    def merge(self, other):
+        self.files += other.files
+        self.labels.update(other.labels)
+        for video, counts in other.videos.items():
+            self.add_video(video, counts)
+        for label, histogram in other.durations.items():
+            self.durations.setdefault(label, Counter()).update(histogram)
+        self.total_durations.update(other.total_durations)
+        self.errors.extend(other.errors)
+        return self
+
+    def report(self):
+        return {
+            'files': self.files,
+            'annotations': sum(self.labels.values()),
+            'labels': sorted(self.labels),
+            'counts': dict(self.labels.most_common()),
+            'videos': {video: dict(counts.most_common()) for video, counts in sorted(self.videos.items())},
+            'durations': {
+                label: {
+                    'bin_width': self.bin_width,
+                    'total': self.total_durations[label],
+                    'histogram': [[bin_index * self.bin_width, count] for bin_index, count in sorted(histogram.items())]
+                }
+                for label, histogram in sorted(self.durations.items())
+            },
+            'errors': self.errors
+        }
+
+
+class _VideoCounter:
+    """Counts of one video while its annotations stream by; start points wait for their end"""
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.counts = Counter()
+        self.open_starts = {}
+
+    def add(self, ann):
+        if not isinstance(ann, dict):
+            return
+        label = _label_of(ann)
+        ann_type = ann.get('type')
+        if ann_type == 'end':
+            start = self.open_starts.pop(ann.get('startAnnotationId'), None)
+            end_time = _number(ann.get('time'))
+            if start is not None and end_time is not None:
+                self.stats.add_duration(start[0], end_time - start[1])
+            return
+
+        # Every other record (start, complete or a point event) is one annotation
+        self.counts[label] += 1
+        self.stats.labels[label] += 1
+        if ann_type == 'start' and ann.get('id') and _number(ann.get('time')) is not None:
+            self.open_starts[ann['id']] = (label, ann['time'])
+        elif ann_type == 'complete':
+            start_time, end_time = _number(ann.get('startTime')), _number(ann.get('endTime'))
+            if start_time is not None and end_time is not None:
+                self.stats.add_duration(label, end_time - start_time)
+
+
+def _video_name(path):
+    return path.split('/')[-1] if isinstance(path, str) else None
+
+
+def _walk_annotations(stream, counter):
+    for _ in stream.items():
+        counter.add(stream.value())
+
+
+def _stream_file(file_path, stats):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        stream = JsonStream(f)
+        if stream.peek() != '{':
+            raise ValueError('Unsupported JSON structure: expected an object')
+        # The name of a video may come after its annotations, so counts are kept until the object ends
+        top_level = _VideoCounter(stats)
+        video_name = None
+        for key in stream.keys():
+            if key == 'annotations' and stream.peek() == '[':
+                _walk_annotations(stream, top_level)
+            elif key == 'video_name':
+                video_name = stream.value()
+            elif key == 'videos' and stream.peek() == '[':
+                for position, _ in enumerate(stream.items()):
+                    video = _VideoCounter(stats)
+                    path = None
+                    for video_key in stream.keys():
+                        if video_key == 'annotations' and stream.peek() == '[':
+                            _walk_annotations(stream, video)
+                        elif video_key == 'path':
+                            path = stream.value()
+                        else:
+                            stream.skip()
+                    stats.add_video(_video_name(path) or f"{file_path.stem}[{position}]", video.counts)
+            else:
+                stream.skip()
+        stats.add_video(video_name or file_path.stem, top_level.counts)
+
+
+def file_stats(file_path, bin_width=1.0):
+    """Statistics of one annotation file (errors are recorded, not raised)"""
+    file_path = Path(file_path)
+    stats = AnnotationStats(bin_width)
+    try:
+        journal_file_path = file_path.with_name(f"{file_path.stem}.journal.jsonl")
+        if journal_file_path.is_file() and journal_file_path.stat().st_size > 0:
+            # Operations not yet compacted into the snapshot: replay them in memory
+            with file_path.open('r', encoding='utf-8') as f:
+                storage_data = json.load(f)
+            apply_operations(storage_data, read_journal(journal_file_path))
+            video = _VideoCounter(stats)
+            for ann in storage_data.get('annotations', []):
+                video.add(ann)
+            stats.add_video(storage_data.get('video_name') or file_path.stem, video.counts)
+        else:
+            _stream_file(file_path, stats)
+        stats.files = 1
+    except (OSError, ValueError) as e:
+        stats = AnnotationStats(bin_width)
+        stats.errors.append({'file': str(file_path), 'error': str(e)})
+    return stats
+
+
+def annotation_files(folders):
+    """The annotation files of the given folders and of the category folders below them"""
+    files = []
+    for folder in map(Path, folders):
+        candidates = list(folder.glob('*.json')) + list(folder.glob('*/*.json'))
+        for file_path in sorted(candidates):
+            # Dotfiles (the video manifest) do not hold annotations either
+            if file_path.name in SKIPPED_FILES or file_path.name.startswith('.') or file_path.stem.endswith('_processed'):
+                continue
+            # categories/categories.json is the category configuration
+            if file_path.parent == folder and folder.name == 'categories':
+                continue
+            files.append(file_path)
+    return files
+
+
+def collect_stats(files, bin_width=1.0, workers=None):
+    """Merged statistics of many files, processed across a process pool"""
+    stats = AnnotationStats(bin_width)
+    if workers == 1 or len(files) < 2:
+        for file_path in files:
+            stats.merge(file_stats(file_path, bin_width))
+        return stats
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for partial in executor.map(file_stats, files, [bin_width] * len(files), chunksize=8):
+            stats.merge(partial)
+    return stats
+
+
+def format_report(report, top=20):
+    lines = [f"{report['files']} files, {report['annotations']} annotations, {len(report['labels'])} labels, "
+             f"{len(report['videos'])} videos"]
+    lines.append('Annotations per label:')
+    for label, count in list(report['counts'].items())[:top]:
+        lines.append(f"  {count:8d}  {label}")
+    if report['durations']:
+        lines.append('Completed interval durations (seconds):')
+        for label, durations in report['durations'].items():
+            count = sum(bin_count for _, bin_count in durations['histogram'])
+            lines.append(f"  {label}: {count} intervals, mean {durations['total'] / count:.2f}")
+    for error in report['errors']:
+        lines.append(f"Error reading {error['file']}: {error['error']}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Label and duration statistics of the annotation files')
+    parser.add_argument('folders', nargs='*', default=['annotations', 'categories'])
+    parser.add_argument('--bin-width', type=float, default=1.0, help='width of the duration histogram bins (seconds)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--labels', help='write the unique labels to this file, one per line')
+    parser.add_argument('--json', help='write the full report to this JSON file')
+    args = parser.parse_args()
+
+    report = collect_stats(annotation_files(args.folders), args.bin_width, args.workers).report()
+    print(format_report(report))
+    if args.labels:
+        with open(args.labels, 'w') as f:
+            for label in report['labels']:
+                f.write(f"{label}\n")
+        print(f"Labels have been written to {args.labels}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,128 @@
+"""
+Live annotation changes, pushed to clients over Server-Sent Events.
+
+The write routes ``publish`` the change records they apply to a video (the
+journal operations, or a note that the whole snapshot was replaced) and
+every client following that video receives them on its event stream. Each
+video has its own sequence numbers and keeps its most recent records, so a
+client that reconnects with the id of the last event it saw is sent only
+what it missed; one that fell too far behind, or whose ids come from before
+a restart, is told to reload.
+
+The hub lives in one process: with several worker processes, clients only
+see the changes written through the worker serving their stream.
+"""
+
+from collections import deque
+import json
+import threading
+import time
+import uuid
+
+
+def _channel_key(category_id, filename):
+    # Videos are stored by file stem, whatever the extension
+    return category_id, filename.rsplit('.', 1)[0]
+
+
+def format_event(event_id, kind, data):
+    """One Server-Sent Event; ``data`` is already JSON"""
+    return f"id: {event_id}\nevent: {kind}\ndata: {data}\n\n"
+
+
+class _Channel:
+    """Sequence counter and recent change records of one video"""
+
+    def __init__(self, history_size, lock):
+        self.seq = 0
+        # (seq, kind, JSON data), oldest first; sequence numbers are contiguous
+        self.events = deque(maxlen=history_size)
+        self.changed = threading.Condition(lock)
+
+
+class SyncHub:
+    """In-process publish/subscribe of annotation change records, per video"""
+
+    def __init__(self, history_size=256, heartbeat=15):
+        self.history_size = history_size
+        self.heartbeat = heartbeat
+        # Distinguishes the sequence numbers of this process from those of an earlier run
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def _channel(self, category_id, filename):
+        key = _channel_key(category_id, filename)
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._channels[key] = _Channel(self.history_size, self._lock)
+            return channel
+
+    def event_id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def publish(self, category_id, filename, kind, **data):
+        """Record a change of a video and wake its subscribers; returns its sequence number"""
+        channel = self._channel(category_id, filename)
+        with channel.changed:
+            channel.seq += 1
+            # Encoded once, however many clients receive it
+            payload = json.dumps(dict(data, seq=channel.seq, time=time.time()), separators=(',', ':'))
+            channel.events.append((channel.seq, kind, payload))
+            channel.changed.notify_all()
+            return channel.seq
+
+    def _parse_event_id(self, event_id):
+        """Sequence number of an event id of this process, or None"""
+        epoch, _, seq = (event_id or '').partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def wait(self, category_id, filename, after, timeout):
+        """
+        Change records of a video after sequence number ``after``, waiting up
+        to ``timeout`` seconds for one. Returns (records, current sequence
+        number); records is None if some were already dropped from the history.
+        """
+        channel = self._channel(category_id, filename)
+        with channel.changed:
+            if channel.seq <= after:
+                channel.changed.wait(timeout)
+            if channel.seq <= after:
+                return [], channel.seq
+            first = channel.events[0][0] if channel.events else channel.seq + 1
+            if after < first - 1:
+                return None, channel.seq
+            return list(channel.events)[after - first + 1:], channel.seq
+
+    def stream(self, category_id, filename, last_event_id=None):
+        """
+        Server-Sent Events of a video's changes. Starts after ``last_event_id``
+        when it is one of ours, otherwise with a 'hello' event carrying the
+        current sequence number (subscribe before loading the annotations, so
+        no change falls in between).
+        """
+        channel = self._channel(category_id, filename)
+        after = self._parse_event_id(last_event_id)
+        with channel.changed:
+            current = channel.seq
+        if after is None or after > current:
+            kind = 'hello' if not last_event_id else 'reset'
+            after = current
+            yield format_event(self.event_id(after), kind, json.dumps({'seq': after}))
+
+        while True:
+            records, current = self.wait(category_id, filename, after, self.heartbeat)
+            if records is None:
+                # Fell behind the history: the client reloads the whole video
+                after = current
+                yield format_event(self.event_id(after), 'reset', json.dumps({'seq': after}))
+            elif records:
+                for seq, kind, payload in records:
+                    after = seq
+                    yield format_event(self.event_id(seq), kind, payload)
+            else:
+                # Keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
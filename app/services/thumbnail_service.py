@@ -0,0 +1,190 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from app.services.file_utils import atomic_write_json
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+JPEG_QUALITY = 70
+
+
+def read_keyframes(video_path):
+    """
+    Timestamps (seconds) of the key frames of a video, read from the encoded
+    packets without decoding them. Empty if the backend cannot report them.
+    """
+    import cv2
+    cap = cv2.VideoCapture(str(video_path), cv2.CAP_FFMPEG)
+    keyframes = []
+    try:
+        if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+            return keyframes
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(round(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000, 3))
+    finally:
+        cap.release()
+    return keyframes
+
+
+def build_sprites(video_path, output_folder, interval, tile_width, columns, rows):
+    """
+    Decode a video once and write one thumbnail every ``interval`` seconds into
+    JPEG sprite sheets of ``columns`` x ``rows`` tiles. Returns the sprite index.
+    """
+    import cv2
+    import numpy as np
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video: {Path(video_path).name}")
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    tile_height = max(1, round(tile_width * height / width)) if width > 0 else tile_width
+    tiles_per_sheet = columns * rows
+
+    sheets = []
+    sheet = None
+    count = 0
+    frame_index = 0
+    next_time = 0.0
+
+    def flush():
+        name = f"sprite_{len(sheets)}.jpg"
+        ok, encoded = cv2.imencode('.jpg', sheet, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not ok:
+            raise ValueError('Cannot encode sprite sheet')
+        (output_folder / name).write_bytes(encoded.tobytes())
+        sheets.append(name)
+
+    try:
+        # grab() decodes every frame once; only sampled frames are converted and scaled
+        while cap.grab():
+            time = frame_index / fps if fps > 0 else cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            frame_index += 1
+            if time + 1e-6 < next_time:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok:
+                continue
+
+            slot = count % tiles_per_sheet
+            if slot == 0:
+                if sheet is not None:
+                    flush()
+                sheet = np.zeros((tile_height * rows, tile_width * columns, 3), np.uint8)
+            row, column = divmod(slot, columns)
+            sheet[row * tile_height:(row + 1) * tile_height, column * tile_width:(column + 1) * tile_width] = \
+                cv2.resize(frame, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+            count += 1
+            next_time = count * interval
+        if sheet is not None:
+            # Crop the unused rows of the last sheet
+            used_rows = (count - 1) % tiles_per_sheet // columns + 1
+            sheet = sheet[:used_rows * tile_height]
+            flush()
+    finally:
+        cap.release()
+
+    return {
+        'interval': interval,
+        'tile_width': tile_width,
+        'tile_height': tile_height,
+        'columns': columns,
+        'rows': rows,
+        'count': count,
+        'sheets': sheets
+    }
+
+
+class ThumbnailService:
+    """
+    Timeline thumbnail sprite sheets and key frame index, built in the background.
+
+    Each video is decoded once on a bounded worker pool; the result is written
+    to ``<thumbnail folder>/<video hash>/`` (``index.json`` plus
+    ``sprite_<n>.jpg`` sheets). Folders are keyed by the video's content hash,
+    so the files never change once written and can be cached by browsers
+    indefinitely, and the same video uploaded twice is processed once.
+    """
+
+    def __init__(self, thumbnail_folder, workers=1, interval=2, tile_width=160, columns=10, rows=10):
+        self.thumbnail_folder = Path(thumbnail_folder)
+        self.interval = interval
+        self.tile_width = tile_width
+        self.columns = columns
+        self.rows = rows
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._errors = {}
+
+    @staticmethod
+    def valid_hash(video_hash):
+        return re.fullmatch(r'[0-9a-f]{40,64}', video_hash or '') is not None
+
+    def _folder(self, video_hash):
+        return self.thumbnail_folder / video_hash
+
+    def index(self, video_hash):
+        """The sprite and key frame index of a video, or None if not built yet"""
+        try:
+            with (self._folder(video_hash) / 'index.json').open('r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def error(self, video_hash):
+        return self._errors.get(video_hash)
+
+    def submit(self, video_path, video_hash):
+        """
+        Build the thumbnails of a video in the background unless they exist.
+        Returns the status: 'done', 'pending' or 'error'.
+        """
+        if self.index(video_hash) is not None:
+            return 'done'
+        with self._lock:
+            if video_hash in self._pending:
+                return 'pending'
+            if video_hash in self._errors:
+                # Not retried until restart; the video cannot be decoded
+                return 'error'
+            self._pending.add(video_hash)
+        self._executor.submit(self._run, Path(video_path), video_hash)
+        return 'pending'
+
+    def _run(self, video_path, video_hash):
+        folder = self._folder(video_hash)
+        # Build next to the final folder and move it into place when complete
+        self.thumbnail_folder.mkdir(parents=True, exist_ok=True)
+        work_folder = Path(tempfile.mkdtemp(dir=self.thumbnail_folder, prefix=f".{video_hash}."))
+        try:
+            os.chmod(work_folder, 0o755)
+            index = build_sprites(video_path, work_folder, self.interval, self.tile_width, self.columns, self.rows)
+            index['keyframes'] = read_keyframes(video_path)
+            atomic_write_json(work_folder / 'index.json', index)
+            try:
+                work_folder.rename(folder)
+            except OSError:
+                # Built concurrently by another worker process
+                shutil.rmtree(work_folder, ignore_errors=True)
+        except Exception as e:
+            print(f"Warning: building thumbnails for {video_path} failed: {e}")
+            shutil.rmtree(work_folder, ignore_errors=True)
+            with self._lock:
+                self._errors[video_hash] = str(e)
+        finally:
+            with self._lock:
+                self._pending.discard(video_hash)
+
+    def sprite_path(self, video_hash, sheet):
+        """Path of a sprite sheet, or None"""
+        if not self.valid_hash(video_hash):
+            return None
+        path = self._folder(video_hash) / f"sprite_{sheet}.jpg"
+        return path if path.is_file() else None
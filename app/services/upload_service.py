@@ -0,0 +1,283 @@
+from flask import current_app
+from werkzeug.utils import secure_filename
+from pathlib import Path
+from app.services.file_utils import file_lock, atomic_write_json
+from app.services.video_store_service import hash_file
+from collections import OrderedDict
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+
+# Size of the blocks copied from the request stream to disk. Keeps memory flat
+# no matter how large a chunk (or the whole video) is.
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Running hashes kept for uploads in progress; those of abandoned uploads are
+# dropped first (an evicted upload is hashed again at finalize)
+MAX_RUNNING_HASHES = 64
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    """Raised when an upload request cannot be honoured; carries the HTTP status."""
+
+    def __init__(self, message, status=400, session=None):
+        super().__init__(message)
+        self.status = status
+        self.session = session
+
+
+class UploadService:
+    """
+    Chunked, resumable video uploads.
+
+    Protocol:
+    - init: register the file (category, name, total size and the client's
+      SHA-256 of it, or a nonce it keeps for the file) and get an upload id;
+      initialising the same file again resumes it
+    - PUT chunk N: stream bytes for chunk N into the video store's incoming folder
+    - finalize: check every byte arrived, drop the session and return the
+      file's SHA-256 so it can be moved into the content-addressed store
+
+    Chunks are written in order into one file on the store's filesystem, so
+    moving it into the store afterwards is a rename. The SHA-256 is updated
+    as chunks arrive; only if the upload was resumed on another worker
+    process (or after a restart) is the file hashed again at finalize. The
+    session state (received byte offset) lives in a small JSON sidecar so an
+    interrupted upload can be resumed from any worker process; chunk writes
+    and finalization of one upload are serialized with a per-session lock.
+    Uploads left untouched for UPLOAD_SESSION_MAX_AGE seconds are deleted
+    when the next upload starts.
+    """
+
+    def __init__(self, video_store):
+        self.video_store = video_store
+        # upload id -> (bytes hashed, running sha256) for uploads streamed by this process,
+        # least recently used first
+        self._hashers = OrderedDict()
+        self._hashers_lock = threading.Lock()
+
+    def _sessions_folder(self):
+        folder = Path(current_app.config['UPLOAD_SESSIONS_FOLDER'])
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
+    def _session_path(self, upload_id):
+        return self._sessions_folder() / f"{secure_filename(upload_id)}.json"
+
+    @staticmethod
+    def make_upload_id(category_id, filename, total_size, fingerprint=None):
+        """
+        Id of an upload. With the client's fingerprint of the file (its SHA-256
+        or a nonce) the id is deterministic, so re-initialising the same file
+        resumes it, while another file of the same name and size gets its own
+        upload. Without one every upload starts afresh.
+        """
+        if not fingerprint:
+            return uuid.uuid4().hex
+        key = f"{category_id}/{filename}/{total_size}/{fingerprint}".encode('utf-8')
+        return hashlib.sha1(key).hexdigest()
+
+    def _pop_hasher(self, upload_id):
+        with self._hashers_lock:
+            return self._hashers.pop(upload_id, None)
+
+    def _keep_hasher(self, upload_id, state):
+        with self._hashers_lock:
+            self._hashers[upload_id] = state
+            self._hashers.move_to_end(upload_id)
+            while len(self._hashers) > MAX_RUNNING_HASHES:
+                self._hashers.popitem(last=False)
+
+    def _save_session(self, session):
+        atomic_write_json(self._session_path(session['upload_id']), session, kind='upload_session')
+
+    def _lock(self, upload_id):
+        return file_lock(self._session_path(upload_id), current_app.config['LOCKS_FOLDER'])
+
+    def get_session(self, upload_id):
+        session_path = self._session_path(upload_id)
+        if not session_path.exists():
+            return None
+        with session_path.open('r') as f:
+            return json.load(f)
+
+    def init_session(self, category_id, filename, total_size, chunk_size=None, sha256=None, nonce=None):
+        """
+        Create a new upload session, or return the existing one to resume it.
+        A declared ``sha256`` is checked against the uploaded bytes at finalize.
+        """
+        filename = secure_filename(filename or '')
+        if not category_id:
+            raise UploadError('No category selected')
+        if not filename:
+            raise UploadError('No selected file')
+        if not isinstance(total_size, int) or total_size < 0:
+            raise UploadError('Invalid total size')
+        if total_size > current_app.config['MAX_CONTENT_LENGTH']:
+            raise UploadError('File too large', status=413)
+        if sha256 is not None and not (isinstance(sha256, str) and SHA256_PATTERN.match(sha256)):
+            raise UploadError('Invalid sha256')
+        if nonce is not None and not (isinstance(nonce, str) and 0 < len(nonce) <= 128):
+            raise UploadError('Invalid nonce')
+
+        self.expire_sessions()
+        upload_id = self.make_upload_id(category_id, filename, total_size, sha256 or nonce)
+        incoming_path = self.video_store.incoming_folder() / f"{upload_id}{Path(filename).suffix.lower()}"
+
+        # Serialized with the chunk writes, so a re-init never truncates a file being written
+        with self._lock(upload_id):
+            session = self.get_session(upload_id)
+            if session is not None and incoming_path.exists():
+                # Resume: the bytes up to 'received' are already on disk
+                return session
+
+            chunk_size = int(chunk_size or current_app.config['UPLOAD_CHUNK_SIZE'])
+            chunk_size = max(COPY_BUFFER_SIZE, min(chunk_size, current_app.config['UPLOAD_CHUNK_SIZE_MAX']))
+
+            # Reserve the file; chunks are written into it in place
+            with incoming_path.open('wb'):
+                pass
+            self._pop_hasher(upload_id)
+
+            session = {
+                'upload_id': upload_id,
+                'category_id': category_id,
+                'filename': filename,
+                'path': str(incoming_path),
+                'total_size': total_size,
+                'chunk_size': chunk_size,
+                'received': 0,
+                'expected_sha256': sha256
+            }
+            self._save_session(session)
+            return session
+
+    def expire_sessions(self):
+        """
+        Drop the uploads nothing was written to for UPLOAD_SESSION_MAX_AGE
+        seconds (their session and partial file), and files that interrupted
+        uploads left in the incoming folder. Returns the number of uploads dropped.
+        """
+        cutoff = time.time() - current_app.config['UPLOAD_SESSION_MAX_AGE']
+        expired = 0
+        for session_path in self._sessions_folder().glob('*.json'):
+            upload_id = session_path.stem
+            with self._lock(upload_id):
+                try:
+                    # Every chunk write replaces the session file
+                    if session_path.stat().st_mtime >= cutoff:
+                        continue
+                    session = self.get_session(upload_id)
+                except FileNotFoundError:
+                    continue
+                except (OSError, ValueError):
+                    session = None
+                if session is not None:
+                    Path(session['path']).unlink(missing_ok=True)
+                session_path.unlink(missing_ok=True)
+                self._pop_hasher(upload_id)
+                expired += 1
+
+        for incoming_path in self.video_store.incoming_folder().iterdir():
+            try:
+                if (incoming_path.is_file() and incoming_path.stat().st_mtime < cutoff
+                        and not self._session_path(incoming_path.stem).exists()):
+                    incoming_path.unlink()
+                    expired += 1
+            except FileNotFoundError:
+                pass
+        return expired
+
+    def write_chunk(self, upload_id, index, stream):
+        """
+        Stream chunk ``index`` from ``stream`` into the video file.
+
+        Chunks must arrive in order; re-sending an already received chunk is
+        allowed (it is simply overwritten). Returns the updated session.
+        """
+        with self._lock(upload_id):
+            session = self.get_session(upload_id)
+            if session is None:
+                raise UploadError('Upload session not found', status=404)
+
+            chunk_size = session['chunk_size']
+            total_size = session['total_size']
+            offset = index * chunk_size
+            if index < 0 or offset > total_size or (offset == total_size and total_size > 0):
+                raise UploadError(f'Chunk index {index} out of range', session=session)
+            if offset > session['received']:
+                # A chunk is missing; tell the client where to resume from
+                raise UploadError(f"Expected chunk at offset {session['received']}", status=409, session=session)
+
+            expected = min(chunk_size, total_size - offset)
+            hasher = self._chunk_hasher(upload_id, offset, session['received'])
+            written = 0
+            with open(session['path'], 'r+b') as f:
+                f.seek(offset)
+                while written < expected:
+                    block = stream.read(min(COPY_BUFFER_SIZE, expected - written))
+                    if not block:
+                        break
+                    f.write(block)
+                    if hasher is not None:
+                        hasher.update(block)
+                    written += len(block)
+
+            if written != expected:
+                # Interrupted transfer: keep the last complete offset so the chunk is re-sent.
+                # The running hash now covers a partial chunk, so it is rebuilt at finalize.
+                self._pop_hasher(upload_id)
+                raise UploadError(f'Incomplete chunk: got {written} of {expected} bytes', session=session)
+
+            if hasher is not None:
+                self._keep_hasher(upload_id, (offset + written, hasher))
+            session['received'] = max(session['received'], offset + written)
+            self._save_session(session)
+            return session
+
+    def _chunk_hasher(self, upload_id, offset, received):
+        """The running hash of an upload if the chunk at ``offset`` extends it, else None"""
+        if offset != received:
+            return None
+        if offset == 0:
+            return hashlib.sha256()
+        with self._hashers_lock:
+            state = self._hashers.get(upload_id)
+        if state is not None and state[0] == offset:
+            return state[1]
+        return None
+
+    def finalize(self, upload_id):
+        """
+        Check the upload is complete and close the session. Returns the session,
+        with the 'sha256' of the uploaded file.
+        """
+        with self._lock(upload_id):
+            session = self.get_session(upload_id)
+            if session is None:
+                raise UploadError('Upload session not found', status=404)
+            if session['received'] != session['total_size']:
+                raise UploadError('Upload incomplete', status=409, session=session)
+
+            final_path = Path(session['path'])
+            if final_path.stat().st_size != session['total_size']:
+                raise UploadError('Uploaded file size mismatch', status=409, session=session)
+
+            state = self._pop_hasher(upload_id)
+            if state is not None and state[0] == session['total_size']:
+                session['sha256'] = state[1].hexdigest()
+            else:
+                session['sha256'] = hash_file(final_path)
+            if session.get('expected_sha256') and session['sha256'] != session['expected_sha256']:
+                # Start over: the bytes on disk are not the file the client described
+                self._session_path(upload_id).unlink()
+                final_path.unlink()
+                raise UploadError('Uploaded file does not match its SHA-256', status=409)
+
+            self._session_path(upload_id).unlink()
+            return session
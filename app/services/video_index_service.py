@@ -0,0 +1,101 @@
+from pathlib import Path
+import threading
+import time
+
+
+class VideoIndexService:
+    """
+    In-memory filename -> path index of stored videos.
+
+    The index is built with a single scan of the uploads folder and every
+    category folder, then kept current by the upload and delete routes, so
+    locating a video for playback is a dict lookup instead of a walk over all
+    category folders on every (range) request. A lookup that misses triggers
+    a rescan, which picks up files added by other worker processes or by
+    hand, at most once every ``rescan_interval`` seconds; misses in between
+    are answered from the index, so requests for unknown names cannot keep
+    the server walking the storage folders.
+
+    Videos kept in the content-addressed store are indexed under the
+    filename a category's manifest gives them.
+    """
+
+    def __init__(self, upload_folder, categories_folder, video_store=None, rescan_interval=30):
+        self.upload_folder = Path(upload_folder)
+        self.categories_folder = Path(categories_folder)
+        self.video_store = video_store
+        self.rescan_interval = rescan_interval
+        self._paths = {}
+        self._built = False
+        # time.monotonic() of the last scan
+        self._scanned_at = None
+        self._lock = threading.Lock()
+        # Held while a miss rescans, so concurrent misses wait for one scan instead of each running their own
+        self._scan_lock = threading.Lock()
+
+    def _scan(self):
+        paths = {}
+        # Category folders first so files directly in 'uploads' take precedence
+        if self.categories_folder.is_dir():
+            for category_folder in self.categories_folder.iterdir():
+                if not category_folder.is_dir():
+                    continue
+                if self.video_store is not None:
+                    for filename, stored_path in self.video_store.entries(category_folder):
+                        paths.setdefault(filename, stored_path)
+                for file_path in category_folder.iterdir():
+                    if file_path.is_file():
+                        paths.setdefault(file_path.name, file_path)
+        if self.upload_folder.is_dir():
+            for file_path in self.upload_folder.iterdir():
+                if file_path.is_file():
+                    paths[file_path.name] = file_path
+        return paths
+
+    def rebuild(self):
+        """Rescan the storage folders and replace the index"""
+        scanned_at = time.monotonic()
+        paths = self._scan()
+        with self._lock:
+            self._paths = paths
+            self._built = True
+            self._scanned_at = scanned_at
+
+    def _rescan_if_due(self):
+        """Rescan unless the last scan is less than ``rescan_interval`` seconds old; returns whether it did"""
+        with self._scan_lock:
+            if self._scanned_at is not None and time.monotonic() - self._scanned_at < self.rescan_interval:
+                return False
+            self.rebuild()
+            return True
+
+    def register(self, file_path, filename=None):
+        """Add or update a stored file in the index (under ``filename`` if given)"""
+        file_path = Path(file_path)
+        with self._lock:
+            self._paths[filename or file_path.name] = file_path
+
+    def unregister(self, filename):
+        with self._lock:
+            self._paths.pop(filename, None)
+
+    def unregister_folder(self, folder):
+        """Drop every indexed file that lives in ``folder`` (e.g. a deleted category)"""
+        folder = Path(folder)
+        with self._lock:
+            self._paths = {name: path for name, path in self._paths.items() if path.parent != folder}
+
+    def locate(self, filename):
+        """Return the path of a stored file, or None if it does not exist"""
+        if not self._built:
+            self._rescan_if_due()
+
+        file_path = self._paths.get(filename)
+        if file_path is not None and file_path.is_file():
+            return file_path
+
+        # Unknown or stale entry: the file may have been added or removed elsewhere
+        if not self._rescan_if_due():
+            return None
+        file_path = self._paths.get(filename)
+        return file_path if file_path is not None and file_path.is_file() else None
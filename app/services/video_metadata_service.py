@@ -0,0 +1,223 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from app.services.file_utils import atomic_write_json
+from app.services.metrics_service import VIDEO_PROBE_SECONDS
+from app.services.video_store_service import is_video_hash
+import hashlib
+import json
+import re
+import threading
+import time
+
+# Bytes hashed from the start, middle and end of a video to identify its content.
+# Reading the whole file would cost as much as the probe it is meant to skip.
+HASH_SAMPLE_SIZE = 1024 * 1024
+
+# Finished jobs kept in memory for polling
+MAX_FINISHED_JOBS = 1000
+
+# Content hashes of videos outside the store remembered per path
+MAX_REMEMBERED_HASHES = 1000
+
+
+def content_hash(video_path, size=None):
+    """Fingerprint of a video: its size plus sampled blocks of its content"""
+    video_path = Path(video_path)
+    if size is None:
+        size = video_path.stat().st_size
+    digest = hashlib.sha1(str(size).encode('utf-8'))
+    with video_path.open('rb') as f:
+        for offset in sorted({0, max(0, size // 2 - HASH_SAMPLE_SIZE // 2), max(0, size - HASH_SAMPLE_SIZE)}):
+            f.seek(offset)
+            digest.update(f.read(HASH_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def _fourcc_to_codec(fourcc):
+    fourcc = int(fourcc)
+    if fourcc <= 0:
+        return None
+    codec = ''.join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4))
+    return codec.strip('\x00 ') or None
+
+
+def probe_video(video_path):
+    """
+    Read fps, frame count, duration, resolution and codec of a video with OpenCV.
+
+    Some containers report a wrong CAP_PROP_FRAME_COUNT; when the reported last
+    frame cannot be read the frames are counted instead.
+    """
+    start = time.perf_counter()
+    try:
+        metadata = _probe_video(video_path)
+    except Exception:
+        VIDEO_PROBE_SECONDS.observe(time.perf_counter() - start, result='error')
+        raise
+    VIDEO_PROBE_SECONDS.observe(time.perf_counter() - start, result='ok')
+    return metadata
+
+
+def _probe_video(video_path):
+    import cv2
+    cap = cv2.VideoCapture(str(video_path))
+    try:
+        if not cap.isOpened():
+            raise ValueError(f"Cannot open video: {Path(video_path).name}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        codec = _fourcc_to_codec(cap.get(cv2.CAP_PROP_FOURCC))
+
+        frame_count_exact = frame_count > 0 and cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count - 1) and cap.grab()
+        if not frame_count_exact:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            frame_count = 0
+            while cap.grab():
+                frame_count += 1
+    finally:
+        cap.release()
+
+    return {
+        'fps': fps,
+        'frame_count': frame_count,
+        'duration': frame_count / fps if fps > 0 else 0,
+        'width': width,
+        'height': height,
+        'codec': codec
+    }
+
+
+class VideoMetadataService:
+    """
+    Background probing of uploaded videos, with a metadata sidecar cache.
+
+    Probing opens the video with OpenCV (and may count frames), which is too
+    slow to do inside the upload request. ``submit`` returns at once with a job
+    id to poll; the probe runs on a small worker pool and its result is
+    written to ``<metadata folder>/<content hash>.json``. The content hash of
+    a video in the store is the SHA-256 it is stored under. Other videos are
+    identified by their size and sampled blocks, remembered per (path, size,
+    mtime). Reopening or re-uploading a known video, under any name, skips
+    probing.
+
+    Job ids are the content hash, so a job can be polled from any worker
+    process once its sidecar exists.
+    """
+
+    def __init__(self, metadata_folder, workers=2, store_folder=None):
+        self.metadata_folder = Path(metadata_folder)
+        self.store_folder = Path(store_folder).resolve() if store_folder is not None else None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='video-probe')
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        # resolved path -> ((size, mtime), content hash), least recently used first
+        self._hashes = OrderedDict()
+
+    def _sidecar_path(self, video_hash):
+        return self.metadata_folder / f"{video_hash}.json"
+
+    def fingerprint(self, video_path):
+        """
+        Content hash of a video: the SHA-256 of a stored video, else the sampled
+        hash, reused while the file's size and mtime are unchanged
+        """
+        resolved = Path(video_path).resolve()
+        if resolved.parent == self.store_folder and is_video_hash(resolved.stem):
+            # The store already hashed the whole file to name it
+            return resolved.stem
+
+        stat = resolved.stat()
+        key = str(resolved)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._hashes.get(key)
+            if cached is not None and cached[0] == signature:
+                self._hashes.move_to_end(key)
+                return cached[1]
+        video_hash = content_hash(resolved, stat.st_size)
+        with self._lock:
+            self._hashes[key] = (signature, video_hash)
+            self._hashes.move_to_end(key)
+            while len(self._hashes) > MAX_REMEMBERED_HASHES:
+                self._hashes.popitem(last=False)
+        return video_hash
+
+    def _read_sidecar(self, video_hash):
+        try:
+            with self._sidecar_path(video_hash).open('r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def cached(self, video_path):
+        """The cached metadata of a video, or None if it has not been probed"""
+        return self._read_sidecar(self.fingerprint(video_path))
+
+    def _set_job(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.setdefault(job_id, {'job_id': job_id})
+            job.update(fields)
+            self._jobs.move_to_end(job_id)
+            finished = [key for key, value in self._jobs.items() if value['status'] in ('done', 'error')]
+            for key in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[key]
+            return dict(job)
+
+    def _run(self, job_id, video_path):
+        self._set_job(job_id, status='running')
+        try:
+            metadata = probe_video(video_path)
+            self.metadata_folder.mkdir(parents=True, exist_ok=True)
+            atomic_write_json(self._sidecar_path(job_id), metadata, kind='metadata', indent=4)
+        except Exception as e:
+            print(f"Warning: probing {video_path} failed: {e}")
+            self._set_job(job_id, status='error', error=str(e))
+        else:
+            self._set_job(job_id, status='done', metadata=metadata)
+
+    def submit(self, video_path):
+        """
+        Probe a video in the background unless its metadata is already cached.
+        Returns the job: {'job_id', 'status': 'pending'|'running'|'done'|'error', 'metadata'?}
+        """
+        video_path = Path(video_path)
+        job_id = self.fingerprint(video_path)
+        metadata = self._read_sidecar(job_id)
+        if metadata is not None:
+            return self._set_job(job_id, status='done', metadata=metadata, filename=video_path.name)
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job['status'] in ('pending', 'running'):
+                return dict(job)
+            self._jobs[job_id] = {'job_id': job_id, 'status': 'pending', 'filename': video_path.name}
+        self._executor.submit(self._run, job_id, video_path)
+        return self.job(job_id)
+
+    def job(self, job_id):
+        """State of a probing job, or None if the id is unknown"""
+        if not re.fullmatch(r'[0-9a-f]{40}|[0-9a-f]{64}', job_id or ''):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        # Finished by another worker process (or before a restart)
+        metadata = self._read_sidecar(job_id)
+        if metadata is not None:
+            return {'job_id': job_id, 'status': 'done', 'metadata': metadata}
+        return None
+
+    def probe(self, video_path):
+        """Probe synchronously (through the cache) and return the metadata"""
+        video_path = Path(video_path)
+        metadata = self.cached(video_path)
+        if metadata is None:
+            job_id = self.fingerprint(video_path)
+            metadata = probe_video(video_path)
+            self.metadata_folder.mkdir(parents=True, exist_ok=True)
+            atomic_write_json(self._sidecar_path(job_id), metadata, kind='metadata', indent=4)
+        return metadata
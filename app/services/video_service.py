@@ -1,6 +1,5 @@
 from flask import current_app, jsonify
 from werkzeug.utils import secure_filename
-import cv2
 from pathlib import Path
 import shutil
 import json
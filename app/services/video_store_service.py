@@ -0,0 +1,199 @@
+from pathlib import Path
+from app.services.file_utils import file_lock, atomic_write_json
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+# Size of the blocks copied (and hashed) from a request stream
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# A dotfile: video annotation files are named after the video (secure_filename
+# strips leading dots), so a video cannot share the manifest's name
+MANIFEST_NAME = '.videos.json'
+# Where the manifest was kept before; a video named 'videos' clashed with it
+LEGACY_MANIFEST_NAME = 'videos.json'
+
+
+def hash_file(path):
+    """SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_video_hash(value):
+    return isinstance(value, str) and re.fullmatch(r'[0-9a-f]{64}', value) is not None
+
+
+class VideoStoreService:
+    """
+    Content-addressed video storage.
+
+    Every video is stored once as ``<store folder>/<sha256><ext>``. A category
+    refers to the videos uploaded into it through ``categories/<id>/.videos.json``
+    ({filename: {'sha256', 'stored', 'size'}}), so uploading the same recording
+    into several categories costs one copy on disk, and an upload whose hash
+    is already stored finishes without transferring the bytes again.
+
+    Adding and removing references and garbage collection of unreferenced
+    files hold one store-wide lock, so a file is never collected between
+    being stored and being linked.
+    """
+
+    def __init__(self, store_folder, categories_folder, lock_folder):
+        self.store_folder = Path(store_folder)
+        self.categories_folder = Path(categories_folder)
+        self.lock_folder = lock_folder
+
+    def _lock(self):
+        return file_lock(self.store_folder, self.lock_folder)
+
+    def incoming_folder(self):
+        """Where uploads are written while they stream in (same filesystem as the store)"""
+        folder = self.store_folder / 'incoming'
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
+    def stored_path(self, video_hash, filename):
+        return self.store_folder / f"{video_hash}{Path(filename).suffix.lower()}"
+
+    def find(self, video_hash):
+        """The stored file with this hash, or None"""
+        if not is_video_hash(video_hash) or not self.store_folder.is_dir():
+            return None
+        return next((path for path in self.store_folder.glob(f"{video_hash}*") if path.is_file()), None)
+
+    def ingest(self, stream):
+        """
+        Copy a stream into a temporary file in the store, hashing it on the way.
+        Returns (sha256, temporary path); pass both to ``add``.
+        """
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.incoming_folder(), suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b''):
+                    digest.update(block)
+                    f.write(block)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return digest.hexdigest(), Path(tmp_path)
+
+    def _manifest_path(self, category_id):
+        return self.categories_folder / category_id / MANIFEST_NAME
+
+    def manifest(self, category_id):
+        """The videos referenced by a category: {filename: entry}"""
+        return self._read_manifest(self._manifest_path(category_id))
+
+    @staticmethod
+    def _read_manifest(manifest_path):
+        try:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if not isinstance(manifest, dict):
+            return {}
+        return {filename: entry for filename, entry in manifest.items() if isinstance(entry, dict) and 'stored' in entry}
+
+    def migrate_manifests(self):
+        """
+        Rename the manifests of earlier versions (``videos.json``) to
+        MANIFEST_NAME. A ``videos.json`` that is not a manifest is the
+        annotation file of a video named 'videos' and is left alone.
+        Returns the number of manifests renamed.
+        """
+        if not self.categories_folder.is_dir():
+            return 0
+        renamed = 0
+        with self._lock():
+            for category_folder in self.categories_folder.iterdir():
+                legacy_path = category_folder / LEGACY_MANIFEST_NAME
+                manifest_path = category_folder / MANIFEST_NAME
+                if not legacy_path.is_file() or manifest_path.exists():
+                    continue
+                try:
+                    with open(legacy_path, 'r') as f:
+                        manifest = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    continue
+                if isinstance(manifest, dict) and 'annotations' not in manifest and all(
+                    isinstance(entry, dict) and 'stored' in entry for entry in manifest.values()
+                ):
+                    os.replace(legacy_path, manifest_path)
+                    renamed += 1
+        return renamed
+
+    def _link(self, category_id, filename, video_hash, stored_path):
+        manifest_path = self._manifest_path(category_id)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest = self._read_manifest(manifest_path)
+        manifest[filename] = {
+            'sha256': video_hash,
+            'stored': stored_path.name,
+            'size': stored_path.stat().st_size
+        }
+        atomic_write_json(manifest_path, manifest, kind='manifest', indent=4)
+
+    def add(self, tmp_path, video_hash, category_id, filename):
+        """
+        Move an ingested file into the store (dropping it if the hash is already
+        stored) and reference it from the category. Returns the stored path.
+        """
+        with self._lock():
+            stored_path = self.find(video_hash)
+            if stored_path is None:
+                stored_path = self.stored_path(video_hash, filename)
+                os.replace(tmp_path, stored_path)
+            else:
+                os.remove(tmp_path)
+            self._link(category_id, filename, video_hash, stored_path)
+        return stored_path
+
+    def link_existing(self, video_hash, size, category_id, filename):
+        """
+        Reference an already stored video from a category without uploading it.
+        Returns the stored path, or None if no stored file has that hash and size.
+        """
+        with self._lock():
+            stored_path = self.find(video_hash)
+            if stored_path is None or stored_path.stat().st_size != size:
+                return None
+            self._link(category_id, filename, video_hash, stored_path)
+        return stored_path
+
+    def resolve(self, category_id, filename):
+        """Path of a video referenced by a category, or None"""
+        entry = self.manifest(category_id).get(filename)
+        if entry is None:
+            return None
+        stored_path = self.store_folder / entry['stored']
+        return stored_path if stored_path.is_file() else None
+
+    def entries(self, category_folder):
+        """(filename, stored path) of every video referenced from a category folder"""
+        manifest = self._read_manifest(Path(category_folder) / MANIFEST_NAME)
+        return [(filename, self.store_folder / entry['stored']) for filename, entry in manifest.items()]
+
+    def collect_garbage(self):
+        """Delete stored videos no category refers to any more. Returns their paths."""
+        with self._lock():
+            if not self.store_folder.is_dir():
+                return []
+            referenced = set()
+            if self.categories_folder.is_dir():
+                for category_folder in self.categories_folder.iterdir():
+                    if category_folder.is_dir():
+                        referenced.update(path.name for _, path in self.entries(category_folder))
+            removed = []
+            for stored_path in self.store_folder.iterdir():
+                if stored_path.is_file() and stored_path.name not in referenced:
+                    stored_path.unlink()
+                    removed.append(stored_path)
+        return removed
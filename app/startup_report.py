@@ -0,0 +1,119 @@
+"""
+Import cost of the application, module by module.
+
+Loads app.py (or the given modules) in a fresh interpreter run with
+``python -X importtime`` and reports how long the load took, the modules
+that cost the most and whether the heavy media libraries were imported.
+Loading the app has no side effects (no folders, no background threads), so
+this can be run anywhere.
+
+Usage:
+    python -m app.startup_report [--top 20] [--group] [--json report.json] [module ...]
+"""
+
+from pathlib import Path
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Only needed to probe, thumbnail, transcode and export videos
+HEAVY_MODULES = ('cv2', 'numpy')
+
+_LOAD_APP = (
+    "import importlib.util, sys\n"
+    "spec = importlib.util.spec_from_file_location('taat_server', {path!r})\n"
+    "module = importlib.util.module_from_spec(spec)\n"
+    "sys.modules[spec.name] = module\n"
+    "spec.loader.exec_module(module)\n"
+)
+
+
+def parse_importtime(output):
+    """(module, self microseconds, cumulative microseconds, depth) of each ``-X importtime`` line"""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # The header line
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return entries
+
+
+def _group_name(module):
+    # The app's own modules one by one, libraries as a whole
+    parts = module.split('.')
+    return '.'.join(parts[:3]) if parts[0] == 'app' else parts[0]
+
+
+def measure(modules=()):
+    """Load the modules (app.py when none) in a new interpreter; returns the report"""
+    code = ''.join(f"import {module}\n" for module in modules) or _LOAD_APP.format(path=str(REPO_ROOT / 'app.py'))
+    code = "import sys\n" + code
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code + "print(*sorted(sys.modules), sep='\\n')"],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+    entries = parse_importtime(result.stderr)
+    loaded = set(result.stdout.split())
+    return {
+        'target': list(modules) or ['app.py'],
+        'wall_seconds': wall,
+        'import_seconds': sum(cumulative for _, _, cumulative, depth in entries if depth == 0) / 1e6,
+        'module_count': len(entries),
+        'heavy_modules': [module for module in HEAVY_MODULES if module in loaded],
+        'modules': [
+            {'module': name, 'self_ms': own / 1000, 'cumulative_ms': cumulative / 1000}
+            for name, own, cumulative, _ in entries
+        ]
+    }
+
+
+def top_modules(report, count, group=False):
+    """The ``count`` most expensive modules (or packages) by self time"""
+    totals = {}
+    for entry in report['modules']:
+        name = _group_name(entry['module']) if group else entry['module']
+        totals[name] = totals.get(name, 0) + entry['self_ms']
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the import cost of the application, module by module')
+    parser.add_argument('modules', nargs='*', help='Modules to import instead of app.py (e.g. app.asgi)')
+    parser.add_argument('--top', type=int, default=20, help='Number of modules to list')
+    parser.add_argument('--group', action='store_true', help='Add up the modules of each library')
+    parser.add_argument('--json', help='Also write the full report to this file')
+    args = parser.parse_args()
+
+    try:
+        report = measure(args.modules)
+    except RuntimeError as e:
+        raise SystemExit(f"Could not load {' '.join(args.modules) or 'app.py'}: {e}")
+
+    print(f"{', '.join(report['target'])}: {report['import_seconds'] * 1000:.0f} ms importing "
+          f"{report['module_count']} modules ({report['wall_seconds'] * 1000:.0f} ms with interpreter start)")
+    print(f"Heavy modules loaded: {', '.join(report['heavy_modules']) or 'none'}")
+    print(f"{'self ms':>9}  module")
+    for name, self_ms in top_modules(report, args.top, args.group):
+        print(f"{self_ms:9.1f}  {name}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+Benchmarks of the annotation routes and storage paths.
+
+Runs the Flask app in-process with its test client against synthetic data
+in a temporary folder: videos with 1k-100k start/end points, hundreds of
+categories and a file of random bytes standing in for a video, so no real
+videos (and no network) are needed. For every route and size it reports
+latency percentiles, throughput and peak Python memory, and writes the
+results as JSON so runs can be compared.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--sizes 1000 10000 100000] [--backend json|sqlite]
+                                        [--output results.json] [--compare previous.json]
+"""
+
+from contextlib import redirect_stdout
+from pathlib import Path
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+CATEGORY_ID = 'bench'
+VIDEO_FILE_SIZE = 16 * 1024 * 1024
+RANGE_SIZE = 1024 * 1024
+
+
+# --- Synthetic data ---
+
+def make_categories(count, events_per_category=8):
+    """Category configuration with ``count`` categories (the first is the benchmark's)"""
+    categories = []
+    for index in range(count):
+        category_id = CATEGORY_ID if index == 0 else f"category_{index}"
+        categories.append({
+            'id': category_id,
+            'name': category_id,
+            'color': '#336699',
+            'events': [
+                {
+                    'id': f"event_{event}",
+                    'name': f"Event {event}",
+                    'customFields': [
+                        {'name': 'team', 'type': 'select', 'options': ['Home', 'Away']},
+                        {'name': 'note', 'type': 'text'}
+                    ]
+                }
+                for event in range(events_per_category)
+            ]
+        })
+    return {'annotation_categories': categories}
+
+
+def make_points(points, events=8, duration=5400.0, seed=0):
+    """``points`` raw start/end points (points / 2 completed pairs) over ``duration`` seconds"""
+    rng = random.Random(seed)
+    annotations = []
+    for pair in range(points // 2):
+        event_id = f"event_{rng.randrange(events)}"
+        start = round(rng.uniform(0, duration), 3)
+        fields = {'team': rng.choice(['Home', 'Away']), 'note': f"n{pair}"}
+        instance_id = f"{event_id}_{pair}"
+        annotations.append({
+            'id': instance_id, 'time': start, 'categoryId': CATEGORY_ID, 'eventId': event_id,
+            'fields': fields, 'type': 'start'
+        })
+        annotations.append({
+            'time': round(start + rng.uniform(0.5, 30), 3), 'categoryId': CATEGORY_ID, 'eventId': event_id,
+            'fields': fields, 'type': 'end', 'startAnnotationId': instance_id
+        })
+    return annotations
+
+
+# --- Measurement ---
+
+def measure(name, size, operation, iterations, time_budget, memory_iterations=3):
+    """Time ``operation(i)`` (at most ``iterations`` times or ``time_budget`` seconds), then its peak memory"""
+    latencies = []
+    started = time.perf_counter()
+    for iteration in range(iterations):
+        begin = time.perf_counter()
+        operation(iteration)
+        latencies.append(time.perf_counter() - begin)
+        if time.perf_counter() - started > time_budget and len(latencies) >= 3:
+            break
+    elapsed = time.perf_counter() - started
+
+    # Traced separately: tracemalloc slows allocation down too much to time with it
+    tracemalloc.start()
+    try:
+        for iteration in range(memory_iterations):
+            operation(len(latencies) + iteration)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+    return {
+        'name': name,
+        'size': size,
+        'iterations': len(latencies),
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99),
+        'max_ms': latencies[-1] * 1000,
+        'throughput_per_s': len(latencies) / elapsed if elapsed > 0 else None,
+        'peak_memory_kib': peak / 1024
+    }
+
+
+def load_app(backend):
+    """Import app.py with the current directory (a temporary folder) as its data root"""
+    os.environ['ANNOTATION_BACKEND'] = backend
+    spec = importlib.util.spec_from_file_location('taat_benchmark_app', REPO_ROOT / 'app.py')
+    module = importlib.util.module_from_spec(spec)
+    with redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+        module.start_services()
+    return module
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def run_size(module, client, size, args):
+    """Benchmark every route and storage path on a video with ``size`` points"""
+    from app.services.annotation_service import reprocess_raw_annotations
+
+    filename = f"video_{size}.mp4"
+    annotations = make_points(size, seed=size)
+    payload = {'filename': filename, 'categoryId': CATEGORY_ID, 'annotations': annotations, 'activeAnnotations': {}}
+    check(client.post('/save_annotations', json=payload))
+    instance_ids = [ann['id'] for ann in annotations if ann['type'] == 'start']
+    rng = random.Random(size)
+    results = []
+
+    def save(_):
+        check(client.post('/save_annotations', json=payload))
+
+    def edit(_):
+        check(client.post('/edit_annotations', json={
+            'filename': filename, 'categoryId': CATEGORY_ID, 'instanceId': rng.choice(instance_ids),
+            'pointToEdit': rng.choice(['start', 'end']), 'newTime': round(rng.uniform(0, 5400), 3)
+        }))
+
+    def state(_):
+        check(client.get(f"/get_annotation_state/{CATEGORY_ID}/{filename}/event_{rng.randrange(8)}"))
+
+    # Deleted instances are taken from the end so edits above never hit a deleted one
+    deletable = instance_ids[len(instance_ids) // 2:]
+
+    def delete(iteration):
+        check(client.delete(f"/delete_annotation/{CATEGORY_ID}/{filename}/{deletable[-1 - iteration]}"))
+
+    def reprocess(_):
+        reprocess_raw_annotations(annotations)
+
+    budget = args.time_budget
+    # Full saves of large videos take seconds; fewer iterations keep the run short
+    results.append(measure('save_annotations', size, save, max(3, args.iterations // 10), budget))
+    results.append(measure('edit_annotations', size, edit, args.iterations, budget))
+    results.append(measure('get_annotation_state', size, state, args.iterations, budget))
+    results.append(measure('delete_annotation', size, delete, min(args.iterations, len(deletable) - 10), budget))
+    results.append(measure('reprocess_raw_annotations', size, reprocess, max(3, args.iterations // 10), budget))
+    return results
+
+
+def run_uploads(client, args):
+    """Serve a synthetic video: whole file, byte ranges and revalidation"""
+    video_path = Path('uploads') / 'synthetic.mp4'
+    with video_path.open('wb') as f:
+        f.write(os.urandom(VIDEO_FILE_SIZE))
+    rng = random.Random(0)
+    etag = check(client.get('/uploads/synthetic.mp4')).headers.get('ETag')
+
+    def whole(_):
+        check(client.get('/uploads/synthetic.mp4')).get_data()
+
+    def byte_range(_):
+        start = rng.randrange(VIDEO_FILE_SIZE - RANGE_SIZE)
+        check(client.get('/uploads/synthetic.mp4', headers={'Range': f"bytes={start}-{start + RANGE_SIZE - 1}"})).get_data()
+
+    def revalidate(_):
+        client.get('/uploads/synthetic.mp4', headers={'If-None-Match': etag})
+
+    return [
+        measure('uploaded_file', VIDEO_FILE_SIZE, whole, max(3, args.iterations // 10), args.time_budget),
+        measure('uploaded_file_range', RANGE_SIZE, byte_range, args.iterations, args.time_budget),
+        measure('uploaded_file_304', 0, revalidate, args.iterations, args.time_budget)
+    ]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """Print the p50 latency of every benchmark relative to a previous run"""
+    before = {(result['name'], result['size']): result for result in previous['results']}
+    print(f"\nCompared with {previous['meta'].get('revision')} ({previous['meta'].get('date')}):")
+    for result in results:
+        old = before.get((result['name'], result['size']))
+        if old is None or not old['p50_ms']:
+            continue
+        ratio = result['p50_ms'] / old['p50_ms']
+        print(f"  {result['name']:28s} {result['size']:>9}  p50 {old['p50_ms']:9.3f} -> {result['p50_ms']:9.3f} ms  x{ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the annotation routes and storage paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='start/end points per video')
+    parser.add_argument('--categories', type=int, default=200, help='categories in the configuration')
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--iterations', type=int, default=200, help='iterations of the fast operations')
+    parser.add_argument('--time-budget', type=float, default=10.0, help='seconds per benchmark at most')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='results of a previous run to compare with')
+    args = parser.parse_args()
+
+    output = Path(args.output).resolve()
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='taat-bench-') as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            module = load_app(args.backend)
+            module.category_registry.save(make_categories(args.categories))
+            client = module.app.test_client()
+            # The routes log every request; keep the report readable
+            with redirect_stdout(io.StringIO()):
+                for size in args.sizes:
+                    results.extend(run_size(module, client, size, args))
+                results.extend(run_uploads(client, args))
+        finally:
+            os.chdir(cwd)
+
+    print(f"{'benchmark':28s} {'size':>9} {'iter':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'ops/s':>9} {'peak KiB':>10}")
+    for result in results:
+        print(f"{result['name']:28s} {result['size']:>9} {result['iterations']:>5} {result['p50_ms']:9.3f} "
+              f"{result['p90_ms']:9.3f} {result['p99_ms']:9.3f} {result['throughput_per_s']:9.1f} "
+              f"{result['peak_memory_kib']:10.1f}")
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'categories': args.categories
+        },
+        'results': results
+    }
+    with output.open('w') as f:
+        json.dump(report, f, indent=4)
+    print(f"\nResults written to {output}")
+
+    if previous is not None:
+        compare(results, previous)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,54 @@ import os
 from pathlib import Path
 
 class Config:
-    UPLOAD_FOLDER = 'uploads'
-    ANNOTATIONS_FOLDER = 'annotations'
-    EVENT_TYPES_FILE = 'config/annotation_types.json'
-    CATEGORIES_FOLDER = 'categories'
-    MAX_CONTENT_LENGTH = 500 * 1024 * 1024  # 500MB max file size
+    UPLOAD_FOLDER = 'uploads'  # Where videos are stored
+    ANNOTATIONS_FOLDER = 'annotations'  # Where annotation data is stored
+    EVENT_TYPES_FILE = 'config/annotation_types.json'  # Event configuration
+    CATEGORIES_FOLDER = 'categories'  # Category-specific data
+    MAX_CONTENT_LENGTH = 2 * 1000 * 1024 * 1024  # ~2GB max file size
+    UPLOAD_SESSIONS_FOLDER = 'uploads/sessions'  # State of in-progress chunked uploads
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Default chunk size for chunked uploads
+    UPLOAD_CHUNK_SIZE_MAX = 64 * 1024 * 1024  # Largest chunk a client may request
+    UPLOAD_SESSION_MAX_AGE = 24 * 3600  # Seconds an unfinished upload is kept after its last chunk
+    VIDEO_CACHE_MAX_AGE = 3600  # Seconds browsers may reuse served video bytes
+    VIDEO_INDEX_RESCAN_SECONDS = 30  # Least time between two rescans for videos the index does not know
+    ANNOTATION_JOURNAL_COMPACT_BYTES = 256 * 1024  # Journal size that triggers compaction
+    ANNOTATION_BACKEND = os.environ.get('ANNOTATION_BACKEND', 'json')  # 'json' files or 'sqlite'
+    ANNOTATION_DATABASE = 'annotations.db'  # Database used by the sqlite backend
+    ANNOTATION_CACHE_SIZE = 64  # Videos whose processed view is kept in memory
+    LOCKS_FOLDER = 'uploads/locks'  # Lock files serializing writers across worker processes
+    VIDEO_STORE_FOLDER = 'uploads/store'  # Videos stored once, named by their SHA-256
+    VIDEO_METADATA_FOLDER = 'uploads/metadata'  # Cached probe results (fps, frames, codec...)
+    VIDEO_PROBE_WORKERS = 2  # Background threads probing uploaded videos
+    THUMBNAIL_FOLDER = 'uploads/thumbnails'  # Timeline sprite sheets and key frame indexes
+    THUMBNAIL_WORKERS = 1  # Background threads decoding videos into sprite sheets
+    THUMBNAIL_INTERVAL = 2  # Seconds of video between two timeline thumbnails
+    THUMBNAIL_WIDTH = 160  # Width of one thumbnail tile in pixels
+    THUMBNAIL_COLUMNS = 10  # Tiles per sprite sheet row
+    THUMBNAIL_ROWS = 10  # Tile rows per sprite sheet
+    THUMBNAIL_CACHE_MAX_AGE = 365 * 24 * 3600  # Sprite sheets never change (keyed by content)
+    VIDEO_PROXY_ENABLED = True  # Build low-resolution playback proxies after upload
+    VIDEO_PROXY_FOLDER = 'uploads/proxies'  # Where playback proxies are written
+    VIDEO_PROXY_HEIGHT = 480  # Proxy frame height; smaller videos get no proxy
+    VIDEO_PROXY_KEYFRAME_INTERVAL = 1  # Seconds between proxy key frames (seek granularity)
+    VIDEO_PROXY_WORKERS = 1  # Worker processes transcoding proxies
+    LABEL_EXPORT_FOLDER = 'exports/labels'  # Dense per-frame label matrices for training
+    LABEL_EXPORT_MEMMAP_CELLS = 64 * 1024 * 1024  # Larger label matrices are written memory-mapped (.npy)
+    PROFILING_ENABLED = os.environ.get('TAAT_PROFILING') == '1'  # Allow per-request cProfile runs
+    PROFILE_HEADER = 'X-Profile'  # Requests sent with this header are profiled (when enabled)
+    PROFILE_SLOW_SECONDS = 0.5  # Profiled requests slower than this dump their stats
+    PROFILE_FOLDER = 'uploads/profiles'  # Where the .prof files of slow requests are written
+    ANNOTATION_JSON_INDENT = None  # Indentation of the annotation files; None writes them compactly
+    RESPONSE_COMPRESSION_MIN_BYTES = 1024  # Smaller responses are sent uncompressed
+    RESPONSE_COMPRESSION_LEVEL = 6  # gzip/deflate level (1 fastest, 9 smallest)
+    SYNC_HISTORY_SIZE = 256  # Change records kept per video for clients resuming their event stream
+    SYNC_HEARTBEAT_SECONDS = 15  # Idle event streams send a keepalive comment this often
+    SYNC_CLIENT_HEADER = 'X-Client-Id'  # Writers name themselves so clients can skip their own changes
+    ASGI_ANNOTATION_THREADS = 16  # Async serving: threads running the annotation and page routes
+    ASGI_BLOCKING_THREADS = 8  # Async serving: threads for uploads, video files, probes and exports
+    ASGI_STREAM_THREADS = 128  # Async serving: threads holding open event streams (one per client)
+    AGREEMENT_FPS = 25  # Frames per second of the grid annotator agreement is computed on
+    AGREEMENT_IOU_THRESHOLD = 0.5  # Intervals of two annotators overlapping this much are matched
     
     # Add any other configuration variables here
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-please-change' 
\ No newline at end of file
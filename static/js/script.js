@@ -45,9 +45,6 @@ $(document).ready(function () {
                 return;
             }
             videoFile = file;
-            const formData = new FormData();
-            formData.append('video', file);
-            formData.append('categoryId', selectedCategoryId);
 
             const uploadArea = $('#uploadArea');
             const originalContent = uploadArea.html();
@@ -63,46 +60,129 @@ $(document).ready(function () {
                 </div>
             `);
 
-            $.ajax({
-                url: '/upload',
-                type: 'POST',
-                data: formData,
-                processData: false,
-                contentType: false,
-                xhr: function() {
-                    const xhr = new window.XMLHttpRequest();
-                    xhr.upload.addEventListener('progress', function(e) {
-                        if (e.lengthComputable) {
-                            const percent = Math.round((e.loaded / e.total) * 100);
-                            $('.progress-bar').css('width', percent + '%').text(percent + '%');
-                            $('.upload-status').text(`Uploading video... ${percent}%`);
-                        }
-                    }, false);
-                    return xhr;
-                },
-                success: function(response) {
+            this.uploadInChunks(file, selectedCategoryId)
+                .then(response => {
                     uploadContainer.classList.add('d-none');
                     videoContainer.classList.remove('d-none');
                     
                     const newPlayer = initializeVideoPlayer(`/uploads/${response.filename}`);
                     
+                    currentVideoFilename = response.filename;
                     newPlayer.ready(function() {
                         AnnotationManager.loadExistingAnnotations(response);
+                        loadTimelineThumbnails(response.filename);
+                        if ($('#proxyPlayback').is(':checked')) {
+                            switchPlaybackSource(true);
+                        }
                         showToast('Video loaded successfully!', 'success');
                     });
-                },
-                error: function(xhr) {
+                })
+                .catch(error => {
                     uploadArea.html(originalContent);
-                    showToast(xhr.responseJSON?.error || 'Error uploading video', 'error');
+                    showToast(error.message || 'Error uploading video', 'error');
                     $('#videoUpload').val('');
+                });
+        },
+
+        // SHA-256 of a file, read in blocks (null if hash-wasm is not loaded)
+        async hashFile(file) {
+            if (!window.hashwasm) return null;
+            const hasher = await hashwasm.createSHA256();
+            hasher.init();
+            const blockSize = 16 * 1024 * 1024;
+            for (let start = 0; start < file.size; start += blockSize) {
+                const block = await file.slice(start, start + blockSize).arrayBuffer();
+                hasher.update(new Uint8Array(block));
+                const percent = Math.round((Math.min(start + blockSize, file.size) / file.size) * 100);
+                $('.upload-status').text(`Checking video... ${percent}%`);
+            }
+            return hasher.digest('hex');
+        },
+
+        // Nonce identifying an upload of this file when there is no SHA-256, kept so a reload can resume it
+        uploadNonce(file) {
+            const key = `taat-upload:${file.name}:${file.size}:${file.lastModified}`;
+            let nonce = localStorage.getItem(key);
+            if (!nonce) {
+                nonce = window.crypto?.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+                localStorage.setItem(key, nonce);
+            }
+            return { key: key, nonce: nonce };
+        },
+
+        // Chunked, resumable upload: init -> PUT chunk N -> finalize.
+        // Re-initialising the same file (same SHA-256, or nonce) resumes from the offset the server reports.
+        // Videos the server already stores (same SHA-256) are added without uploading.
+        async uploadInChunks(file, categoryId) {
+            const requestJson = async (url, options) => {
+                const response = await fetch(url, options);
+                const body = await response.json().catch(() => ({}));
+                if (!response.ok) {
+                    const error = new Error(body.error || `Upload failed (${response.status})`);
+                    error.offset = body.offset;
+                    throw error;
                 }
+                return body;
+            };
+
+            const sha256 = await this.hashFile(file).catch(() => null);
+            const resume = sha256 ? null : this.uploadNonce(file);
+            const session = await requestJson('/upload/init', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    filename: file.name, categoryId: categoryId, size: file.size,
+                    sha256: sha256, nonce: resume ? resume.nonce : null
+                })
             });
+            if (session.complete) return session;
+
+            const chunkSize = session.chunk_size;
+            let offset = session.offset;
+            let retries = 0;
+
+            const showProgress = () => {
+                const percent = file.size > 0 ? Math.round((offset / file.size) * 100) : 100;
+                $('.progress-bar').css('width', percent + '%').text(percent + '%');
+                $('.upload-status').text(`Uploading video... ${percent}%`);
+            };
+            showProgress();
+
+            while (offset < file.size) {
+                const index = Math.floor(offset / chunkSize);
+                const start = index * chunkSize;
+                try {
+                    const status = await requestJson(`/upload/${session.upload_id}/chunk/${index}`, {
+                        method: 'PUT',
+                        headers: { 'Content-Type': 'application/octet-stream' },
+                        body: file.slice(start, Math.min(start + chunkSize, file.size))
+                    });
+                    offset = status.offset;
+                    retries = 0;
+                    showProgress();
+                } catch (error) {
+                    if (++retries > 5) throw error;
+                    // Ask the server where to resume from before retrying
+                    const status = await requestJson(`/upload/${session.upload_id}`).catch(() => null);
+                    if (status) offset = status.offset;
+                    await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                }
+            }
+
+            $('.upload-status').text('Processing video...');
+            const result = await requestJson(`/upload/${session.upload_id}/finalize`, { method: 'POST' });
+            if (resume) localStorage.removeItem(resume.key);
+            return result;
         }
     };
     
     const AnnotationManager = {
         annotations: [],
         activeAnnotations: new Map(),
+        pendingOperations: [],
+        // Identifies this tab's writes, so its own changes are not applied twice
+        clientId: `${Date.now()}_${Math.random().toString(36).slice(2)}`,
+        syncSource: null,
         selectedCategory: null,
         selectedEvent: null,
         lastEventFieldValues: {},
@@ -276,7 +356,11 @@ $(document).ready(function () {
                         console.log('Start annotations after deletion:', this.annotations.filter(a => a.type === 'start').length);
                         console.log('End annotations after deletion:', this.annotations.filter(a => a.type === 'end').length);
                 
-                        this.saveAnnotations();
+                        this.pendingOperations.push({
+                            op: 'delete',
+                            instanceId: annotation.type === 'start' ? annotation.id : annotation.startAnnotationId
+                        });
+                        this.saveOperations();
                         updateVideoMarkers();
                         this.updateAnnotationsList();
                         showToast('Annotation pair deleted successfully', 'success');
@@ -378,6 +462,7 @@ $(document).ready(function () {
         
                         // Add end annotation
                 this.annotations.push(endAnnotation);
+                this.pendingOperations.push({ op: 'add', annotation: endAnnotation });
                 
                 // Update display state
                 this.activeAnnotations.delete(eventId);
@@ -404,11 +489,12 @@ $(document).ready(function () {
 
                 this.activeAnnotations.set(eventId, startAnnotation);
                 this.annotations.push(startAnnotation);
+                this.pendingOperations.push({ op: 'add', annotation: startAnnotation });
                 this.updateEventButtonState(eventId, true);
                 showToast('Activity start point set', 'success');
             }
 
-            this.saveAnnotations();
+            this.saveOperations();
             updateVideoMarkers();
             this.updateAnnotationsList();
 
@@ -416,6 +502,36 @@ $(document).ready(function () {
             if (modal) modal.hide();
         },
     
+        // Send only the changes since the last save (appended to the server-side journal)
+        saveOperations() {
+            if (!videoFile || !selectedCategoryId) {
+                console.error('Missing required data for saving annotations');
+                return;
+            }
+
+            const operations = this.pendingOperations.concat([
+                { op: 'active', activeAnnotations: Object.fromEntries(this.activeAnnotations) }
+            ]);
+            this.pendingOperations = [];
+
+            $.ajax({
+                url: `/annotations/${selectedCategoryId}/${encodeURIComponent(videoFile.name)}/operations`,
+                type: 'POST',
+                headers: { 'X-Client-Id': this.clientId },
+                contentType: 'application/json',
+                data: JSON.stringify({ operations: operations }),
+                success: (response) => {
+                    console.log('Annotations saved successfully:', response);
+                    showToast('Annotations saved successfully', 'success');
+                },
+                error: (xhr) => {
+                    console.error('Error saving annotations:', xhr);
+                    // Fall back to a full save so no change is lost
+                    this.saveAnnotations();
+                }
+            });
+        },
+
         saveAnnotations() {
             if (!videoFile || !selectedCategoryId) {
                 console.error('Missing required data for saving annotations');
@@ -432,6 +548,7 @@ $(document).ready(function () {
             $.ajax({
                 url: '/save_annotations',
                 type: 'POST',
+                headers: { 'X-Client-Id': this.clientId },
                 contentType: 'application/json',
                 data: JSON.stringify(annotationData),
                 success: (response) => {
@@ -448,6 +565,7 @@ $(document).ready(function () {
         loadExistingAnnotations(videoData) {
             this.activeAnnotations.clear();
             this.annotations = [];
+            this.pendingOperations = [];
     
             if (videoData.annotations) {
                 this.annotations = videoData.annotations.annotations || [];
@@ -461,6 +579,82 @@ $(document).ready(function () {
                 this.updateAnnotationsList();
                 updateVideoMarkers();
             }
+            if (videoFile && selectedCategoryId) {
+                this.startSync(selectedCategoryId, videoFile.name);
+            }
+        },
+
+        // Follow the changes other annotators write to this video (Server-Sent Events).
+        // The annotations are reloaded once subscribed ('hello'), so no change falls in between.
+        startSync(categoryId, filename) {
+            if (this.syncSource) this.syncSource.close();
+            if (!window.EventSource) return;
+
+            const source = new EventSource(`/annotations/${categoryId}/${encodeURIComponent(filename)}/events`);
+            // Changes that arrive while the annotations are loading wait until the load tells which ones it has
+            this.syncQueue = [];
+            const received = (e) => {
+                const change = JSON.parse(e.data);
+                change.kind = e.type;
+                if (this.syncQueue) {
+                    this.syncQueue.push(change);
+                } else {
+                    this.applyRemoteChange(change, categoryId, filename);
+                }
+            };
+            source.addEventListener('operations', received);
+            source.addEventListener('snapshot', received);
+            source.addEventListener('hello', () => this.reloadAnnotations(categoryId, filename));
+            // Changes were missed (e.g. the server restarted): start over from the stored annotations
+            source.addEventListener('reset', () => this.reloadAnnotations(categoryId, filename));
+            this.syncSource = source;
+        },
+
+        applyRemoteChange(change, categoryId, filename) {
+            if (change.client === this.clientId) return;
+            if (change.kind === 'snapshot') {
+                this.reloadAnnotations(categoryId, filename);
+            } else {
+                this.applyRemoteOperations(change.operations);
+            }
+        },
+
+        applyRemoteOperations(operations) {
+            const pointOf = (instanceId, point) => this.annotations.find(a =>
+                a.type === point && (point === 'start' ? a.id : a.startAnnotationId) === instanceId);
+
+            operations.forEach(operation => {
+                if (operation.op === 'add') {
+                    this.annotations.push(operation.annotation);
+                } else if (operation.op === 'update') {
+                    const annotation = pointOf(operation.instanceId, operation.point);
+                    if (!annotation) return;
+                    Object.assign(annotation, operation.changes);
+                    const partner = pointOf(operation.instanceId, operation.point === 'start' ? 'end' : 'start');
+                    if (partner && operation.changes.fields) partner.fields = operation.changes.fields;
+                } else if (operation.op === 'delete') {
+                    this.annotations = this.annotations.filter(a =>
+                        !(a.type === 'start' && a.id === operation.instanceId) &&
+                        !(a.type === 'end' && a.startAnnotationId === operation.instanceId));
+                }
+                // 'active' maps describe what each annotator is recording and are not merged
+            });
+            this.updateAnnotationsList();
+            updateVideoMarkers();
+        },
+
+        reloadAnnotations(categoryId, filename) {
+            this.syncQueue = this.syncQueue || [];
+            $.getJSON(`/get_active_annotations/${categoryId}/${encodeURIComponent(filename)}`, (data) => {
+                this.annotations = data.annotations || [];
+                // The loaded annotations already include every change up to their version
+                const queued = this.syncQueue || [];
+                this.syncQueue = null;
+                const loaded = queued.findIndex(change => change.version === data.version);
+                queued.slice(loaded + 1).forEach(change => this.applyRemoteChange(change, categoryId, filename));
+                this.updateAnnotationsList();
+                updateVideoMarkers();
+            });
         },
 
         deleteAnnotation(annotation) {
@@ -472,6 +666,7 @@ $(document).ready(function () {
             $.ajax({
                 url: `/delete_annotation/${annotation.categoryId}/${annotation.videoName}/${annotation.id}`,
                 type: 'DELETE',
+                headers: { 'X-Client-Id': this.clientId },
                 success: (response) => {
                     console.log('Annotation deleted successfully:', response);
                     // Remove the annotation from the local list
@@ -638,7 +833,13 @@ $(document).ready(function () {
                     annotation.fields = { ...updatedFields };
                     annotation.time = newTime;
             
-                    this.saveAnnotations();
+                    this.pendingOperations.push({
+                        op: 'update',
+                        instanceId: annotation.type === 'start' ? annotation.id : annotation.startAnnotationId,
+                        point: annotation.type,
+                        changes: { time: newTime, fields: { ...updatedFields } }
+                    });
+                    this.saveOperations();
                     updateVideoMarkers();
                     this.updateAnnotationsList();
             
@@ -1318,6 +1519,7 @@ $(document).ready(function () {
     let selectedEventId = null;
     let selectedEventName = null;
     let player = null;
+    let currentVideoFilename = null;
 
     // Drag and drop functionality (already in VideoManager)
     $('#videoUpload').on('change', function(e) {
@@ -1429,6 +1631,91 @@ $(document).ready(function () {
         return player;
     }
 
+    // Switch between the original video and its low-resolution proxy, keeping
+    // the playback position (the proxy has the same timestamps).
+    function switchPlaybackSource(useProxy) {
+        if (!player || !currentVideoFilename) return;
+
+        const apply = (source) => {
+            const time = player.currentTime();
+            const paused = player.paused();
+            player.src(source);
+            player.one('loadedmetadata', () => {
+                player.currentTime(time);
+                if (!paused) player.play();
+            });
+        };
+
+        if (!useProxy) {
+            apply({ type: 'video/mp4', src: `/uploads/${currentVideoFilename}` });
+            return;
+        }
+        $.get(`/videos/${encodeURIComponent(currentVideoFilename)}/proxy`).done(info => {
+            if (info.status === 'done') {
+                apply({ type: info.mimetype, src: info.url });
+            } else if (info.status === 'skipped') {
+                showToast('This video is already low resolution', 'info');
+            } else {
+                showToast('The low-resolution copy is not ready yet', 'info');
+            }
+        });
+    }
+
+    $('#proxyPlayback')
+        .prop('checked', localStorage.getItem('proxyPlayback') === '1')
+        .on('change', function() {
+            localStorage.setItem('proxyPlayback', this.checked ? '1' : '');
+            switchPlaybackSource(this.checked);
+        });
+
+    // Hover previews on the progress bar from server-built sprite sheets.
+    // The sprites are built in the background after upload, so poll until ready.
+    function loadTimelineThumbnails(filename, attempt = 0) {
+        $.ajax({
+            url: `/videos/${encodeURIComponent(filename)}/thumbnails`,
+            method: 'GET',
+            success: function(index, textStatus, xhr) {
+                if (xhr.status === 202) {
+                    if (attempt < 100) {
+                        setTimeout(() => loadTimelineThumbnails(filename, attempt + 1), 3000);
+                    }
+                    return;
+                }
+                setupTimelineThumbnails(index);
+            },
+            error: function() {
+                console.log('No timeline thumbnails for', filename);
+            }
+        });
+    }
+
+    function setupTimelineThumbnails(index) {
+        if (!player || !index.count) return;
+
+        const progressHolder = $(player.el()).find('.vjs-progress-holder');
+        progressHolder.find('.timeline-thumbnail').remove();
+        const preview = $('<div class="timeline-thumbnail"></div>').css({
+            width: index.tile_width + 'px',
+            height: index.tile_height + 'px'
+        }).hide().appendTo(progressHolder);
+        const tilesPerSheet = index.columns * index.rows;
+
+        progressHolder.off('.thumbnails')
+            .on('mousemove.thumbnails', function(e) {
+                const rect = this.getBoundingClientRect();
+                const position = Math.min(Math.max((e.clientX - rect.left) / rect.width, 0), 1);
+                const tile = Math.min(Math.floor((position * player.duration()) / index.interval), index.count - 1);
+                const sheet = Math.floor(tile / tilesPerSheet);
+                const slot = tile % tilesPerSheet;
+                preview.css({
+                    left: (e.clientX - rect.left - index.tile_width / 2) + 'px',
+                    backgroundImage: `url(${index.sprite_urls[sheet]})`,
+                    backgroundPosition: `-${(slot % index.columns) * index.tile_width}px -${Math.floor(slot / index.columns) * index.tile_height}px`
+                }).show();
+            })
+            .on('mouseleave.thumbnails', () => preview.hide());
+    }
+
     function setupCustomControls() {
         if (!player) return;
 
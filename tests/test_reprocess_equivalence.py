@@ -0,0 +1,209 @@
+"""
+The copy-free pairing (reprocess_raw_annotations) and the incrementally kept
+processed view (VideoAnnotations) must give exactly the output of the
+original deepcopy-based reprocess_raw_annotations.
+"""
+
+from contextlib import redirect_stdout
+from copy import deepcopy
+import io
+import random
+
+import pytest
+
+from app.services.annotation_service import (
+    AnnotationIndex, VideoAnnotations, apply_operations, reprocess_raw_annotations, validate_operation
+)
+
+EVENTS = ['goal', 'foul', 'pass']
+
+
+def legacy_reprocess_raw_annotations(raw_annotations_list):
+    """reprocess_raw_annotations as it was, deep-copying every record"""
+    processed_annotations = []
+    active_start_points_by_unique_id = {}
+
+    for ann_data in raw_annotations_list:
+        ann_type = ann_data.get('type')
+
+        if ann_type == 'start':
+            unique_start_id = ann_data.get('id')
+            if unique_start_id:
+                active_start_points_by_unique_id[unique_start_id] = deepcopy(ann_data)
+            else:
+                processed_annotations.append(deepcopy(ann_data))
+        elif ann_type == 'end':
+            linked_start_id = ann_data.get('startAnnotationId')
+            if linked_start_id and linked_start_id in active_start_points_by_unique_id:
+                start_ann_instance = active_start_points_by_unique_id.pop(linked_start_id)
+                complete_ann = deepcopy(start_ann_instance)
+                start_time = start_ann_instance.get('time')
+                end_time = ann_data.get('time')
+                complete_ann.update({
+                    'startTime': start_time,
+                    'endTime': end_time,
+                    'duration': (end_time - start_time) if start_time is not None and end_time is not None else 0,
+                    'type': 'complete',
+                })
+                complete_ann.pop('id', None)
+                complete_ann.pop('startAnnotationId', None)
+                processed_annotations.append(complete_ann)
+            else:
+                processed_annotations.append(deepcopy(ann_data))
+        else:
+            processed_annotations.append(deepcopy(ann_data))
+
+    for unpaired_start_ann in active_start_points_by_unique_id.values():
+        processed_annotations.append(deepcopy(unpaired_start_ann))
+
+    return processed_annotations
+
+
+def _fields(rng):
+    fields = {'team': rng.choice(['Home', 'Away'])}
+    if rng.random() < 0.5:
+        fields['players'] = [rng.randrange(20) for _ in range(rng.randrange(3))]
+    if rng.random() < 0.3:
+        fields['detail'] = {'zone': rng.randrange(9), 'tags': [rng.choice('abc')]}
+    return fields
+
+
+def _start(rng, instance_id):
+    ann = {'type': 'start', 'eventId': rng.choice(EVENTS), 'categoryId': 'c', 'time': round(rng.uniform(0, 100), 3),
+           'fields': _fields(rng)}
+    if instance_id is not None:
+        ann['id'] = instance_id
+    return ann
+
+
+def _end(rng, instance_id, event_id=None):
+    ann = {'type': 'end', 'eventId': event_id or rng.choice(EVENTS), 'time': round(rng.uniform(0, 100), 3),
+           'fields': _fields(rng)}
+    if instance_id is not None:
+        ann['startAnnotationId'] = instance_id
+    return ann
+
+
+def random_raw_annotations(rng, size):
+    """Raw points with the irregular cases the pairing has to handle"""
+    raw = []
+    ids = [f"i{n}" for n in range(size)]
+    for instance_id in ids:
+        start = _start(rng, instance_id)
+        raw.append(start)
+        if rng.random() < 0.75:
+            raw.append(_end(rng, instance_id, start['eventId']))
+    roll = rng.random()
+    if roll < 0.3:
+        # Orphaned end, end without a link, start without an id
+        raw.append(_end(rng, 'missing'))
+        raw.append(_end(rng, None))
+        raw.append(_start(rng, None))
+    if ids and rng.random() < 0.3:
+        # A duplicated start id and a second end for one instance
+        raw.append(_start(rng, rng.choice(ids)))
+        raw.append(_end(rng, rng.choice(ids)))
+    if rng.random() < 0.2:
+        raw.append({'type': 'complete', 'eventId': 'goal', 'startTime': 1, 'endTime': 2, 'fields': _fields(rng)})
+        raw.append({'time': 5, 'eventId': 'pass'})
+    rng.shuffle(raw)
+    return raw
+
+
+def random_operation(rng, ids):
+    roll = rng.random()
+    if roll < 0.3 or not ids:
+        instance_id = rng.choice(ids) if ids and rng.random() < 0.4 else f"n{rng.randrange(10 ** 6)}"
+        ids.append(instance_id)
+        if rng.random() < 0.6:
+            return {'op': 'add', 'annotation': _start(rng, instance_id)}
+        return {'op': 'add', 'annotation': _end(rng, instance_id)}
+    if roll < 0.7:
+        changes = {}
+        if rng.random() < 0.7:
+            changes['time'] = round(rng.uniform(0, 100), 3)
+        if rng.random() < 0.4:
+            changes['fields'] = _fields(rng)
+        if rng.random() < 0.2:
+            changes['eventId'] = rng.choice(EVENTS)
+        return {'op': 'update', 'instanceId': rng.choice(ids + ['missing']), 'point': rng.choice(['start', 'end']),
+                'changes': changes}
+    if roll < 0.9:
+        return {'op': 'delete', 'instanceId': rng.choice(ids + ['missing'])}
+    return {'op': 'active', 'activeAnnotations': {rng.choice(EVENTS): {'time': 1}}}
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    # The pairing prints a warning for every orphaned point
+    with redirect_stdout(io.StringIO()):
+        yield
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_rebuild_matches_deepcopy_version(seed):
+    rng = random.Random(seed)
+    raw = random_raw_annotations(rng, rng.randrange(0, 40))
+    snapshot = deepcopy(raw)
+
+    assert reprocess_raw_annotations(raw) == legacy_reprocess_raw_annotations(raw)
+    # Neither the raw records nor their nested values are modified
+    assert raw == snapshot
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_incremental_view_matches_deepcopy_version(seed):
+    rng = random.Random(seed)
+    raw = random_raw_annotations(rng, rng.randrange(0, 30))
+    ids = [ann['id'] for ann in raw if ann.get('type') == 'start' and ann.get('id')]
+    state = VideoAnnotations({'annotations': deepcopy(raw), 'activeAnnotations': {}})
+    # The same operations replayed on a plain copy, without any cached state
+    replayed = {'annotations': deepcopy(raw), 'activeAnnotations': {}}
+
+    assert state.processed == legacy_reprocess_raw_annotations(raw)
+    for _ in range(40):
+        operations = [random_operation(rng, ids) for _ in range(rng.randrange(1, 4))]
+        state.apply(deepcopy(operations))
+        apply_operations(replayed, deepcopy(operations))
+
+        expected = legacy_reprocess_raw_annotations(replayed['annotations'])
+        assert state.storage_data['annotations'] == replayed['annotations']
+        assert state.processed == expected
+        # A second read reuses the cached list until the next change
+        assert state.processed is state.processed
+        assert reprocess_raw_annotations(state.storage_data['annotations']) == expected
+
+
+def _index_view(index):
+    """What lookups see through an AnnotationIndex: the points of every instance and the open starts"""
+    points = {
+        instance_id: (id(index.point(instance_id, 'start')), id(index.point(instance_id, 'end')))
+        for instance_id in index.instance_ids()
+    }
+    open_starts = {
+        event_id: ({id(ann) for ann in starts.values()}, id(index.open_start(event_id)))
+        for event_id, starts in index.open_starts.items()
+    }
+    return points, open_starts
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_incremental_index_matches_rebuilt_index(seed):
+    rng = random.Random(seed)
+    raw = random_raw_annotations(rng, rng.randrange(0, 30))
+    ids = [ann['id'] for ann in raw if ann.get('type') == 'start' and ann.get('id')]
+    state = VideoAnnotations({'annotations': raw, 'activeAnnotations': {}})
+
+    for _ in range(40):
+        operations = [random_operation(rng, ids) for _ in range(rng.randrange(1, 4))]
+        assert all(validate_operation(operation) is None for operation in operations)
+        state.apply(operations)
+
+        assert _index_view(state.index) == _index_view(AnnotationIndex(state.storage_data['annotations']))
+
+
+@pytest.mark.parametrize('key', ['id', 'type', 'startAnnotationId'])
+def test_update_cannot_change_link_keys(key):
+    operation = {'op': 'update', 'instanceId': 'a', 'point': 'start', 'changes': {key: 'b', 'time': 3}}
+
+    assert key in validate_operation(operation)
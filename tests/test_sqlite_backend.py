@@ -0,0 +1,85 @@
+"""
+The SQLite backend must store exactly what the JSON journal replay does, and
+serve the same processed view, for any sequence of operations.
+"""
+
+from contextlib import redirect_stdout
+from copy import deepcopy
+import io
+import random
+
+import pytest
+
+from app.services.annotation_service import apply_operations, reprocess_raw_annotations
+from app.services.search_index_service import SearchIndex
+from app.services.sqlite_annotation_service import SqliteAnnotationService
+from tests.test_reprocess_equivalence import random_operation, random_raw_annotations
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    # The pairing prints a warning for every orphaned point
+    with redirect_stdout(io.StringIO()):
+        yield
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_operations_match_json_replay(tmp_path, seed):
+    rng = random.Random(seed)
+    raw = random_raw_annotations(rng, rng.randrange(0, 20))
+    ids = [ann['id'] for ann in raw if ann.get('type') == 'start' and ann.get('id')]
+    service = SqliteAnnotationService(tmp_path / 'annotations.db', cache_size=1)
+    replayed = {'video_name': 'v.mp4', 'category_id': 'c', 'annotations': deepcopy(raw), 'activeAnnotations': {}}
+    service.save('c', 'v.mp4', deepcopy(replayed))
+
+    for step in range(20):
+        operations = [random_operation(rng, ids) for _ in range(rng.randrange(1, 4))]
+        service.append_operations('c', 'v.mp4', deepcopy(operations))
+        apply_operations(replayed, deepcopy(operations))
+        if step % 3 == 0:
+            # Another video takes the only cache slot, so the next read goes to the database
+            service.load_processed('c', 'other.mp4')
+
+        assert service.load('c', 'v.mp4') == replayed
+        assert service.load_processed('c', 'v.mp4') == reprocess_raw_annotations(replayed['annotations'])
+
+
+def test_delete_removes_first_points_only(tmp_path):
+    service = SqliteAnnotationService(tmp_path / 'annotations.db')
+    points = [
+        {'type': 'start', 'id': 'a', 'eventId': 'goal', 'time': 1},
+        {'type': 'end', 'startAnnotationId': 'a', 'eventId': 'goal', 'time': 2},
+        {'type': 'start', 'id': 'a', 'eventId': 'goal', 'time': 3},
+        {'type': 'end', 'startAnnotationId': 'a', 'eventId': 'goal', 'time': 4},
+    ]
+    service.save('c', 'v.mp4', {'video_name': 'v.mp4', 'annotations': points, 'activeAnnotations': {}})
+    version = service.append_operations('c', 'v.mp4', [{'op': 'delete', 'instanceId': 'a'}])
+
+    assert [ann['time'] for ann in service.load('c', 'v.mp4')['annotations']] == [3, 4]
+    assert [ann['startTime'] for ann in service.interval_index('c', 'v.mp4').query()] == [3]
+    assert service.version('c', 'v.mp4') == version
+
+
+def test_deleted_category_stays_out_of_the_search_index(tmp_path):
+    service = SqliteAnnotationService(tmp_path / 'annotations.db')
+    points = [
+        {'type': 'start', 'id': 'a', 'eventId': 'goal', 'time': 1},
+        {'type': 'end', 'startAnnotationId': 'a', 'eventId': 'goal', 'time': 2},
+    ]
+    for category_id in ('c', 'd'):
+        service.save(category_id, 'v.mp4', {'video_name': 'v.mp4', 'annotations': deepcopy(points), 'activeAnnotations': {}})
+    service.load_processed('c', 'v.mp4')
+    index = SearchIndex(
+        service.videos,
+        lambda category_id, filename: (filename, service.load_processed(category_id, filename))
+    )
+
+    assert service.delete_category('c') == 1
+    index.build()
+
+    assert [result['category_id'] for result in index.search(event_id='goal')[0]] == ['d']
+    assert service.load('c', 'v.mp4') is None
+    # A category created again under the same id starts without the old annotations
+    service.append_operations('c', 'v.mp4', [{'op': 'active', 'activeAnnotations': {}}])
+    assert service.load_processed('c', 'v.mp4') == []
+    assert service.delete_video('c', 'v.mp4') and not service.delete_video('c', 'v.mp4')